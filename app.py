@@ -1,28 +1,127 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash
+from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, abort, has_request_context
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from models import db, User, Subject, Review
+from models import db, User, Subject, Review, ImportJob
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
-from datetime import datetime
-from bs4 import BeautifulSoup
-import requests
-from flask_migrate import Migrate, upgrade  # Added for database migrations
+import click
+import functools
+import hashlib
+from datetime import timedelta
+import json
+import logging
+from sqlalchemy.exc import IntegrityError
+from crawler import Crawler
+from drps_parser import parse_course_page
+from importer import relink_subjects, run_import, sync_subjects
+from jobs import enqueue_import, work
+from snapshot import import_snapshot
+from catalogue import CatalogueCache, catalogue_stamp, Facets, LISTING_COLUMNS, list_subjects
+from autocomplete import Autocomplete
+from ratings import add_ratings, rebuild_rating_aggregates
+from prerequisites import check_plan, prerequisite_chain, prohibited_with, rebuild_closure, unlocks
+from reviews import ReviewRateLimiter, ingest_reviews, list_reviews, review_dict
+from pagecache import PageCache
+from auth import UserCache, is_logged_in
+from db_routing import REPLICA_BIND, engine_options, read_replica, stick_to_primary
+from metrics import Instrumentation
+from leaderboards import Leaderboards, WINDOWS, WINDOW_LABELS
+from search import InvertedIndex, search_subjects
+from schema import upgrade_schema
+from similarity import similar_subjects, similarity_stamp, update_similar_subjects
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Connection pool: size per worker process, extra connections under bursts, and connection health
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 5))
+app.config['DB_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', 10))  # seconds to wait for a connection
+app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))  # seconds before reconnecting
+app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))  # Postgres only; 0 is off
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config)
+# Optional read replica for the read-only routes; a client that just wrote reads from the
+# primary for REPLICA_STICKY_SECONDS so it sees its own changes
+app.config['REPLICA_DATABASE_URL'] = os.getenv('REPLICA_DATABASE_URL', '')
+app.config['REPLICA_STICKY_SECONDS'] = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+if app.config['REPLICA_DATABASE_URL']:
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: {
+        'url': app.config['REPLICA_DATABASE_URL'],
+        **engine_options(app.config['REPLICA_DATABASE_URL'], app.config),
+    }}
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your_secret_key')
 
+# DRPS crawler settings (point DRPS_BASE_URL at a local server to crawl saved pages)
+app.config['DRPS_BASE_URL'] = os.getenv('DRPS_BASE_URL', 'http://www.drps.ed.ac.uk/24-25/dpt/')
+app.config['CRAWLER_MAX_WORKERS'] = int(os.getenv('CRAWLER_MAX_WORKERS', 8))
+app.config['CRAWLER_RATE_LIMIT'] = float(os.getenv('CRAWLER_RATE_LIMIT', 5))  # requests/sec per host
+app.config['CRAWLER_TIMEOUT'] = float(os.getenv('CRAWLER_TIMEOUT', 10))
+app.config['CRAWLER_RETRIES'] = int(os.getenv('CRAWLER_RETRIES', 3))
+# On-disk cache of course pages and their parsed details; an empty directory disables it
+app.config['CRAWLER_CACHE_DIR'] = os.getenv('CRAWLER_CACHE_DIR', os.path.join(app.instance_path, 'drps_cache'))
+app.config['CRAWLER_CACHE_TTL'] = int(os.getenv('CRAWLER_CACHE_TTL', 24 * 60 * 60))  # seconds before revalidating
+# 'lxml' is used when installed, falling back to the pure-Python 'html.parser'
+app.config['DRPS_PARSER_FEATURES'] = os.getenv('DRPS_PARSER_FEATURES', 'lxml')
+app.config['DRPS_PARSER_STRAIN'] = os.getenv('DRPS_PARSER_STRAIN', '1') == '1'
+app.config['IMPORT_BATCH_SIZE'] = int(os.getenv('IMPORT_BATCH_SIZE', 500))  # rows per bulk INSERT
+# How often (seconds) in-memory catalogue structures check whether an import changed the subjects
+app.config['CATALOGUE_CHECK_INTERVAL'] = float(os.getenv('CATALOGUE_CHECK_INTERVAL', 5))
+app.config['SUBJECTS_PER_PAGE'] = int(os.getenv('SUBJECTS_PER_PAGE', 48))  # home page and /subjects
+app.config['SUBJECTS_MAX_PER_PAGE'] = 200  # largest ?limit accepted by /subjects
+app.config['REVIEWS_PER_PAGE'] = int(os.getenv('REVIEWS_PER_PAGE', 20))  # subject page and its reviews JSON
+app.config['REVIEWS_MAX_PER_PAGE'] = 100
+# Similar subjects kept for each subject page, refreshed after every import
+app.config['SIMILAR_SUBJECTS'] = int(os.getenv('SIMILAR_SUBJECTS', 10))
+# Bulk review ingestion: most reviews per POST /reviews/bulk, and each user's sustained reviews/sec per worker
+app.config['REVIEW_BULK_MAX'] = int(os.getenv('REVIEW_BULK_MAX', 1000))
+app.config['REVIEW_RATE_LIMIT'] = float(os.getenv('REVIEW_RATE_LIMIT', 10))
+app.config['REVIEW_BATCH_SIZE'] = int(os.getenv('REVIEW_BATCH_SIZE', 500))  # reviews per INSERT and commit
+# Logged-in users are cached per worker for this long (seconds) instead of loaded on every request
+app.config['USER_CACHE_TTL'] = float(os.getenv('USER_CACHE_TTL', 60))
+app.config['USER_CACHE_SIZE'] = int(os.getenv('USER_CACHE_SIZE', 1024))
+# Rendered-page cache: 'memory' (per worker), 'filesystem' (shared by the workers on a host) or '' (off)
+app.config['PAGE_CACHE_BACKEND'] = os.getenv('PAGE_CACHE_BACKEND', 'memory')
+app.config['PAGE_CACHE_DIR'] = os.getenv('PAGE_CACHE_DIR', os.path.join(app.instance_path, 'page_cache'))
+app.config['PAGE_CACHE_SIZE'] = int(os.getenv('PAGE_CACHE_SIZE', 1024))  # entries, memory backend
+app.config['PAGE_CACHE_TTL'] = float(os.getenv('PAGE_CACHE_TTL', 60))  # seconds
+# Instrumentation: queries slower than this are logged, and Server-Timing headers are optional
+app.config['SLOW_QUERY_THRESHOLD_MS'] = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 500))
+app.config['SERVER_TIMING'] = os.getenv('SERVER_TIMING', '0') == '1'
+# Import workers and CLI commands write their metrics here (node_exporter textfile collector)
+app.config['METRICS_TEXTFILE'] = os.getenv('METRICS_TEXTFILE', '')
+# Feed rankings are rebuilt after this many seconds, or sooner after this many reviews in a worker
+app.config['LEADERBOARD_TTL'] = float(os.getenv('LEADERBOARD_TTL', 60))
+app.config['LEADERBOARD_REFRESH_REVIEWS'] = int(os.getenv('LEADERBOARD_REFRESH_REVIEWS', 20))
+# Pseudo-reviews at the mean rating added to every subject's average in "Highest Rated"
+app.config['LEADERBOARD_PRIOR_WEIGHT'] = float(os.getenv('LEADERBOARD_PRIOR_WEIGHT', 5))
+
 db.init_app(app)
-migrate = Migrate(app, db)  # Enable migrations
+instrumentation = Instrumentation.from_config(app.config)
+instrumentation.init_app(app)
+crawler = Crawler.from_config(app.config, observer=instrumentation.observe_crawler)
+# In-process search index, used when the database is not Postgres (or has no search columns yet)
+search_index = CatalogueCache(InvertedIndex.from_database, app.config['CATALOGUE_CHECK_INTERVAL'])
+# Name/code prefix index answering /search_suggestions from memory
+autocomplete = CatalogueCache(Autocomplete.from_database, app.config['CATALOGUE_CHECK_INTERVAL'])
+# Home page filter values and their counts
+facets = CatalogueCache(Facets.from_database, app.config['CATALOGUE_CHECK_INTERVAL'])
+leaderboards = Leaderboards.from_config(app.config)
+review_limiter = ReviewRateLimiter.from_config(app.config)
+# Pages tagged 'catalogue' are re-rendered whenever an import or sync changes the subjects
+catalogue_version = CatalogueCache(catalogue_stamp, app.config['CATALOGUE_CHECK_INTERVAL'])
+# and pages tagged 'similar' whenever the similar subjects lists are rewritten, by any process
+similar_version = CatalogueCache(similarity_stamp, app.config['CATALOGUE_CHECK_INTERVAL'], stamp=similarity_stamp)
+page_cache = PageCache.from_config(app.config, versions={'catalogue': catalogue_version.get,
+                                                         'similar': similar_version.get})
 
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
+user_cache = UserCache.from_config(app.config)
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.load(int(user_id))
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -42,6 +141,7 @@ def register():
         new_user = User(username=username, email=email, password=password_hash)
         db.session.add(new_user)
         db.session.commit()
+        stick_to_primary(app.config['REPLICA_STICKY_SECONDS'])
 
         return redirect(url_for('login'))  # Redirect to login page after successful registration
 
@@ -67,6 +167,8 @@ def logout():
     return redirect(url_for('login'))
 
 @app.route('/', methods=['GET'])
+@read_replica
+@page_cache.cached(tags=lambda: ['catalogue'])
 def home():
     """Home route displaying all subjects with optional filters."""
     # Get filter values from the query parameters (if any)
@@ -74,50 +176,106 @@ def home():
     filter_credits = request.args.get('filter_credits')
     filter_scqf = request.args.get('filter_scqf')
 
-    # Start with all subjects
-    subjects = Subject.query
-
-    # Apply filtering based on period
-    if filter_period:
-        subjects = subjects.filter(Subject.period == filter_period)
-
-    # Apply filtering based on credits
-    if filter_credits:
-        subjects = subjects.filter(Subject.credits == filter_credits)
+    filters = {'period': filter_period, 'credits': filter_credits, 'scqf': filter_scqf}
 
-    if filter_scqf:
-        subjects = subjects.filter(Subject.scqf == filter_scqf)
-
-    # Fetch the filtered subjects
-    subjects = subjects.all()
-
-    # Fetch unique values for period and credits
-    unique_periods = db.session.query(Subject.period).distinct().all()
-    unique_credits = db.session.query(Subject.credits).distinct().all()
-    unique_scqf = db.session.query(Subject.scqf).distinct().all()
+    # One page of subjects, continuing from the ?after= / ?before= cursor
+    try:
+        subjects, next_cursor, prev_cursor = list_subjects(filters, request.args.get('after'), request.args.get('before'),
+                                                           per_page=app.config['SUBJECTS_PER_PAGE'])
+    except ValueError:
+        return redirect(url_for('home', filter_period=filter_period, filter_credits=filter_credits,
+                                filter_scqf=filter_scqf))
 
-    # Format the unique values as a list of strings
-    unique_periods = [period[0] for period in unique_periods]
-    unique_credits = [credits[0] for credits in unique_credits]
-    unique_scqf = [scqf[0] for scqf in unique_scqf]
+    # Filter values with their subject counts, given the other active filters
+    facet_counts = facets.get().counts(filters)
 
     return render_template('home.html', 
                            subjects=subjects, 
                            filter_period=filter_period, 
                            filter_credits=filter_credits, 
                            filter_scqf=filter_scqf,
-                           unique_periods=unique_periods, 
-                           unique_credits=unique_credits,
-                           unique_scqf=unique_scqf,
-                           logged_in=current_user.is_authenticated,)
+                           unique_periods=facet_counts['period'],
+                           unique_credits=facet_counts['credits'],
+                           unique_scqf=facet_counts['scqf'],
+                           next_cursor=next_cursor,
+                           prev_cursor=prev_cursor,
+                           logged_in=is_logged_in(),)
+
+@app.route('/subjects')
+@read_replica
+def subjects_json():
+    """JSON subject listing with the home page's filters and cursor paging."""
+    filters = {column: request.args.get(f'filter_{column}') for column in ('period', 'credits', 'scqf')}
+    limit = min(request.args.get('limit', app.config['SUBJECTS_PER_PAGE'], type=int), app.config['SUBJECTS_MAX_PER_PAGE'])
+    try:
+        subjects, next_cursor, prev_cursor = list_subjects(filters, request.args.get('after'), request.args.get('before'),
+                                                           per_page=max(limit, 1))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    query_args = {f'filter_{column}': value for column, value in filters.items() if value}
+    return jsonify({
+        "subjects": [{column: getattr(subject, column) for column in LISTING_COLUMNS} for subject in subjects],
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "next_url": url_for('subjects_json', after=next_cursor, limit=limit, **query_args) if next_cursor else None,
+        "prev_url": url_for('subjects_json', before=prev_cursor, limit=limit, **query_args) if prev_cursor else None,
+    })
 
 @app.route('/subject/<int:subject_id>')
+@read_replica
+@page_cache.cached(tags=lambda subject_id: [f'subject:{subject_id}', 'catalogue', 'similar'])
 def subject_page(subject_id):
     """Subject details page with reviews and average rating."""
     subject = Subject.query.get_or_404(subject_id)
-    reviews = Review.query.filter_by(subject_id=subject_id).all()
-    avg_rating = db.session.query(db.func.avg(Review.rating)).filter_by(subject_id=subject_id).scalar() or 0
-    return render_template('subject.html', subject=subject, reviews=reviews, avg_rating=round(avg_rating, 2))
+    # The newest reviews; the page fetches older ones from subject_reviews as the user scrolls
+    reviews, next_cursor = list_reviews(subject_id, per_page=app.config['REVIEWS_PER_PAGE'])
+    next_url = url_for('subject_reviews', subject_id=subject_id, after=next_cursor) if next_cursor else None
+    return render_template('subject.html', subject=subject, reviews=reviews, avg_rating=round(subject.avg_rating, 2),
+                           next_url=next_url, chain=prerequisite_chain(subject.code), unlocks=unlocks(subject.code),
+                           similar=similar_subjects(subject.id))
+
+def linked_course_dict(course):
+    return {'code': course.code, 'depth': course.depth, 'subject_id': course.subject_id, 'name': course.name}
+
+@app.route('/subject/<int:subject_id>/dependencies')
+@read_replica
+def subject_dependencies(subject_id):
+    """JSON prerequisite chain, unlocked courses and prohibited combinations of a subject."""
+    code = db.session.scalar(db.select(Subject.code).where(Subject.id == subject_id))
+    if code is None:
+        abort(404)
+    return jsonify({
+        "code": code,
+        "prerequisites": [linked_course_dict(course) for course in prerequisite_chain(code)],
+        "unlocks": [linked_course_dict(course) for course in unlocks(code)],
+        "prohibited": [linked_course_dict(course) for course in prohibited_with(code)],
+    })
+
+@app.route('/plan/check')
+@read_replica
+def plan_check():
+    """Check ?courses=A,B,C (in the order they will be taken) against ?completed= course codes."""
+    courses = [code.strip().upper() for code in request.args.get('courses', '').split(',') if code.strip()]
+    completed = [code.strip().upper() for code in request.args.get('completed', '').split(',') if code.strip()]
+    if not courses:
+        return jsonify({"error": "'courses' is required."}), 400
+    return jsonify(check_plan(courses, completed))
+
+@app.route('/subject/<int:subject_id>/reviews')
+@read_replica
+def subject_reviews(subject_id):
+    """JSON page of a subject's reviews, newest first, continuing from ?after=."""
+    limit = min(request.args.get('limit', app.config['REVIEWS_PER_PAGE'], type=int), app.config['REVIEWS_MAX_PER_PAGE'])
+    try:
+        reviews, next_cursor = list_reviews(subject_id, request.args.get('after'), per_page=max(limit, 1))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    return jsonify({
+        "reviews": [review_dict(review) for review in reviews],
+        "next_cursor": next_cursor,
+        "next_url": url_for('subject_reviews', subject_id=subject_id, after=next_cursor, limit=limit) if next_cursor else None,
+    })
 
 @app.route('/add_review/<int:subject_id>', methods=['POST'])
 @login_required  # Ensure user is logged in to add a review
@@ -146,458 +304,268 @@ def add_review(subject_id):
         rating=rating,
         comment=comment
     )
+    # The aggregate update goes first: it finds out whether the subject exists, and commits with the review
+    if not add_ratings(subject_id, [rating]):
+        db.session.rollback()
+        abort(404)
     db.session.add(new_review)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "You have already reviewed this subject."}), 400
+    reviews_added([subject_id])
 
     flash("Review added successfully!", "success")
     return redirect(url_for('subject_page', subject_id=subject_id))
 
+@app.route('/reviews/bulk', methods=['POST'])
+@login_required
+def add_reviews_bulk():
+    """Add a JSON list of the logged-in user's reviews, each naming a subject_id or subject_code.
+
+    Reviews are dated when they are added; a 'created_at' in the records is ignored.
+    """
+    records = request.get_json(silent=True)
+    if not isinstance(records, list):
+        return jsonify({"error": "Expected a JSON list of reviews."}), 400
+    if len(records) > app.config['REVIEW_BULK_MAX']:
+        return jsonify({"error": f"At most {app.config['REVIEW_BULK_MAX']} reviews per request."}), 413
+
+    wait = review_limiter.take(current_user.id, len(records))
+    if wait:
+        response = jsonify({"error": "Too many reviews, slow down."})
+        response.headers['Retry-After'] = str(int(wait) + 1)
+        return response, 429
+
+    stats = ingest_reviews(records, user_id=current_user.id, batch_size=app.config['REVIEW_BATCH_SIZE'])
+    reviews_added(stats.subject_ids, stats.inserted)
+    return jsonify(stats.to_dict())
+
+def reviews_added(subject_ids, count=None):
+    """Refresh what new reviews of `subject_ids` change: leaderboards, cached pages and replica reads."""
+    if not subject_ids:
+        return
+    leaderboards.record_reviews(len(subject_ids) if count is None else count)
+    page_cache.invalidate(*(f'subject:{subject_id}' for subject_id in subject_ids), 'feed')
+    if has_request_context():
+        stick_to_primary(app.config['REPLICA_STICKY_SECONDS'])
+
 @app.route('/feed')
+@read_replica
+@page_cache.cached(tags=lambda: ['feed', 'catalogue'])
 def feed():
-    # Most Reviewed Subjects
-    most_reviewed = db.session.query(
-        Subject.id,  # Include subject ID
-        Subject.name,
-        db.func.count(Review.id).label('review_count')
-    ).join(Review).group_by(Subject.id).order_by(db.desc('review_count')).limit(5).all()
-
-    # Highest Rated Subjects
-    highest_rated = db.session.query(
-        Subject.id,  # Include subject ID
-        Subject.name,
-        db.func.avg(Review.rating).label('avg_rating')
-    ).join(Review).group_by(Subject.id).order_by(db.desc('avg_rating')).limit(5).all()
+    # Rankings come from the in-memory leaderboards, refreshed every LEADERBOARD_TTL seconds
+    window = request.args.get('window', 'all')
+    if window not in WINDOWS:
+        window = 'all'
+    rankings = leaderboards.get(window)
 
     return render_template('feed.html', 
-                          most_reviewed=most_reviewed, 
-                          highest_rated=highest_rated, 
-                          logged_in=current_user.is_authenticated)
-
-def extract_subject_details(url):
-    """Fetch and parse course details from the University of Edinburgh DRPS course page."""
-    details = {
-        'title': '',
-        'course_code': '',
-        'school': '',
-        'college': '',
-        'summary': '',
-        'course_description': '',
-        'assessment': '',
-        'learning_outcomes': '',
-        'total_hours': '',
-        'prerequisites': '',
-        'prohibited_combinations': '',
-        'course_organizer': '',
-        'course_url': '',
-        'keywords': '',
-    }
+                          most_reviewed=rankings['most_reviewed'], 
+                          highest_rated=rankings['highest_rated'], 
+                          window=window,
+                          windows=WINDOW_LABELS,
+                          logged_in=is_logged_in())
 
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        # Extract Course Title and Code
-        title_tag = soup.find('h1', class_='sitspagetitle')
-        if title_tag:
-            title_text = title_tag.get_text(strip=True)
-            if '(' in title_text and ')' in title_text:
-                details['title'] = title_text.split('(')[0].strip()
-                details['course_code'] = title_text.split('(')[-1].strip(')')
-
-        # Extract School and College from "Course Outline"
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Course Outline" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        cells = tr.find_all('td')
-                        if len(cells) >= 4:  # Ensure we have both columns
-                            label_1 = cells[0].get_text(strip=True)
-                            value_1 = cells[1].get_text(strip=True)
-                            label_2 = cells[2].get_text(strip=True)
-                            value_2 = cells[3].get_text(strip=True)
-                            
-                            if "School" in label_1:
-                                details['school'] = value_1
-                            if "College" in label_2:
-                                details['college'] = value_2
-
-        # Extract Summary and Course Description
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Course Outline" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        cells = tr.find_all('td')
-                        if len(cells) >= 2:
-                            label = cells[0].get_text(strip=True)
-                            value = cells[1].get_text(" ", strip=True)
-                            if "Summary" in label:
-                                details['summary'] = value
-                            elif "Course description" in label:
-                                details['course_description'] = value
-
-        # Extract Prerequisites (Fixing the issue)
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Entry Requirements" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        cells = tr.find_all('td')
-                        if len(cells) >= 2:
-                            label = cells[0].get_text(strip=True)
-                            if "Pre-requisites" in label:
-                                prereq_links = []
-                                for link in cells[1].find_all('a'):
-                                    prereq_links.append(f"{link.get_text(strip=True)}")
-                                details['prerequisites'] = "; ".join(prereq_links)
-
-                            if "Prohibited Combinations" in label:
-                                prohibited_links = []
-                                for link in cells[1].find_all('a'):
-                                    prohibited_links.append(f"{link.get_text(strip=True)}")
-                                details['prohibited_combinations'] = "; ".join(prohibited_links)
-
-        # Extract Learning Outcomes
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Learning Outcomes" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    outcome_list = table.find('ol')
-                    if outcome_list:
-                        details['learning_outcomes'] = " ".join(li.get_text(strip=True) for li in outcome_list.find_all('li'))
-
-        # Extract Assessment Details
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Assessment" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    assessment_data = table.find('td', colspan="14")
-                    if assessment_data:
-                        details['assessment'] = assessment_data.get_text(" ", strip=True)
-
-        # Extract Total Learning Hours
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Course Delivery Information" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        if "Total Hours" in tr.get_text():
-                            details['total_hours'] = tr.find_all('td')[1].get_text(strip=True)
-
-        # Extract Course URL
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Additional Information" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        cells = tr.find_all('td')
-                        if len(cells) >= 2:
-                            label = cells[0].get_text(strip=True)
-                            value = cells[1].get_text(strip=True)
-                            if "Course URL" in label:
-                                details['course_url'] = value
-
-        # Extract Keywords
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Additional Information" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        cells = tr.find_all('td')
-                        if len(cells) >= 2:
-                            label = cells[0].get_text(strip=True)
-                            value = cells[1].get_text(strip=True)
-                            if "Keywords" in label:
-                                details['keywords'] = value
-
-        # Extract Course Organizer
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Contacts" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        cells = tr.find_all('td')
-                        if len(cells) >= 2:
-                            label = cells[0].get_text(strip=True)
-                            value = cells[1].get_text(strip=True)
-                            if "Course organiser" in label:
-                                details['course_organizer'] = value.split("Tel:")[0].strip()
-
-        return details
-
-    except requests.RequestException as e:
-        print(f"Error fetching URL {url}: {e}")
-        return details
-
-    """Fetch and parse course details from the University of Edinburgh DRPS course page."""
-    details = {
-        'title': '',
-        'course_code': '',
-        'school': '',
-        'college': '',
-        'summary': '',
-        'course_description': '',
-        'assessment': '',
-        'learning_outcomes': '',
-        'total_hours': '',
-        'prerequisites': '',
-        'prohibited_combinations': '',
-        'course_organizer': '',
-        'course_url': '',
-        'keywords': '',
-    }
+def parse_subject_details(content):
+    """Parse course details out of a DRPS course page with the configured parser backend."""
+    return parse_course_page(content, features=app.config['DRPS_PARSER_FEATURES'],
+                             strain=app.config['DRPS_PARSER_STRAIN'])
+
+
+def run_subject_import(content, stats=None, on_progress=None, update=False):
+    """Parse a listing upload, crawl its course pages and save the subjects."""
+    stats = run_import(content, crawler, app.config['DRPS_BASE_URL'], parse=parse_subject_details,
+                       stats=stats, on_progress=on_progress, update=update,
+                       batch_size=app.config['IMPORT_BATCH_SIZE'])
+    refresh_similar_subjects()
+    return stats
+
+def refresh_similar_subjects(full=False):
+    """Recompute the similar subjects lists affected by changes to the subjects' text.
+
+    Cached subject pages notice through the 'similar' tag's version, read from the database.
+    """
+    return update_similar_subjects(app.config['SIMILAR_SUBJECTS'], full=full)
 
-    try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an error for bad responses
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        # Extract Course Title and Code
-        title_tag = soup.find('h1', class_='sitspagetitle')
-        if title_tag:
-            title_text = title_tag.get_text(strip=True)
-            if '(' in title_text and ')' in title_text:
-                details['title'] = title_text.split('(')[0].strip()
-                details['course_code'] = title_text.split('(')[-1].strip(')')
-
-        # Extract School and College
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Course Outline" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        cells = tr.find_all('td')
-                        if len(cells) >= 2:
-                            label = cells[0].get_text(strip=True)
-                            value = cells[1].get_text(strip=True)
-                            if "School" in label:
-                                details['school'] = value
-                            elif "College" in label:
-                                details['college'] = value
-
-        # Extract Summary and Course Description
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Course Outline" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        cells = tr.find_all('td')
-                        if len(cells) >= 2:
-                            label = cells[0].get_text(strip=True)
-                            value = cells[1].get_text(" ", strip=True)
-                            if "Summary" in label:
-                                details['summary'] = value
-                            elif "Course description" in label:
-                                details['course_description'] = value
-
-        # Extract Prerequisites and Prohibited Combinations
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Entry Requirements" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        cells = tr.find_all('td')
-                        if len(cells) >= 2:
-                            label = cells[0].get_text(strip=True)
-                            value = cells[1].get_text(" ", strip=True)
-                            if "Pre-requisites" in label:
-                                details['prerequisites'] = value
-                            elif "Prohibited Combinations" in label:
-                                details['prohibited_combinations'] = value
-
-        # Extract Learning Outcomes
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Learning Outcomes" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    outcome_list = table.find('ol')
-                    if outcome_list:
-                        details['learning_outcomes'] = " ".join(li.get_text(strip=True) for li in outcome_list.find_all('li'))
-
-        # Extract Assessment Details
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Assessment" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    assessment_data = table.find('td', colspan="14")
-                    if assessment_data:
-                        details['assessment'] = assessment_data.get_text(" ", strip=True)
-
-        # Extract Total Learning Hours
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Course Delivery Information" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        if "Total Hours" in tr.get_text():
-                            details['total_hours'] = tr.find_all('td')[1].get_text(strip=True)
-
-        # Extract Course URL
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Additional Information" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        cells = tr.find_all('td')
-                        if len(cells) >= 2:
-                            label = cells[0].get_text(strip=True)
-                            value = cells[1].get_text(strip=True)
-                            if "Course URL" in label:
-                                details['course_url'] = value
-
-        # Extract Keywords
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Additional Information" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        cells = tr.find_all('td')
-                        if len(cells) >= 2:
-                            label = cells[0].get_text(strip=True)
-                            value = cells[1].get_text(strip=True)
-                            if "Keywords" in label:
-                                details['keywords'] = value
-
-        # Extract Course Organizer
-        for row in soup.select('table.sitstablegrid caption'):
-            if "Contacts" in row.get_text():
-                table = row.find_parent('table')
-                if table:
-                    rows = table.find_all('tr')
-                    for tr in rows:
-                        cells = tr.find_all('td')
-                        if len(cells) >= 2:
-                            label = cells[0].get_text(strip=True)
-                            value = cells[1].get_text(strip=True)
-                            if "Course organiser" in label:
-                                details['course_organizer'] = value.split("Tel:")[0].strip()
-
-        return details
-
-    except requests.RequestException as e:
-        print(f"Error fetching URL {url}: {e}")
-        return details
-
-    
 @app.route('/add_subjects_from_html', methods=['POST'])
 def add_subjects_from_html():
-    """Extract subjects from the uploaded HTML file and add them to the database."""
+    """Queue the uploaded HTML listing for import by a background worker."""
     uploaded_file = request.files['file']
     if not uploaded_file:
         return jsonify({"error": "No file uploaded."}), 400
 
-    soup = BeautifulSoup(uploaded_file.read(), 'html.parser')
-    subjects_to_add = []
-
-    # Find all SCQF level sections
-    scqf_levels = soup.find_all('h3', class_='scqf_level')
-
-    for scqf_level in scqf_levels:
-        scqf_text = scqf_level.get_text(strip=True)
-        scqf = scqf_text.split('(')[0].replace('SCQF Level', '').strip()  # Extract SCQF level number
-        
-        # Find the table following the SCQF level heading
-        table = scqf_level.find_next('table')
-        rows = table.find_all('tr')
-
-        # Process each row in the table (skip the header row)
-        for row in rows[1:]:
-            columns = row.find_all('td')
-            
-            if len(columns) >= 5:
-                code = columns[0].get_text(strip=True)
-                availability = columns[1].get_text(strip=True)
-                name = columns[2].get_text(strip=True)
-                period = columns[3].get_text(strip=True)
-                credits = columns[4].get_text(strip=True)
-
-                try:
-                    credits = int(credits)
-                    # Construct the URL for the individual course page
-                    course_url = f"http://www.drps.ed.ac.uk/24-25/dpt/cx{code.lower()}.htm"
-                    # Fetch additional details from the individual course page
-                    details = extract_subject_details(course_url)
-
-                    subjects_to_add.append({
-                        "name": name,
-                        "code": code,
-                        "period": period,
-                        "credits": credits,
-                        "scqf": scqf,
-                        "availability": availability,
-                        "school": details.get('school', ''),
-                        "college": details.get('college', ''),
-                        "summary": details.get('summary', ''),
-                        "assessment": details.get('assessment', ''),
-                        "learning_outcomes": details.get('learning_outcomes', ''),
-                        "total_hours": details.get('total_hours', ''),
-                        "prerequisites": details.get('prerequisites', ''),
-                        "prohibited_combinations": details.get('prohibited_combinations', ''),
-                        "additional_costs": details.get('additional_costs', ''),
-                        "course_organizer": details.get('course_organizer', ''),
-                        "url": course_url
-                    })
-                except ValueError:
-                    # Skip if credits cannot be converted to an integer
-                    continue
-
-    # Add subjects to the database
-    for subject in subjects_to_add:
-        existing_subject = Subject.query.filter_by(code=subject["code"]).first()
-        if not existing_subject:
-            new_subject = Subject(
-                name=subject["name"],
-                code=subject["code"],
-                period=subject["period"],
-                credits=subject["credits"],
-                scqf=subject["scqf"],
-                availability=subject["availability"],
-                school=subject["school"],
-                college=subject["college"],
-                summary=subject["summary"],
-                assessment=subject["assessment"],
-                learning_outcomes=subject["learning_outcomes"],
-                total_hours=subject["total_hours"],
-                prerequisites=subject["prerequisites"],
-                prohibited_combinations=subject["prohibited_combinations"],
-                additional_costs=subject["additional_costs"],
-                course_organizer=subject["course_organizer"],
-                url=subject["url"],
-                created_at=datetime.now()
-            )
-            db.session.add(new_subject)
-
-    db.session.commit()
-    return jsonify({"message": f"{len(subjects_to_add)} subjects added successfully!"})
+    # With update_existing set, subjects already in the database are rewritten when their data changed
+    update_existing = request.form.get('update_existing', '').lower() in ('1', 'true', 'on')
+    job = enqueue_import(uploaded_file.read(), uploaded_file.filename, update_existing)
+    return jsonify({
+        "message": "Import queued.",
+        "job_id": job.id,
+        "status_url": url_for('import_job_status', job_id=job.id),
+    }), 202
+
+@app.route('/import_jobs/<int:job_id>')
+def import_job_status(job_id):
+    """Report the progress of a subject import job."""
+    job = ImportJob.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics of this worker process."""
+    return instrumentation.registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+def write_metrics_textfile():
+    if app.config['METRICS_TEXTFILE']:
+        instrumentation.registry.write_textfile(app.config['METRICS_TEXTFILE'])
+
+@app.cli.command('import-worker')
+@click.option('--poll-interval', default=2.0, help='Seconds to wait between polls of an empty queue.')
+@click.option('--once', is_flag=True, help='Exit once the queue is empty.')
+def import_worker(poll_interval, once):
+    """Run queued subject imports."""
+    # Job start and finish are logged at INFO; a handler the deployment configured takes precedence
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    work(run_subject_import, poll_interval=poll_interval, once=once, on_job_done=write_metrics_textfile)
+
+@app.cli.command('sync-subjects')
+@click.option('--max-age-hours', default=24.0, help='Re-fetch subjects last fetched longer ago than this.')
+@click.option('--limit', type=int, default=None, help='Check at most this many subjects, oldest first.')
+@click.option('--dry-run', is_flag=True, help='Report what would change without writing anything.')
+def sync_subjects_command(max_age_hours, limit, dry_run):
+    """Refresh existing subjects whose course page changed since they were last fetched."""
+    report = sync_subjects(crawler, parse=parse_subject_details, max_age=timedelta(hours=max_age_hours),
+                           dry_run=dry_run, limit=limit, batch_size=app.config['IMPORT_BATCH_SIZE'])
+    for diff in report['diffs']:
+        click.echo(diff['code'])
+        for column, change in diff['changes'].items():
+            click.echo(f"  {column}: {change['old']!r:.60} -> {change['new']!r:.60}")
+    prefix = "Would update" if dry_run else "Updated"
+    click.echo(f"Checked {report['checked']}: {prefix} {report['changed']}, "
+               f"{report['unchanged']} unchanged, {report['failed']} failed.")
+    if report['changed'] and not dry_run:
+        refresh_similar_subjects()
+    write_metrics_textfile()
+
+@app.cli.command('rebuild-rating-aggregates')
+@click.option('--dry-run', is_flag=True, help='Report subjects with wrong aggregates without fixing them.')
+def rebuild_rating_aggregates_command(dry_run):
+    """Recompute the review counts, rating sums and histograms stored on subjects."""
+    repaired = rebuild_rating_aggregates(dry_run=dry_run)
+    prefix = "Would repair" if dry_run else "Repaired"
+    click.echo(f"{prefix} {len(repaired)} subjects.")
+
+@app.cli.command('import-reviews')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', type=int, default=None, help='Reviews per INSERT and commit (default REVIEW_BATCH_SIZE).')
+def import_reviews_command(path, batch_size):
+    """Load reviews from a JSON list or JSON Lines file.
+
+    Each review names its user (user_id or username) and subject (subject_id or subject_code),
+    with a rating, an optional comment and an optional ISO created_at (not in the future).
+    """
+    with open(path, encoding='utf-8') as f:
+        first = f.read(1)
+        f.seek(0)
+        records = json.load(f) if first == '[' else (json.loads(line) for line in f if line.strip())
+
+        def progress(stats):
+            click.echo(f"  {stats.received} read, {stats.inserted} inserted ({stats.reviews_per_sec:.0f} reviews/sec)")
+
+        stats = ingest_reviews(records, batch_size=batch_size or app.config['REVIEW_BATCH_SIZE'], on_batch=progress,
+                               keep_created_at=True)
+    reviews_added(stats.subject_ids, stats.inserted)
+    for index, message in stats.errors[:20]:
+        click.echo(f"  record {index}: {message}")
+    click.echo(f"Inserted {stats.inserted} reviews ({stats.duplicates} duplicates, {len(stats.errors)} invalid) "
+               f"in {stats.elapsed:.1f}s: {stats.reviews_per_sec:.0f} reviews/sec.")
+
+@app.cli.command('import-snapshot')
+@click.argument('path', type=click.Path(exists=True))
+@click.option('--workers', type=int, default=None, help='Parser processes (default: one per CPU).')
+@click.option('--batch-size', type=int, default=None, help='Pages per parse batch and commit (default IMPORT_BATCH_SIZE).')
+@click.option('--update', is_flag=True, help='Rewrite subjects already in the database when their data changed.')
+@click.option('--checkpoint', type=click.Path(dir_okay=False), default=None,
+              help='Progress file (default: one per snapshot in the instance folder).')
+@click.option('--restart', is_flag=True, help='Ignore any checkpoint and import the whole snapshot again.')
+def import_snapshot_command(path, workers, batch_size, update, checkpoint, restart):
+    """Import subjects from a directory, tar or zip of saved DRPS listing and cx<code>.htm course pages."""
+    if checkpoint is None:
+        os.makedirs(app.instance_path, exist_ok=True)
+        name = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+        checkpoint = os.path.join(app.instance_path, f'snapshot-{name}.checkpoint.json')
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    elif os.path.exists(checkpoint):
+        click.echo(f"Resuming from {checkpoint} (if it is for this snapshot as it is now).")
+
+    def progress(stats):
+        click.echo(f"  {stats.pages_parsed}/{stats.pages_total} pages: {stats.subjects_inserted} inserted, "
+                   f"{stats.subjects_updated} updated")
+
+    # A partial of the module-level parser, so it can be sent to the worker processes
+    parse = functools.partial(parse_course_page, features=app.config['DRPS_PARSER_FEATURES'],
+                              strain=app.config['DRPS_PARSER_STRAIN'])
+    stats = import_snapshot(path, checkpoint, parse=parse, base_url=app.config['DRPS_BASE_URL'], workers=workers,
+                            batch_size=batch_size or app.config['IMPORT_BATCH_SIZE'], update=update,
+                            on_batch=progress)
+    click.echo(f"{stats.pages_total} listed, {stats.pages_parsed} pages parsed, {stats.pages_failed} missing or unreadable: "
+               f"{stats.subjects_inserted} inserted, {stats.subjects_updated} updated, "
+               f"{stats.subjects_unchanged} unchanged.")
+    click.echo(f"Similar subjects updated for {refresh_similar_subjects()} subjects.")
+    write_metrics_textfile()
+
+@app.cli.command('rebuild-similar-subjects')
+@click.option('--full', is_flag=True, help='Rescore every subject, not just those whose text changed.')
+def rebuild_similar_subjects_command(full):
+    """Recompute the similar subjects shown on subject pages."""
+    click.echo(f"Similar subjects updated for {refresh_similar_subjects(full=full)} subjects.")
+
+@app.cli.command('rebuild-prerequisites')
+@click.option('--relink', is_flag=True, help='Re-read every course page for its links first (uses the crawl cache).')
+def rebuild_prerequisites_command(relink):
+    """Recompute the precomputed prerequisite chains from the stored course links."""
+    if relink:
+        click.echo(f"Links changed for {relink_subjects(crawler, parse=parse_subject_details)} subjects.")
+    click.echo(f"{rebuild_closure()} prerequisite chain entries.")
+
+@app.cli.command('upgrade-schema')
+def upgrade_schema_command():
+    """Bring the database up to the current models; run on every deploy (see README)."""
+    changes = upgrade_schema()
+    for change in changes:
+        click.echo(change)
+    if not changes:
+        click.echo("The schema is up to date.")
 
 @app.route('/search_suggestions')
+@read_replica
 def search_suggestions():
     query = request.args.get('q', '')
     if query:
-        subjects = Subject.query.filter(Subject.name.ilike(f'%{query}%')).limit(10).all()
-        suggestions = [{'id': subject.id, 'name': subject.name} for subject in subjects]
+        # Names and codes come from memory; full-text search only runs when none match
+        subjects = autocomplete.get().complete(query, limit=10) or search_subjects(query, search_index, limit=10)
+        suggestions = [{'id': subject_id, 'name': name, 'code': code} for subject_id, name, code in subjects]
         return jsonify(suggestions)
     return jsonify([])
 
+@app.cli.command('autocomplete-stats')
+def autocomplete_stats_command():
+    """Report the size of the in-memory autocomplete index (held once per web worker)."""
+    stats = autocomplete.get().stats()
+    click.echo(f"{stats['subjects']} subjects, {stats['keys']} keys, {stats['bytes'] / 1024:.0f} KiB per worker")
+
+def warm_caches():
+    """Build the in-memory catalogue structures so the first requests don't pay for it."""
+    with app.app_context():
+        facets.get()
+        return autocomplete.get().stats()
+
 if __name__ == '__main__':
     if not os.path.exists('templates'):
         os.makedirs('templates')
     with app.app_context():
-        db.create_all()
+        upgrade_schema()
 
     app.run(debug=True)
@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import session
+from flask_login import UserMixin
+from sqlalchemy import event
+
+from models import db, User
+
+
+class AuthUser(UserMixin):
+    """The logged-in user as seen by Flask-Login: just the columns requests need, no password or email."""
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    def __repr__(self):
+        return f'<AuthUser {self.username}>'
+
+
+class UserCache:
+    """Per-process LRU of AuthUsers for the Flask-Login user loader.
+
+    Entries expire after `ttl` seconds; changes to a User made in this process evict it at
+    once, changes made by other workers are seen within `ttl`.
+    """
+
+    def __init__(self, ttl=60.0, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        event.listen(User, 'after_insert', self._on_change)  # SQLite can reuse a deleted user's id
+        event.listen(User, 'after_update', self._on_change)
+        event.listen(User, 'after_delete', self._on_change)
+
+    def load(self, user_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and now - entry[1] < self.ttl:
+                self.entries.move_to_end(user_id)
+                return entry[0]
+
+        row = db.session.execute(db.select(User.id, User.username).where(User.id == user_id)).first()
+        user = AuthUser(*row) if row else None
+        with self.lock:
+            self.entries[user_id] = (user, now)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def _on_change(self, mapper, connection, user):
+        self.invalidate(user.id)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(ttl=config['USER_CACHE_TTL'], max_entries=config['USER_CACHE_SIZE'])
+
+
+def session_user_id():
+    """The logged-in user's id straight from the session cookie, without loading the user."""
+    user_id = session.get('_user_id')
+    return int(user_id) if user_id is not None else None
+
+
+def is_logged_in():
+    return session_user_id() is not None
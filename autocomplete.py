@@ -0,0 +1,77 @@
+import sys
+from array import array
+from bisect import bisect_left
+
+from models import db, Subject
+
+# Kinds of completion key, in the order their matches are suggested
+NAME_START, CODE, NAME_WORD = 0, 1, 2
+
+
+def normalize(text):
+    return ' '.join(text.lower().split()) if text else ''
+
+
+class Autocomplete:
+    """Sorted-array prefix index over subject names and codes.
+
+    Each subject is indexed under its full name, its code and every later word of its name
+    ("learning" finds "Machine Learning"). Keys of each kind live in one sorted list with a
+    parallel array of subject positions, so a lookup is a bisect plus a short forward scan.
+    """
+
+    def __init__(self, rows):
+        self.ids = array('i')
+        self.names = []
+        self.codes = []
+        entries = ([], [], [])
+        for position, row in enumerate(rows):
+            self.ids.append(row.id)
+            self.names.append(row.name)
+            self.codes.append(row.code)
+            name = normalize(row.name)
+            entries[NAME_START].append((name, position))
+            entries[CODE].append((normalize(row.code), position))
+            words = name.split(' ')
+            for i in range(1, len(words)):
+                entries[NAME_WORD].append((' '.join(words[i:]), position))
+
+        self.keys = []
+        self.positions = []
+        for kind_entries in entries:
+            kind_entries.sort()
+            self.keys.append([key for key, _ in kind_entries])
+            self.positions.append(array('i', [position for _, position in kind_entries]))
+
+    @classmethod
+    def from_database(cls):
+        return cls(db.session.execute(db.select(Subject.id, Subject.name, Subject.code).order_by(Subject.id)))
+
+    def complete(self, query, limit=10):
+        """Up to `limit` subjects as (id, name, code): names starting with the query first, then codes,
+        then names with a later word starting with it, each alphabetically."""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        seen = set()
+        results = []
+        for kind in (NAME_START, CODE, NAME_WORD):
+            keys = self.keys[kind]
+            i = bisect_left(keys, prefix)
+            while i < len(keys) and keys[i].startswith(prefix):
+                position = self.positions[kind][i]
+                if position not in seen:
+                    seen.add(position)
+                    results.append((self.ids[position], self.names[position], self.codes[position]))
+                    if len(results) == limit:
+                        return results
+                i += 1
+        return results
+
+    def stats(self):
+        """Entry count and approximate memory footprint in bytes (for sizing gunicorn workers)."""
+        size = sys.getsizeof(self.ids) + sys.getsizeof(self.names) + sys.getsizeof(self.codes)
+        size += sum(sys.getsizeof(text) for text in self.names) + sum(sys.getsizeof(text) for text in self.codes)
+        for keys, positions in zip(self.keys, self.positions):
+            size += sys.getsizeof(keys) + sum(sys.getsizeof(key) for key in keys) + sys.getsizeof(positions)
+        return {'subjects': len(self.ids), 'keys': sum(len(keys) for keys in self.keys), 'bytes': size}
@@ -0,0 +1,8 @@
+import itertools
+
+
+def chunks(items, size):
+    """Lists of up to `size` items from any iterable, generators included."""
+    items = iter(items)
+    while batch := list(itertools.islice(items, size)):
+        yield batch
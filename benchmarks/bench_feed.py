@@ -0,0 +1,61 @@
+"""Feed benchmark: /feed requests/sec with the cached leaderboards against the original queries.
+
+Usage: python benchmarks/bench_feed.py [reviews] [database_url]
+
+Seeds 5000 subjects and `reviews` reviews (100000 by default) spread over 90 days, then
+serves /feed through the test client for a few seconds per variant.
+"""
+import sys
+import time
+
+from common import load_app, seed_reviews, seed_subjects, timed
+
+
+def requests_per_second(client, path, seconds=3.0):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        assert client.get(path).status_code == 200
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    app, db = load_app(sys.argv[2] if len(sys.argv) > 2 else None)
+    from flask import render_template
+    from leaderboards import build_leaderboards
+    from models import Review, Subject
+    from ratings import rebuild_rating_aggregates
+
+    with app.app_context():
+        seed_subjects(db, 5000)
+        seed_ms, _ = timed(seed_reviews, db, count)
+        rebuild_rating_aggregates()
+        print(f"5000 subjects, {count} reviews (seeded in {seed_ms / 1000:.1f}s, "
+              f"{db.session.get_bind().dialect.name})")
+
+    def legacy_feed():
+        # The original per-request aggregations over the whole Review table
+        most_reviewed = db.session.query(
+            Subject.id, Subject.name, db.func.count(Review.id).label('review_count')
+        ).join(Review).group_by(Subject.id).order_by(db.desc('review_count')).limit(5).all()
+        highest_rated = db.session.query(
+            Subject.id, Subject.name, db.func.avg(Review.rating).label('avg_rating')
+        ).join(Review).group_by(Subject.id).order_by(db.desc('avg_rating')).limit(5).all()
+        return render_template('feed.html', most_reviewed=most_reviewed, highest_rated=highest_rated,
+                               window='all', windows={}, logged_in=False)
+
+    app.add_url_rule('/legacy_feed', 'legacy_feed', legacy_feed)
+    client = app.test_client()
+
+    with app.app_context():
+        build_ms, _ = timed(build_leaderboards)
+    print(f"leaderboard rebuild (all windows): {build_ms:.0f}ms")
+    print(f"legacy /feed:  {requests_per_second(client, '/legacy_feed'):8.1f} req/s")
+    for window in ('all', '7d', '30d'):
+        print(f"/feed?window={window:<4} {requests_per_second(client, f'/feed?window={window}'):8.1f} req/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Filtered listing benchmark: home page filter queries on text columns against typed, indexed ones.
+
+Usage: python benchmarks/bench_filters.py [--scales 10000,100000] [--requests 200] [--database-url URL]
+
+For each scale, seeds N subjects into a subject table shaped as it was before (credits and
+scqf as text, no filter index) and times filtered listing pages with the original query:
+first pages and pages deep into the filtered listing, for each combination of filters the
+home page offers. Then converts that table with migrate_filter_columns (timed too) and times
+the same pages against integer values. Both must return the same subjects, as must
+list_subjects.
+"""
+import argparse
+import random
+
+from common import load_app, subject_rows, summarize, timed
+
+# Filter combinations, as the home page's selects build them up
+COMBINATIONS = [('scqf',), ('credits',), ('period',), ('scqf', 'credits'), ('scqf', 'credits', 'period')]
+PER_PAGE = 48
+
+
+def legacy_table(db, Subject):
+    """The subject table as it was: credits and scqf as text, and no filter index."""
+    table = Subject.__table__.to_metadata(db.MetaData())
+    table.c.credits.type = db.String(50)
+    table.c.scqf.type = db.String(50)
+    for index in list(table.indexes):
+        if index.name == 'ix_subject_scqf_credits_period_name_id':
+            table.indexes.discard(index)
+    return table
+
+
+def listing_page(db, table, filters, after=None):
+    # list_subjects' query: equality on each filter, keyset ordered by (name, id)
+    query = db.select(table.c.id, table.c.name, table.c.code, table.c.period, table.c.credits, table.c.scqf)
+    for column, value in filters.items():
+        query = query.where(table.c[column] == value)
+    if after:
+        query = query.where(db.tuple_(table.c.name, table.c.id) > db.tuple_(*after))
+    return [row.id for row in db.session.execute(query.order_by(table.c.name, table.c.id).limit(PER_PAGE + 1))]
+
+
+def run_scale(app, db, scale, count):
+    from catalogue import list_subjects, migrate_filter_columns, typed_filters
+    from models import Subject
+    from paging import encode_cursor
+
+    rng = random.Random(scale)
+    rows = list(subject_rows(scale))
+    with app.app_context():
+        db.drop_all()
+        table = legacy_table(db, Subject)
+        table.create(db.engine)
+        db.metadata.create_all(db.engine, tables=[t for t in db.metadata.sorted_tables if t is not Subject.__table__])
+        for i in range(0, len(rows), 1000):
+            db.session.execute(db.insert(table).values([
+                dict(row, credits=str(row['credits']), scqf=str(row['scqf'])) for row in rows[i:i + 1000]
+            ]))
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+        dialect = db.session.get_bind().dialect.name
+        positions = db.session.execute(db.select(table.c.id, table.c.name)).all()
+    print(f"\n== {scale} subjects ({dialect})")
+
+    # The same requests before and after: a combination's values from a random subject, half of
+    # them deep pages starting at a random subject's position
+    requests = []
+    for _ in range(count):
+        row = rng.choice(rows)
+        combination = rng.choice(COMBINATIONS)
+        position = rng.choice(positions) if rng.random() < 0.5 else None
+        requests.append((combination, {column: str(row[column]) for column in combination}, position))
+
+    def run(page):
+        samples = {combination: [] for combination in COMBINATIONS}
+        pages = []
+        with app.app_context():
+            for combination, filters, position in requests:
+                ms, ids = timed(page, filters, position)
+                samples[combination].append(ms)
+                pages.append(ids)
+        for combination in COMBINATIONS:
+            summarize('  ' + '+'.join(combination), samples[combination])
+        summarize('  all', [ms for combination in COMBINATIONS for ms in samples[combination]])
+        return pages
+
+    def position_of(position):
+        return (position.name, position.id) if position else None
+
+    print("text columns, no filter index:")
+    before = run(lambda filters, position: listing_page(db, table, filters, position_of(position)))
+
+    with app.app_context():
+        ms, converted = timed(migrate_filter_columns)
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+    print(f"migrate_filter_columns: {converted} subjects in {ms:.0f}ms")
+
+    print("integer columns, filter index:")
+    after = run(lambda filters, position: listing_page(db, Subject.__table__, typed_filters(filters),
+                                                       position_of(position)))
+    if before != after:
+        print("  MISMATCH: the migrated table returned different pages")
+
+    # The pages the app serves, through list_subjects (which drops the lookahead row)
+    with app.app_context():
+        for (_, filters, position), ids in zip(requests, after):
+            cursor = encode_cursor(*position_of(position)) if position else None
+            subjects, next_cursor, _ = list_subjects(filters, cursor, per_page=PER_PAGE)
+            if [subject.id for subject in subjects] != ids[:PER_PAGE] or bool(next_cursor) != (len(ids) > PER_PAGE):
+                print(f"  MISMATCH: list_subjects returned a different page for {filters}")
+                break
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scales', default='10000,100000', help='Comma-separated subject counts.')
+    parser.add_argument('--requests', type=int, default=200, help='Listing pages timed per scale and variant.')
+    parser.add_argument('--database-url', default=None, help='Database to run against (default: a throwaway SQLite file).')
+    args = parser.parse_args()
+
+    app, db = load_app(args.database_url)
+    for scale in (int(scale) for scale in args.scales.split(',')):
+        run_scale(app, db, scale, args.requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Listing parser benchmark: peak memory and rows/sec of the streaming parser against the tree parser.
+
+Usage: python benchmarks/bench_listing.py [--sizes 1000,10000,50000] [--repeat 3]
+
+Writes a synthetic DRPS listing of each size to a temporary file, then parses it with the
+original BeautifulSoup parser (the whole upload read into memory and built into a tree) and
+with importer.iter_listing (streamed from the file). Peak memory is the largest Python
+allocation total seen by tracemalloc during the parse; both parsers must return the same rows.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from common import subject_rows
+from mock_drps import listing_page
+from importer import iter_listing
+
+
+# The listing parser as it was before iter_listing, kept as the baseline
+def legacy_parse_listing(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    listing = []
+    for scqf_level in soup.find_all('h3', class_='scqf_level'):
+        scqf = scqf_level.get_text(strip=True).split('(')[0].replace('SCQF Level', '').strip()
+        table = scqf_level.find_next('table')
+        for row in table.find_all('tr')[1:]:
+            columns = row.find_all('td')
+            if len(columns) >= 5:
+                try:
+                    credits = int(columns[4].get_text(strip=True))
+                except ValueError:
+                    continue
+                listing.append({
+                    "name": columns[2].get_text(strip=True),
+                    "code": columns[0].get_text(strip=True),
+                    "period": columns[3].get_text(strip=True),
+                    "credits": credits,
+                    "scqf": scqf,
+                    "availability": columns[1].get_text(strip=True),
+                })
+    return listing
+
+
+def legacy(path):
+    with open(path, 'rb') as f:
+        return len(legacy_parse_listing(f.read()))
+
+
+def streaming(path):
+    with open(path, 'rb') as f:
+        # Rows are consumed one at a time, the way run_import hands them to the crawler
+        return sum(1 for _ in iter_listing(f))
+
+
+def measure(parse, path, repeat):
+    """Best time over `repeat` runs, then peak traced memory of one more run; returns the row count too."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = parse(path)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    parse(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1000,10000,50000', help='Comma-separated listing sizes (rows).')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per parser; the best is reported.')
+    args = parser.parse_args()
+
+    for size in (int(size) for size in args.sizes.split(',')):
+        fd, path = tempfile.mkstemp(suffix='.html')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(listing_page(list(subject_rows(size))))
+        print(f"\n== {size} rows ({os.path.getsize(path) / 2**20:.1f} MiB listing)")
+
+        for label, parse in [('tree (html.parser)', legacy), ('streaming', streaming)]:
+            seconds, peak, rows = measure(parse, path, args.repeat)
+            print(f"{label:<20} {rows / seconds:10.0f} rows/s  {seconds * 1000:8.1f}ms  peak {peak / 2**20:7.1f} MiB")
+
+        with open(path, 'rb') as f:
+            expected = legacy_parse_listing(f.read())
+        with open(path, 'rb') as f:
+            if list(iter_listing(f)) != expected:
+                print("  MISMATCH: the streaming parser returned different rows")
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
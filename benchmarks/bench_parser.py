@@ -0,0 +1,222 @@
+"""Microbenchmark for the DRPS course page parser.
+
+Usage: python benchmarks/bench_parser.py <directory of saved course pages> [repeat]
+
+Compares the original caption-rescanning parser against drps_parser with each
+backend, reporting pages/sec and any pages whose parsed details differ.
+"""
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from drps_parser import HAS_LXML, parse_course_page  # noqa: E402
+
+
+# The parser as it was before drps_parser, kept as the baseline
+def legacy_parse(content):
+    """Original parser: re-selects the captions and re-walks the rows for every field."""
+    details = {
+        'title': '',
+        'course_code': '',
+        'school': '',
+        'college': '',
+        'summary': '',
+        'course_description': '',
+        'assessment': '',
+        'learning_outcomes': '',
+        'total_hours': '',
+        'prerequisites': '',
+        'prohibited_combinations': '',
+        'course_organizer': '',
+        'course_url': '',
+        'keywords': '',
+    }
+
+    soup = BeautifulSoup(content, 'html.parser')
+
+    # Extract Course Title and Code
+    title_tag = soup.find('h1', class_='sitspagetitle')
+    if title_tag:
+        title_text = title_tag.get_text(strip=True)
+        if '(' in title_text and ')' in title_text:
+            details['title'] = title_text.split('(')[0].strip()
+            details['course_code'] = title_text.split('(')[-1].strip(')')
+
+    # Extract School and College from "Course Outline"
+    for row in soup.select('table.sitstablegrid caption'):
+        if "Course Outline" in row.get_text():
+            table = row.find_parent('table')
+            if table:
+                rows = table.find_all('tr')
+                for tr in rows:
+                    cells = tr.find_all('td')
+                    if len(cells) >= 4:  # Ensure we have both columns
+                        label_1 = cells[0].get_text(strip=True)
+                        value_1 = cells[1].get_text(strip=True)
+                        label_2 = cells[2].get_text(strip=True)
+                        value_2 = cells[3].get_text(strip=True)
+                        
+                        if "School" in label_1:
+                            details['school'] = value_1
+                        if "College" in label_2:
+                            details['college'] = value_2
+
+    # Extract Summary and Course Description
+    for row in soup.select('table.sitstablegrid caption'):
+        if "Course Outline" in row.get_text():
+            table = row.find_parent('table')
+            if table:
+                rows = table.find_all('tr')
+                for tr in rows:
+                    cells = tr.find_all('td')
+                    if len(cells) >= 2:
+                        label = cells[0].get_text(strip=True)
+                        value = cells[1].get_text(" ", strip=True)
+                        if "Summary" in label:
+                            details['summary'] = value
+                        elif "Course description" in label:
+                            details['course_description'] = value
+
+    # Extract Prerequisites (Fixing the issue)
+    for row in soup.select('table.sitstablegrid caption'):
+        if "Entry Requirements" in row.get_text():
+            table = row.find_parent('table')
+            if table:
+                rows = table.find_all('tr')
+                for tr in rows:
+                    cells = tr.find_all('td')
+                    if len(cells) >= 2:
+                        label = cells[0].get_text(strip=True)
+                        if "Pre-requisites" in label:
+                            prereq_links = []
+                            for link in cells[1].find_all('a'):
+                                prereq_links.append(f"{link.get_text(strip=True)}")
+                            details['prerequisites'] = "; ".join(prereq_links)
+
+                        if "Prohibited Combinations" in label:
+                            prohibited_links = []
+                            for link in cells[1].find_all('a'):
+                                prohibited_links.append(f"{link.get_text(strip=True)}")
+                            details['prohibited_combinations'] = "; ".join(prohibited_links)
+
+    # Extract Learning Outcomes
+    for row in soup.select('table.sitstablegrid caption'):
+        if "Learning Outcomes" in row.get_text():
+            table = row.find_parent('table')
+            if table:
+                outcome_list = table.find('ol')
+                if outcome_list:
+                    details['learning_outcomes'] = " ".join(li.get_text(strip=True) for li in outcome_list.find_all('li'))
+
+    # Extract Assessment Details
+    for row in soup.select('table.sitstablegrid caption'):
+        if "Assessment" in row.get_text():
+            table = row.find_parent('table')
+            if table:
+                assessment_data = table.find('td', colspan="14")
+                if assessment_data:
+                    details['assessment'] = assessment_data.get_text(" ", strip=True)
+
+    # Extract Total Learning Hours
+    for row in soup.select('table.sitstablegrid caption'):
+        if "Course Delivery Information" in row.get_text():
+            table = row.find_parent('table')
+            if table:
+                rows = table.find_all('tr')
+                for tr in rows:
+                    if "Total Hours" in tr.get_text():
+                        details['total_hours'] = tr.find_all('td')[1].get_text(strip=True)
+
+    # Extract Course URL
+    for row in soup.select('table.sitstablegrid caption'):
+        if "Additional Information" in row.get_text():
+            table = row.find_parent('table')
+            if table:
+                rows = table.find_all('tr')
+                for tr in rows:
+                    cells = tr.find_all('td')
+                    if len(cells) >= 2:
+                        label = cells[0].get_text(strip=True)
+                        value = cells[1].get_text(strip=True)
+                        if "Course URL" in label:
+                            details['course_url'] = value
+
+    # Extract Keywords
+    for row in soup.select('table.sitstablegrid caption'):
+        if "Additional Information" in row.get_text():
+            table = row.find_parent('table')
+            if table:
+                rows = table.find_all('tr')
+                for tr in rows:
+                    cells = tr.find_all('td')
+                    if len(cells) >= 2:
+                        label = cells[0].get_text(strip=True)
+                        value = cells[1].get_text(strip=True)
+                        if "Keywords" in label:
+                            details['keywords'] = value
+
+    # Extract Course Organizer
+    for row in soup.select('table.sitstablegrid caption'):
+        if "Contacts" in row.get_text():
+            table = row.find_parent('table')
+            if table:
+                rows = table.find_all('tr')
+                for tr in rows:
+                    cells = tr.find_all('td')
+                    if len(cells) >= 2:
+                        label = cells[0].get_text(strip=True)
+                        value = cells[1].get_text(strip=True)
+                        if "Course organiser" in label:
+                            details['course_organizer'] = value.split("Tel:")[0].strip()
+
+    return details
+
+
+def load_corpus(directory):
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(('.htm', '.html')):
+            with open(os.path.join(directory, name), 'rb') as f:
+                pages.append(f.read())
+    return pages
+
+
+def run(label, parse, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [parse(page) for page in pages]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {len(pages) * repeat / elapsed:10.1f} pages/sec")
+    return results
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    pages = load_corpus(sys.argv[1])
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    print(f"{len(pages)} pages x {repeat}")
+
+    baseline = run("legacy (html.parser)", legacy_parse, pages, repeat)
+    variants = [
+        ("indexed (html.parser)", dict(features='html.parser', strain=False)),
+        ("indexed (html.parser, strained)", dict(features='html.parser', strain=True)),
+    ]
+    if HAS_LXML:
+        variants += [
+            ("indexed (lxml)", dict(features='lxml', strain=False)),
+            ("indexed (lxml, strained)", dict(features='lxml', strain=True)),
+        ]
+    for label, options in variants:
+        results = run(label, lambda page: parse_course_page(page, **options), pages, repeat)
+        # Only the fields the legacy parser knew about (not e.g. the linked course codes)
+        mismatches = sum(1 for old, new in zip(baseline, results) if any(new[key] != value for key, value in old.items()))
+        if mismatches:
+            print(f"  {mismatches} pages parsed differently from the legacy parser")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""Route benchmark: throughput, latency percentiles and queries per request for every page.
+
+Usage: python benchmarks/bench_routes.py [--scales 1000,10000] [--requests 200]
+                                         [--database-url URL] [--no-page-cache]
+                                         [--save-baseline] [--tolerance 0.5]
+
+Each scale runs in a fresh process against a freshly seeded database (a throwaway SQLite
+file unless --database-url points at e.g. a local Postgres): N subjects, N/10 users and
+10N reviews skewed towards popular subjects. Course pages for the import are served by a
+local mock DRPS, so nothing leaves the machine.
+
+Results are compared with benchmarks/baselines/routes-<dialect>-<scale>.json when it exists;
+a route regresses when it issues more queries per request, or its p95 grows by more than
+--tolerance (and by more than 1ms). Regressions exit with status 1. --save-baseline stores
+the current run as the new baseline, with its --requests and page cache mode: how warm the
+page cache gets depends on both, so a run with different settings is not compared (status 2).
+"""
+import argparse
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+
+from common import ROOT, load_app, percentiles, seed_reviews, seed_subjects, subject_rows
+from mock_drps import MockDRPS, listing_page
+
+BASELINE_DIR = os.path.join(ROOT, 'benchmarks', 'baselines')
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def measure(client, requests):
+    """Issue (method, path, data) requests, returning latency samples (ms) and query counts."""
+    samples, queries = [], []
+    for method, path, data in requests:
+        start = time.perf_counter()
+        response = client.open(path, method=method, data=data)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code in (200, 302), f"{method} {path}: {response.status_code}"
+        match = SERVER_TIMING_QUERIES.search(response.headers.get('Server-Timing', ''))
+        queries.append(int(match.group(1)) if match else 0)
+    return samples, queries
+
+
+def report(name, samples, queries):
+    result = percentiles(samples)
+    result['rps'] = len(samples) / (sum(samples) / 1000)
+    result['queries'] = sum(queries) / len(queries)
+    print(f"{name:<20} n={len(samples):<5} {result['rps']:8.1f} req/s  p50={result['p50']:7.2f}ms "
+          f"p95={result['p95']:7.2f}ms p99={result['p99']:7.2f}ms  queries/req={result['queries']:.1f}")
+    return result
+
+
+def run_scale(scale, count, database_url):
+    drps = MockDRPS()
+    os.environ['DRPS_BASE_URL'] = drps.base_url
+    os.environ['CRAWLER_RATE_LIMIT'] = '1000'
+    os.environ['SERVER_TIMING'] = '1'
+    app, db = load_app(database_url)
+    from app import run_subject_import
+    from jobs import work
+    from models import Subject
+    from paging import encode_cursor
+    from ratings import rebuild_rating_aggregates
+    from search import create_search_indexes
+
+    with app.app_context():
+        dialect = db.session.get_bind().dialect.name
+        start = time.perf_counter()
+        rows = seed_subjects(db, scale)
+        seed_reviews(db, scale * 10, users=max(scale // 10, 10))
+        rebuild_rating_aggregates()
+        create_search_indexes()
+        subjects = db.session.execute(db.select(Subject.id, Subject.name)).all()
+        print(f"\n== {scale} subjects, {max(scale // 10, 10)} users, {scale * 10} reviews ({dialect}, "
+              f"seeded in {time.perf_counter() - start:.1f}s)")
+
+    rng = random.Random(scale)
+    weights = [1.0 / (rank + 1) for rank in range(len(subjects))]
+
+    def popular():
+        return rng.choices(subjects, weights)[0]
+
+    def filters():
+        row = rng.choice(rows)
+        return rng.choice([f"filter_scqf={row['scqf']}", f"filter_period={row['period']}",
+                           f"filter_credits={row['credits']}&filter_scqf={row['scqf']}"])
+
+    def cursor():
+        subject = rng.choice(subjects)
+        return encode_cursor(subject.name, subject.id)
+
+    routes = {
+        'home': lambda: ('GET', '/', None),
+        'home_filtered': lambda: ('GET', f'/?{filters()}', None),
+        'home_deep_page': lambda: ('GET', f'/?after={cursor()}', None),
+        'subjects_json': lambda: ('GET', f'/subjects?after={cursor()}', None),
+        'search_suggestions': lambda: ('GET', f"/search_suggestions?q={rng.choice(rows)['name'][:rng.randint(2, 8)]}", None),
+        'subject_page': lambda: ('GET', f'/subject/{popular().id}', None),
+        'subject_reviews': lambda: ('GET', f'/subject/{popular().id}/reviews', None),
+        'feed': lambda: ('GET', f"/feed?window={rng.choice(['7d', '30d', 'all'])}", None),
+    }
+
+    client = app.test_client()
+    results = {}
+    for name, make_request in routes.items():
+        results[name] = report(name, *measure(client, [make_request() for _ in range(count)]))
+
+    # Reviews from one logged-in user, each for a different subject
+    client.post('/register', data={'username': 'bench-reviewer', 'email': 'bench-reviewer@example.com', 'password': 'pw'})
+    client.post('/login', data={'username': 'bench-reviewer', 'password': 'pw'})
+    reviewed = rng.sample(subjects, min(count, len(subjects)))
+    results['add_review'] = report('add_review', *measure(client, [
+        ('POST', f'/add_review/{subject.id}', {'rating': rng.randint(1, 5), 'comment': 'Benchmark review'})
+        for subject in reviewed
+    ]))
+
+    # An import of new subjects through the job queue, crawling the mock DRPS
+    new_rows = list(subject_rows(scale + 100, seed=1))[scale:]
+    drps.add(new_rows)
+    start = time.perf_counter()
+    response = client.post('/add_subjects_from_html', data={'file': (io.BytesIO(listing_page(new_rows)), 'listing.html')})
+    assert response.status_code == 202, response.get_data(as_text=True)
+    with app.app_context():
+        work(run_subject_import, once=True)
+    elapsed = time.perf_counter() - start
+    print(f"{'import':<20} {len(new_rows)} subjects in {elapsed * 1000:.0f}ms ({len(new_rows) / elapsed:.0f} subjects/s)")
+    results['import'] = {'subjects_per_sec': len(new_rows) / elapsed}
+
+    drps.close()
+    return dialect, results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before or 'p95' not in result:
+            continue
+        if result['queries'] > before['queries'] + 0.05:
+            regressions.append(f"{name}: {before['queries']:.1f} -> {result['queries']:.1f} queries/req")
+        if result['p95'] > before['p95'] * (1 + tolerance) and result['p95'] - before['p95'] > 1:
+            regressions.append(f"{name}: p95 {before['p95']:.2f}ms -> {result['p95']:.2f}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scales', default='1000,10000', help='Comma-separated subject counts.')
+    parser.add_argument('--scale', type=int, help=argparse.SUPPRESS)  # One scale, in this process
+    parser.add_argument('--requests', type=int, default=200, help='Requests per route.')
+    parser.add_argument('--database-url', help='Database to seed (default: a temporary SQLite file).')
+    parser.add_argument('--no-page-cache', action='store_true', help='Render every page (PAGE_CACHE_BACKEND=).')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed relative p95 growth.')
+    args = parser.parse_args()
+
+    if args.scale is None:
+        # Every scale in a fresh process, so no in-memory cache outlives its database
+        argv = ['--requests', str(args.requests), '--tolerance', str(args.tolerance)]
+        argv += ['--database-url', args.database_url] if args.database_url else []
+        argv += ['--no-page-cache'] if args.no_page_cache else []
+        argv += ['--save-baseline'] if args.save_baseline else []
+        status = 0
+        for scale in args.scales.split(','):
+            status |= subprocess.call([sys.executable, os.path.abspath(__file__), '--scale', scale.strip()] + argv)
+        sys.exit(status)
+
+    if args.no_page_cache:
+        os.environ['PAGE_CACHE_BACKEND'] = ''
+    dialect, results = run_scale(args.scale, args.requests, args.database_url)
+
+    suffix = '-nocache' if args.no_page_cache else ''
+    path = os.path.join(BASELINE_DIR, f"routes-{dialect}-{args.scale}{suffix}.json")
+    settings = {'requests': args.requests, 'page_cache': not args.no_page_cache}
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'settings': settings, 'routes': results}, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {os.path.relpath(path, ROOT)}")
+    elif os.path.exists(path):
+        with open(path) as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != settings:
+            print(f"Not comparing with {os.path.relpath(path, ROOT)}: it was recorded with {baseline.get('settings')}, "
+                  f"this run used {settings}. Rerun with the baseline's settings, or --save-baseline.")
+            sys.exit(2)
+        regressions = compare(results, baseline['routes'], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {os.path.relpath(path, ROOT)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Search latency benchmark: replays typed prefixes against /search_suggestions' search.
+
+Usage: python benchmarks/bench_search.py [subjects] [database_url]
+
+Seeds `subjects` synthetic subjects (10000 by default) and types the names of a sample
+of them one character at a time, the way home.html's fetchSuggestions fires on input,
+timing the original leading-wildcard ILIKE query against search_subjects and the in-memory
+autocomplete index.
+"""
+import random
+import sys
+
+from common import load_app, seed_subjects, summarize, timed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    app, db = load_app(sys.argv[2] if len(sys.argv) > 2 else None)
+    from app import autocomplete, search_index
+    from models import Subject
+    from search import create_search_indexes, search_subjects
+
+    with app.app_context():
+        rows = seed_subjects(db, count)
+        create_search_indexes()
+
+        # Prefixes of 2+ characters, as the client only asks from the second keystroke
+        rng = random.Random(1)
+        prefixes = []
+        for row in rng.sample(rows, 50):
+            name = row['name'].lower()
+            prefixes += [name[:i] for i in range(2, min(len(name), 20) + 1)]
+
+        def legacy(query):
+            return Subject.query.filter(Subject.name.ilike(f'%{query}%')).limit(10).all()
+
+        # Build the in-process index (if used) before timing, as a warm worker would have
+        build_ms, _ = timed(search_subjects, 'warm up', search_index)
+        print(f"{count} subjects, {len(prefixes)} typed prefixes, index build {build_ms:.0f}ms "
+              f"({db.session.get_bind().dialect.name})")
+
+        summarize("legacy ILIKE '%q%'", [timed(legacy, q)[0] for q in prefixes])
+        summarize("search_subjects", [timed(search_subjects, q, search_index)[0] for q in prefixes])
+
+        build_ms, index = timed(autocomplete.get)
+        stats = index.stats()
+        print(f"autocomplete build {build_ms:.0f}ms, {stats['keys']} keys, {stats['bytes'] / 1024:.0f} KiB")
+        summarize("autocomplete", [timed(index.complete, q)[0] for q in prefixes])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Serving benchmark: concurrent throughput of sync vs threaded gunicorn workers.
+
+Usage: python benchmarks/bench_serving.py [--workers 2] [--threads 8] [--concurrency 32]
+                                          [--duration 10] [--db-latency-ms 2] [--subjects 5000]
+                                          [--database-url URL] [--page-cache]
+
+Seeds a database, then for each mode starts gunicorn with the same number of worker processes
+(so roughly equal memory) and drives the read routes and /search_suggestions from
+`--concurrency` client threads. --db-latency-ms delays every query to stand in for a database
+on another host; that wait is what threads overlap. The page cache is off unless --page-cache
+is given, so every request reaches the database.
+"""
+import argparse
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from common import ROOT, load_app, percentiles, seed_reviews, seed_subjects
+
+CONFIG = os.path.join(ROOT, 'benchmarks', 'gunicorn_bench.conf.py')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def worker_rss_mb(master_pid):
+    """Resident memory of the master and its workers."""
+    pids = [master_pid] + [int(pid) for pid in subprocess.run(
+        ['ps', '-o', 'pid=', '--ppid', str(master_pid)], capture_output=True, text=True).stdout.split()]
+    total = 0
+    for pid in pids:
+        with open(f'/proc/{pid}/status') as f:
+            # Exited processes have no VmRSS line
+            total += next((int(line.split()[1]) for line in f if line.startswith('VmRSS')), 0)
+    return total / 1024
+
+
+def load(base_url, paths, concurrency, duration):
+    samples, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        local = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = session.get(base_url + rng.choice(paths), timeout=30).status_code == 200
+            except requests.RequestException:
+                ok = False
+            local.append((time.perf_counter() - start) * 1000)
+            if not ok:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors[0]
+
+
+def run_mode(label, threads, args, env, paths):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn.app.wsgiapp', '-c', CONFIG, '--workers', str(args.workers), '--threads', str(threads),
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'],
+        cwd=ROOT, env={**env, 'GUNICORN_THREADS': str(threads)})
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        for _ in range(100):
+            if server.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with status {server.returncode}")
+            try:
+                requests.get(base_url + '/search_suggestions?q=ab', timeout=5)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.2)
+        load(base_url, paths, args.concurrency, 2)  # Warm every worker's caches and connections
+        samples, errors = load(base_url, paths, args.concurrency, args.duration)
+        rss = worker_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    p = percentiles(samples)
+    print(f"{label:<22} {len(samples) / args.duration:8.1f} req/s  p50={p['p50']:7.1f}ms p95={p['p95']:7.1f}ms "
+          f"p99={p['p99']:7.1f}ms  errors={errors}  rss={rss:.0f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--db-latency-ms', type=float, default=2)
+    parser.add_argument('--subjects', type=int, default=5000)
+    parser.add_argument('--database-url', help='Database to seed (default: a temporary SQLite file).')
+    parser.add_argument('--page-cache', action='store_true', help='Leave the rendered-page cache on.')
+    args = parser.parse_args()
+
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'serving.db')
+    app, db = load_app(database_url)
+    from models import Subject
+    with app.app_context():
+        rows = seed_subjects(db, args.subjects)
+        seed_reviews(db, args.subjects * 5, users=max(args.subjects // 10, 10))
+        subject_ids = db.session.scalars(db.select(Subject.id)).all()
+
+    rng = random.Random(0)
+    paths = ['/', '/feed', '/feed?window=7d']
+    paths += [f'/?filter_scqf={scqf}' for scqf in (7, 8, 9, 10, 11)]
+    paths += [f'/subject/{subject_id}' for subject_id in rng.sample(subject_ids, 200)]
+    paths += [f"/search_suggestions?q={row['name'][:rng.randint(2, 6)]}" for row in rng.sample(rows, 200)]
+
+    env = {**os.environ, 'DATABASE_URL': database_url, 'CRAWLER_CACHE_DIR': '',
+           'BENCH_DB_LATENCY_MS': str(args.db_latency_ms),
+           'DB_POOL_SIZE': str(max(args.threads, 5))}
+    if not args.page_cache:
+        env['PAGE_CACHE_BACKEND'] = ''
+    print(f"{args.subjects} subjects, {args.workers} workers, {args.concurrency} concurrent clients, "
+          f"{args.db_latency_ms}ms per query")
+    run_mode('sync', 1, args, env, paths)
+    run_mode(f'gthread x{args.threads}', args.threads, args, env, paths)
+
+
+if __name__ == '__main__':
+    main()
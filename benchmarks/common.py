@@ -0,0 +1,147 @@
+"""Shared helpers for the benchmark scripts: app setup, synthetic data and latency summaries."""
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SYLLABLES = ['al', 'go', 'ri', 'thm', 'da', 'ta', 'com', 'pu', 'ter', 'sci', 'ence', 'net', 'work', 'sys',
+             'tem', 'lo', 'gic', 'ma', 'chi', 'ne', 'lear', 'ning', 'gra', 'phics', 'qua', 'ntum', 'bio',
+             'eco', 'no', 'mics', 'his', 'to', 'ry', 'phi', 'so', 'phy', 'law', 'art', 'mu', 'sic']
+
+
+def load_app(database_url=None):
+    """Import the app against `database_url` (a throwaway SQLite file by default) with fresh tables."""
+    if database_url is None:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('CRAWLER_CACHE_DIR', '')
+    from app import app, db
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app, db
+
+
+def vocabulary(size=3000, seed=0):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    # Shuffle so word frequency (by position, see subject_rows) is unrelated to spelling
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+def subject_rows(count, seed=0):
+    """Synthetic subject rows with Zipf-ish word frequencies, like real course text."""
+    rng = random.Random(seed)
+    words = vocabulary(seed=seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(words))]
+
+    def text(n):
+        return ' '.join(rng.choices(words, weights, k=n))
+
+    for i in range(count):
+        yield {
+            'name': text(rng.randint(2, 5)).title(),
+            'code': f"BNCH{i:06d}",
+            'school': f"School of {rng.choice(words).title()}",
+            'college': rng.choice(['College of Science and Engineering', 'College of Arts, Humanities and Social Sciences',
+                                   'College of Medicine and Veterinary Medicine']),
+            'scqf': rng.choice([7, 8, 9, 10, 11]),
+            'credits': rng.choice([10, 10, 20, 20, 20, 40, 60]),
+            'period': rng.choice(['Semester 1', 'Semester 2', 'Full Year', 'Flexible']),
+            'availability': rng.choice(['SV1', 'SS1', 'SV2']),
+            'summary': text(60),
+            'learning_outcomes': text(40),
+            'keywords': ', '.join(rng.sample(words[:300], 4)),
+            'url': f"http://drps.example/cxbnch{i:06d}.htm",
+        }
+
+
+def seed_subjects(db, count, seed=0, batch_size=1000):
+    from models import Subject
+    rows = list(subject_rows(count, seed))
+    for i in range(0, len(rows), batch_size):
+        db.session.execute(db.insert(Subject).values(rows[i:i + batch_size]))
+    db.session.commit()
+    return rows
+
+
+def seed_reviews(db, count, users=1000, days=90, seed=0, batch_size=5000):
+    """`users` users and `count` reviews spread over the last `days` days, skewed towards popular subjects.
+
+    Each user reviews a subject at most once, so a popular subject tops out at `users` reviews.
+    """
+    import itertools
+    import math
+    from datetime import datetime, timedelta
+    from models import Review, Subject, User
+    rng = random.Random(seed)
+    db.session.execute(db.insert(User).values([
+        {'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password': 'x'} for i in range(users)
+    ]))
+    user_ids = db.session.scalars(db.select(User.id)).all()
+    subject_ids = db.session.scalars(db.select(Subject.id)).all()
+    count = min(count, len(user_ids) * len(subject_ids))
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(subject_ids))))
+    reviewers = {}  # subject id -> (start, stride, taken): walks a random permutation of the users
+
+    def next_reviewer(subject_id):
+        n = len(user_ids)
+        if subject_id not in reviewers:
+            stride = 1
+            while n > 1 and (stride == 1 or math.gcd(stride, n) != 1):
+                stride = rng.randrange(1, n)
+            reviewers[subject_id] = (rng.randrange(n), stride, 0)
+        start, stride, taken = reviewers[subject_id]
+        if taken == n:
+            return None
+        reviewers[subject_id] = (start, stride, taken + 1)
+        return user_ids[(start + taken * stride) % n]
+
+    now = datetime.now()
+    added = 0
+    while added < count:
+        rows = []
+        while len(rows) < min(batch_size, count - added):
+            subject_id = rng.choices(subject_ids, cum_weights=cum_weights)[0]
+            user_id = next_reviewer(subject_id)
+            if user_id is None:
+                continue  # Every user has reviewed it
+            rows.append({
+                'user_id': user_id,
+                'subject_id': subject_id,
+                'rating': rng.choices([1, 2, 3, 4, 5], [1, 1, 3, 4, 3])[0],
+                'comment': 'Benchmark review',
+                'created_at': now - timedelta(seconds=rng.randrange(days * 86400)),
+            })
+        db.session.execute(db.insert(Review).values(rows))
+        added += len(rows)
+    db.session.commit()
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def percentiles(samples_ms):
+    samples = sorted(samples_ms)
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+    return {'p50': pct(50), 'p95': pct(95), 'p99': pct(99), 'max': samples[-1]}
+
+
+def summarize(label, samples_ms):
+    p = percentiles(samples_ms)
+    print(f"{label:<36} n={len(samples_ms):<6} p50={p['p50']:7.2f}ms p95={p['p95']:7.2f}ms "
+          f"p99={p['p99']:7.2f}ms max={p['max']:7.2f}ms")
@@ -0,0 +1,18 @@
+# The app's gunicorn.conf.py, plus an optional fixed delay per query (BENCH_DB_LATENCY_MS) that
+# stands in for the network round trip to a database server on another host.
+import os
+import time
+
+with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py')) as f:
+    exec(f.read())
+
+_app_post_worker_init = post_worker_init  # noqa: F821 (defined by the exec above)
+
+
+def post_worker_init(worker):
+    latency = float(os.getenv('BENCH_DB_LATENCY_MS', 0)) / 1000
+    if latency:
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        event.listen(Engine, 'before_cursor_execute', lambda *args: time.sleep(latency))
+    _app_post_worker_init(worker)
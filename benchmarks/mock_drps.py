@@ -0,0 +1,80 @@
+"""An offline stand-in for DRPS: generated course pages and listings served from a local thread."""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COURSE_PAGE = """<html><body><h1 class="sitspagetitle">{name} ({code})</h1>
+<table class="sitstablegrid"><caption>Course Outline</caption>
+<tr><td>School</td><td>{school}</td><td>College</td><td>{college}</td></tr>
+<tr><td>Course type</td><td>Standard</td><td>Availability</td><td>Available to all students</td></tr>
+<tr><td>Summary</td><td colspan="3">{summary}</td></tr>
+<tr><td>Course description</td><td colspan="3">{summary}</td></tr>
+</table>
+<table class="sitstablegrid"><caption>Entry Requirements (not applicable to Visiting Students)</caption>
+<tr><td>Pre-requisites</td><td>Students MUST have passed: <a href="cx{prerequisite_lower}.htm">Prerequisite ({prerequisite})</a></td></tr>
+</table>
+<table class="sitstablegrid"><caption>Course Delivery Information</caption>
+<tr><td>Academic year 2024/25</td><td>{period}</td></tr>
+<tr><td>Learning and Teaching activities</td><td>Total Hours: {hours} ( Lecture Hours 20 )</td></tr>
+</table>
+<table class="sitstablegrid"><caption>Assessment (Further Info)</caption>
+<tr><td colspan="14">Written Exam 60 %, Coursework 40 %</td></tr></table>
+<table class="sitstablegrid"><caption>Learning Outcomes</caption>
+<tr><td><ol><li>{learning_outcomes}</li></ol></td></tr></table>
+<table class="sitstablegrid"><caption>Additional Information</caption>
+<tr><td>Keywords</td><td>{keywords}</td></tr></table>
+<table class="sitstablegrid"><caption>Contacts</caption>
+<tr><td>Course organiser</td><td>Dr Organiser Tel: 0131 Email: organiser@example.com</td></tr></table>
+</body></html>"""
+
+
+def course_page(row, prerequisite):
+    return COURSE_PAGE.format(prerequisite_lower=prerequisite.lower(), prerequisite=prerequisite,
+                              hours=int(row['credits']) * 10, **row).encode()
+
+
+def listing_page(rows):
+    """A DRPS school listing of `rows` (subject_rows dicts), grouped by SCQF level."""
+    levels = {}
+    for row in rows:
+        levels.setdefault(row['scqf'], []).append(row)
+    out = ["<html><body>"]
+    for level, level_rows in sorted(levels.items()):
+        out.append(f'<h3 class="scqf_level">SCQF Level {level} (Year x)</h3><table>'
+                   '<tr><th>Code</th><th>Avail</th><th>Name</th><th>Period</th><th>Credits</th></tr>')
+        out += [f"<tr><td>{row['code']}</td><td>{row['availability']}</td><td>{row['name']}</td>"
+                f"<td>{row['period']}</td><td>{row['credits']}</td></tr>" for row in level_rows]
+        out.append("</table>")
+    out.append("</body></html>")
+    return "\n".join(out).encode()
+
+
+class MockDRPS:
+    """Serves course pages for subject rows at /dpt/cx<code>.htm on an ephemeral local port."""
+
+    def __init__(self):
+        self.pages = {}
+        pages = self.pages
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = pages.get(self.path)
+                self.send_response(200 if body else 404)
+                self.send_header('Content-Length', str(len(body or b'')))
+                self.end_headers()
+                self.wfile.write(body or b'')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/dpt/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def add(self, rows):
+        # Prerequisites form a tree a few levels deep, like real course chains (the first course
+        # names itself, which the importer drops)
+        for i, row in enumerate(rows):
+            self.pages[f"/dpt/cx{row['code'].lower()}.htm"] = course_page(row, rows[i // 8]['code'])
+
+    def close(self):
+        self.server.shutdown()
@@ -0,0 +1,204 @@
+import re
+import threading
+import time
+
+from sqlalchemy.orm import load_only
+
+from batching import chunks
+from models import db, Subject
+from paging import decode_cursor, encode_cursor
+
+# Home page filters, each counted per value
+FACET_COLUMNS = ('period', 'credits', 'scqf')
+# Type of each filter's values; query string values are converted before they are compared
+FILTER_TYPES = {'period': str, 'credits': int, 'scqf': int}
+
+NUMBER = re.compile(r'\d+')
+
+# Columns the subject listings need; the large text columns stay unloaded
+LISTING_COLUMNS = ('id', 'name', 'code', 'period', 'credits', 'scqf')
+
+
+def catalogue_stamp():
+    """A cheap fingerprint of the subject table that changes whenever subjects are added or rewritten.
+
+    Imports and syncs set updated_at on every row they write, including rows whose course page
+    failed to fetch, so (count, max id, max updated_at) moves on every write without the writers
+    having to signal anything.
+    """
+    row = db.session.execute(
+        db.select(db.func.count(Subject.id), db.func.max(Subject.id), db.func.max(Subject.updated_at))
+    ).one()
+    return tuple(row)
+
+
+class CatalogueCache:
+    """A value derived from the subject table, kept in memory and rebuilt when the table changes.
+
+    Imports run in worker processes, so each web worker notices changes by re-checking the
+    catalogue stamp (or another table's, passed as `stamp`) at most every `check_interval` seconds.
+    """
+
+    def __init__(self, build, check_interval=5.0, stamp=catalogue_stamp):
+        self.build = build
+        self.check_interval = check_interval
+        self.stamp_of = stamp
+        self.value = None
+        self.stamp = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.value is not None and time.monotonic() - self.checked_at < self.check_interval:
+            return self.value
+        with self.lock:
+            # Another thread may have refreshed it while we waited for the lock
+            if self.value is not None and time.monotonic() - self.checked_at < self.check_interval:
+                return self.value
+            stamp = self.stamp_of()
+            if self.value is None or stamp != self.stamp:
+                self.value = self.build()
+                self.stamp = stamp
+            self.checked_at = time.monotonic()
+            return self.value
+
+
+def to_int(value):
+    """A credits value or SCQF level as stored: the first number in listing text ('20', 'SCQF Level 8'), or None."""
+    if value is None or isinstance(value, int):
+        return value
+    match = NUMBER.search(str(value))
+    return int(match.group()) if match else None
+
+
+def typed_filters(filters):
+    """The active filters, with query string values converted to their column's type.
+
+    A value that cannot be converted (?filter_credits=abc) stays a string, and matches nothing.
+    """
+    typed = {}
+    for column, value in filters.items():
+        if value:
+            try:
+                typed[column] = FILTER_TYPES[column](value)
+            except ValueError:
+                typed[column] = value
+    return typed
+
+
+def _facet_order(value):
+    # Numeric values (credits, SCQF levels) in numeric order, before any others
+    return (0, value, '') if isinstance(value, int) else (1, 0, value)
+
+
+class Facets:
+    """Subject counts per filter value, for every combination of the filter columns.
+
+    The catalogue has few distinct (period, credits, scqf) combinations, so counts conditional
+    on any set of active filters are summed in memory rather than with a GROUP BY per request.
+    """
+
+    def __init__(self, rows):
+        self.combinations = [(dict(zip(FACET_COLUMNS, values)), count) for *values, count in rows]
+
+    @classmethod
+    def from_database(cls):
+        columns = [getattr(Subject, column) for column in FACET_COLUMNS]
+        return cls(db.session.execute(db.select(*columns, db.func.count(Subject.id)).group_by(*columns)))
+
+    def counts(self, filters):
+        """{column: [(value, count), ...]} where each count honours the other active filters."""
+        active = typed_filters(filters)
+        result = {}
+        for column in FACET_COLUMNS:
+            others = {other: value for other, value in active.items() if other != column}
+            counts = dict.fromkeys((values[column] for values, _ in self.combinations if values[column] is not None), 0)
+            for values, count in self.combinations:
+                if values[column] is not None and all(values[other] == value for other, value in others.items()):
+                    counts[values[column]] += count
+            result[column] = sorted(counts.items(), key=lambda item: _facet_order(item[0]))
+        return result
+
+
+def list_subjects(filters, after=None, before=None, per_page=48):
+    """One page of subjects ordered by (name, id), as (subjects, next_cursor, prev_cursor).
+
+    Keyset paging: the page starts right after (or ends right before) the cursor's position,
+    so every page costs the same index range scan however deep it is. `filters` maps column
+    names to required values, as strings from the query string or typed; falsy values are ignored.
+    """
+    query = db.select(Subject).options(load_only(*(getattr(Subject, column) for column in LISTING_COLUMNS)))
+    for column, value in typed_filters(filters).items():
+        if isinstance(value, FILTER_TYPES[column]):
+            query = query.where(getattr(Subject, column) == value)
+        else:
+            query = query.where(db.false())
+    position = db.tuple_(Subject.name, Subject.id)
+    if before:
+        query = query.where(position < tuple(decode_cursor(before, str, int))).order_by(Subject.name.desc(), Subject.id.desc())
+    else:
+        if after:
+            query = query.where(position > tuple(decode_cursor(after, str, int)))
+        query = query.order_by(Subject.name, Subject.id)
+
+    subjects = db.session.scalars(query.limit(per_page + 1)).all()
+    more = len(subjects) > per_page
+    subjects = subjects[:per_page]
+    if before:
+        subjects.reverse()
+        next_cursor = encode_cursor(subjects[-1].name, subjects[-1].id) if subjects else None
+        prev_cursor = encode_cursor(subjects[0].name, subjects[0].id) if more else None
+    else:
+        next_cursor = encode_cursor(subjects[-1].name, subjects[-1].id) if more else None
+        prev_cursor = encode_cursor(subjects[0].name, subjects[0].id) if after and subjects else None
+    return subjects, next_cursor, prev_cursor
+
+
+def migrate_filter_columns(batch_size=1000):
+    """Convert credits and scqf of an existing subject table from text to integers, with the filter index.
+
+    Each value becomes the first number in its old text, as to_int() reads listings; text without
+    a number becomes NULL. Postgres changes the column types in place. SQLite cannot, so the table
+    is rebuilt from the model and the rows copied across. Does nothing when the columns are already
+    integers, apart from creating the index if missing. Returns the number of subjects converted.
+    """
+    connection = db.session.connection()
+    dialect = connection.dialect.name
+    inspector = db.inspect(connection)
+    columns = {column['name']: column['type'] for column in inspector.get_columns('subject')}
+    text_columns = [column for column, kind in FILTER_TYPES.items()
+                    if kind is int and not isinstance(columns[column], db.Integer)]
+    converted = 0
+
+    if text_columns and dialect == 'postgresql':
+        converted = db.session.scalar(db.select(db.func.count(Subject.id)))
+        for column in text_columns:
+            db.session.execute(db.text(f"ALTER TABLE subject ALTER COLUMN {column} TYPE integer "
+                                       f"USING substring({column} from '[0-9]+')::integer"))
+    elif text_columns and dialect == 'sqlite':
+        old = db.table('subject_before_migration', *(db.column(column) for column in columns))
+        # Keep the review foreign keys naming "subject" while the old table is renamed
+        db.session.execute(db.text("PRAGMA legacy_alter_table = ON"))
+        for name in db.session.scalars(db.text(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'subject' AND sql IS NOT NULL")).all():
+            db.session.execute(db.text(f'DROP INDEX "{name}"'))
+        db.session.execute(db.text(f"ALTER TABLE subject RENAME TO {old.name}"))
+        Subject.__table__.create(connection)
+        copied = [column for column in columns if column in Subject.__table__.c]
+        db.session.execute(db.insert(Subject.__table__).from_select(copied, db.select(*(old.c[column] for column in copied))))
+        rows = db.session.execute(db.select(old.c.id, *(old.c[column] for column in text_columns))).all()
+        for batch in chunks(rows, batch_size):
+            db.session.execute(db.update(Subject), [
+                {'id': row.id, **{column: to_int(row._mapping[column]) for column in text_columns}}
+                for row in batch
+            ])
+        db.session.execute(db.text(f"DROP TABLE {old.name}"))
+        db.session.execute(db.text("PRAGMA legacy_alter_table = OFF"))
+        converted = len(rows)
+    elif text_columns:
+        raise RuntimeError(f"Converting the filter columns is not supported on {dialect}")
+
+    for index in Subject.__table__.indexes:
+        index.create(connection, checkfirst=True)
+    db.session.commit()
+    return converted
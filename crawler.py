@@ -0,0 +1,248 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from files import write_atomic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "http://www.drps.ed.ac.uk/24-25/dpt/"
+# Responses worth asking for again after a pause
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def course_url(code, base_url=DEFAULT_BASE_URL):
+    """Build the DRPS course page URL for a course code."""
+    return f"{base_url.rstrip('/')}/cx{code.lower()}.htm"
+
+
+class HostRateLimiter:
+    """Space out requests to the same host so we never exceed `rate` requests per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        # Sleep outside the lock so other hosts are not held up
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class CrawlCache:
+    """Persistent on-disk cache of fetched pages (zlib-compressed, keyed by URL) and of parse results.
+
+    Response entries keep the ETag / Last-Modified validators so stale pages can be revalidated
+    with a conditional GET. Parse results are keyed by a hash of the page body, so a page that
+    has not changed is never parsed twice.
+    """
+
+    def __init__(self, directory, ttl=86400):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(os.path.join(directory, 'responses'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'parsed'), exist_ok=True)
+
+    def _path(self, kind, key, suffix):
+        return os.path.join(self.directory, kind, f"{key}{suffix}")
+
+    def load(self, url):
+        """Return the cached entry for a URL as a dict with its body, or None."""
+        key = hashlib.sha256(url.encode()).hexdigest()
+        try:
+            with open(self._path('responses', key, '.json'), 'rb') as f:
+                entry = json.load(f)
+            with open(self._path('responses', key, '.z'), 'rb') as f:
+                entry['body'] = zlib.decompress(f.read())
+        except (OSError, ValueError, zlib.error):
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry['fetched_at'] < self.ttl
+
+    def store(self, url, body, etag=None, last_modified=None):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        write_atomic(self._path('responses', key, '.z'), zlib.compress(body))
+        self.touch(url, etag, last_modified)
+
+    def touch(self, url, etag=None, last_modified=None):
+        """Record that the cached body for a URL was confirmed current just now."""
+        key = hashlib.sha256(url.encode()).hexdigest()
+        meta = {'url': url, 'etag': etag, 'last_modified': last_modified, 'fetched_at': time.time()}
+        write_atomic(self._path('responses', key, '.json'), json.dumps(meta).encode())
+
+    def parsed(self, body, parse, version):
+        """Return `parse(body)`, memoized on disk by a hash of the body and the parser version.
+
+        Returns a (details, hit) pair.
+        """
+        key = hashlib.sha256(body).hexdigest()
+        path = self._path('parsed', f"{key}-{version}", '.json')
+        try:
+            with open(path, 'rb') as f:
+                return json.load(f), True
+        except (OSError, ValueError):
+            pass
+        details = parse(body)
+        write_atomic(path, json.dumps(details).encode())
+        return details, False
+
+
+class Crawler:
+    """Fetch DRPS pages concurrently over a pooled keep-alive session."""
+
+    def __init__(self, max_workers=8, rate_limit=5.0, timeout=10.0, retries=3, backoff=0.5, cache=None,
+                 observer=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = HostRateLimiter(rate_limit)
+        self.cache = cache
+        # Cache effectiveness (fresh hits, 304 revalidations, misses and stale pages served on error) and retries
+        self.counters = Counter()
+        self.counters_lock = threading.Lock()
+        # Optional timing callback, called as observer('fetch', seconds, outcome=...) and
+        # observer('parse', seconds, cached=...)
+        self.observer = observer
+
+        # One session shared by every worker thread, with enough pooled connections for all of them.
+        # Retries are made by _get, not the adapter, so that each attempt waits for the rate limiter
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_config(cls, config, observer=None):
+        """Build a crawler from the Flask app config."""
+        cache = None
+        if config['CRAWLER_CACHE_DIR']:
+            cache = CrawlCache(config['CRAWLER_CACHE_DIR'], ttl=config['CRAWLER_CACHE_TTL'])
+        return cls(max_workers=config['CRAWLER_MAX_WORKERS'],
+                   rate_limit=config['CRAWLER_RATE_LIMIT'],
+                   timeout=config['CRAWLER_TIMEOUT'],
+                   retries=config['CRAWLER_RETRIES'],
+                   cache=cache,
+                   observer=observer)
+
+    def count(self, name):
+        with self.counters_lock:
+            self.counters[name] += 1
+
+    def fetch(self, url, revalidate=False):
+        """Fetch a single page, returning its body or None if it could not be fetched.
+
+        With `revalidate`, a cached copy is always checked with the server even if it is still fresh.
+        """
+        start = time.perf_counter()
+        body, outcome = self._fetch(url, revalidate)
+        if self.observer:
+            self.observer('fetch', time.perf_counter() - start, outcome=outcome)
+        return body
+
+    def _fetch(self, url, revalidate):
+        entry = self.cache.load(url) if self.cache else None
+        if entry and not revalidate and self.cache.is_fresh(entry):
+            self.count('cache_hits')
+            return entry['body'], 'hit'
+
+        # Revalidate a stale entry with a conditional GET
+        headers = {}
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            response = self._get(url, headers)
+            if response.status_code == 304 and entry:
+                self.count('cache_revalidated')
+                self.cache.touch(url, entry['etag'], entry['last_modified'])
+                return entry['body'], 'revalidated'
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning("Error fetching URL %s: %s", url, e, extra={'url': url})
+            if entry:
+                # Better a stale copy than no details at all
+                self.count('cache_stale')
+                return entry['body'], 'stale'
+            return None, 'error'
+
+        self.count('cache_misses')
+        if self.cache:
+            self.cache.store(url, response.content, response.headers.get('ETag'),
+                             response.headers.get('Last-Modified'))
+        return response.content, 'miss'
+
+    def _get(self, url, headers):
+        """GET a page, retrying failed connections and RETRY_STATUSES with exponential backoff.
+
+        Every attempt, retries included, waits for its turn with the host's rate limiter.
+        """
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.count('retries')
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            self.limiter.wait(url)
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                return response
+
+    def parse(self, body, parse, version):
+        """Parse a fetched page, reusing the memoized result when the cache has seen the same body."""
+        start = time.perf_counter()
+        if not self.cache or not body:
+            details, hit = parse(body), False
+        else:
+            details, hit = self.cache.parsed(body, parse, version)
+            self.count('parse_cache_hits' if hit else 'parse_cache_misses')
+        if self.observer:
+            self.observer('parse', time.perf_counter() - start, cached=hit)
+        return details
+
+    def fetch_many(self, urls, revalidate=False, window=None):
+        """Fetch pages concurrently, yielding (url, body) pairs as each one completes.
+
+        `urls` may be a generator. With `window`, at most that many fetches are queued or in
+        flight at a time and more urls are only read as earlier fetches complete.
+        """
+        urls = iter(urls)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.fetch, url, revalidate): url for url in itertools.islice(urls, window)}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                # Top up before yielding, so fetching carries on while the caller handles the results
+                for url in itertools.islice(urls, len(done)):
+                    futures[executor.submit(self.fetch, url, revalidate)] = url
+                for future in done:
+                    yield futures.pop(future), future.result()
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,54 @@
+import functools
+import time
+
+from flask import g, has_app_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql import Delete, Insert, Update
+
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    """Session that sends the reads of views marked with @read_replica to the replica bind.
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and has_app_context() and g.get('use_replica') and not self._flushing
+                and not isinstance(clause, (Insert, Update, Delete))):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_replica(view):
+    """Serve a read-only view from the replica, unless this client wrote something moments ago."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Read-your-writes: after a write, stay on the primary until the replica has caught up
+        g.use_replica = session.get('primary_until', 0) < time.time()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def stick_to_primary(seconds):
+    """Send this client's reads to the primary for `seconds` (call after a write)."""
+    if seconds > 0:
+        session['primary_until'] = time.time() + seconds
+
+
+def engine_options(database_url, config):
+    """SQLAlchemy engine options for `database_url` from the DB_* settings."""
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    if database_url and not database_url.startswith('sqlite'):
+        options['pool_size'] = config['DB_POOL_SIZE']
+        options['max_overflow'] = config['DB_MAX_OVERFLOW']
+        options['pool_timeout'] = config['DB_POOL_TIMEOUT']
+    if database_url and database_url.startswith('postgresql') and config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
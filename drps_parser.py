@@ -0,0 +1,164 @@
+import re
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401  (optional, faster tree builder)
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+# Bump whenever parse_course_page output changes, so memoized parse results are not reused
+PARSER_VERSION = 2
+
+# Course pages only carry data in the page title and the sitstablegrid tables,
+# so everything else can be skipped while the tree is being built
+COURSE_PAGE_STRAINER = SoupStrainer(['h1', 'table'])
+
+# Course links point at cx<code>.htm and read "Course Name (CODE)"
+COURSE_LINK_HREF = re.compile(r'cx([a-z]+\d+)\.htm', re.IGNORECASE)
+COURSE_LINK_TEXT = re.compile(r'\(([A-Z]+\d+)\)\s*$')
+
+
+def empty_details():
+    return {
+        'title': '',
+        'course_code': '',
+        'school': '',
+        'college': '',
+        'summary': '',
+        'course_description': '',
+        'assessment': '',
+        'learning_outcomes': '',
+        'total_hours': '',
+        'prerequisites': '',
+        'prohibited_combinations': '',
+        'prerequisite_codes': [],
+        'prohibited_codes': [],
+        'course_organizer': '',
+        'course_url': '',
+        'keywords': '',
+    }
+
+
+class Section:
+    """One captioned sitstablegrid table, with its rows and label -> cell pairs."""
+
+    def __init__(self, caption, table):
+        self.caption = caption
+        self.table = table
+        self.rows = table.find_all('tr')
+        self.pairs = []
+        for tr in self.rows:
+            cells = tr.find_all('td')
+            # Rows are laid out as label, value[, label, value]
+            for i in range(0, len(cells) - 1, 2):
+                self.pairs.append((cells[i].get_text(strip=True), cells[i + 1]))
+
+    def find(self, label):
+        """Yield every value cell whose label contains `label`."""
+        for text, cell in self.pairs:
+            if label in text:
+                yield cell
+
+
+class CoursePage:
+    """Index of a DRPS course page, built in a single walk over the document."""
+
+    def __init__(self, soup):
+        self.title = ''
+        self.sections = []
+        for tag in soup.find_all(['h1', 'table']):
+            if tag.name == 'h1':
+                if 'sitspagetitle' in tag.get('class', []) and not self.title:
+                    self.title = tag.get_text(strip=True)
+                continue
+            if 'sitstablegrid' not in tag.get('class', []):
+                continue
+            caption = tag.find('caption', recursive=False)
+            if caption:
+                self.sections.append(Section(caption.get_text(), tag))
+
+    def sections_for(self, caption):
+        """Yield every section whose caption contains `caption`."""
+        for section in self.sections:
+            if caption in section.caption:
+                yield section
+
+
+def course_link_codes(cell):
+    """Codes of the courses linked from a cell, in order and without repeats."""
+    codes = []
+    for a in cell.find_all('a'):
+        match = COURSE_LINK_HREF.search(a.get('href', '')) or COURSE_LINK_TEXT.search(a.get_text(strip=True))
+        if match and match.group(1).upper() not in codes:
+            codes.append(match.group(1).upper())
+    return codes
+
+
+def make_soup(content, features='html.parser', strain=True):
+    """Build a BeautifulSoup tree, using lxml and a SoupStrainer when asked for."""
+    if features == 'lxml' and not HAS_LXML:
+        features = 'html.parser'
+    return BeautifulSoup(content, features, parse_only=COURSE_PAGE_STRAINER if strain else None)
+
+
+def parse_course_page(content, features='html.parser', strain=True):
+    """Parse course details out of a University of Edinburgh DRPS course page."""
+    details = empty_details()
+    if not content:
+        return details
+
+    page = CoursePage(make_soup(content, features, strain))
+
+    # Course Title and Code
+    if '(' in page.title and ')' in page.title:
+        details['title'] = page.title.split('(')[0].strip()
+        details['course_code'] = page.title.split('(')[-1].strip(')')
+
+    for section in page.sections_for("Course Outline"):
+        for cell in section.find("School"):
+            details['school'] = cell.get_text(strip=True)
+        for cell in section.find("College"):
+            details['college'] = cell.get_text(strip=True)
+        for cell in section.find("Summary"):
+            details['summary'] = cell.get_text(" ", strip=True)
+        for cell in section.find("Course description"):
+            details['course_description'] = cell.get_text(" ", strip=True)
+
+    # Prerequisites and Prohibited Combinations are stored as the linked course names,
+    # and their codes feed the prerequisite graph
+    for section in page.sections_for("Entry Requirements"):
+        for cell in section.find("Pre-requisites"):
+            details['prerequisites'] = "; ".join(a.get_text(strip=True) for a in cell.find_all('a'))
+            details['prerequisite_codes'] = course_link_codes(cell)
+        for cell in section.find("Prohibited Combinations"):
+            details['prohibited_combinations'] = "; ".join(a.get_text(strip=True) for a in cell.find_all('a'))
+            details['prohibited_codes'] = course_link_codes(cell)
+
+    for section in page.sections_for("Learning Outcomes"):
+        outcome_list = section.table.find('ol')
+        if outcome_list:
+            details['learning_outcomes'] = " ".join(li.get_text(strip=True) for li in outcome_list.find_all('li'))
+
+    for section in page.sections_for("Assessment"):
+        assessment_data = section.table.find('td', colspan="14")
+        if assessment_data:
+            details['assessment'] = assessment_data.get_text(" ", strip=True)
+
+    for section in page.sections_for("Course Delivery Information"):
+        for tr in section.rows:
+            if "Total Hours" in tr.get_text():
+                details['total_hours'] = tr.find_all('td')[1].get_text(strip=True)
+
+    for section in page.sections_for("Additional Information"):
+        for cell in section.find("Course URL"):
+            details['course_url'] = cell.get_text(strip=True)
+        for cell in section.find("Keywords"):
+            details['keywords'] = cell.get_text(strip=True)
+
+    for section in page.sections_for("Contacts"):
+        for cell in section.find("Course organiser"):
+            details['course_organizer'] = cell.get_text(strip=True).split("Tel:")[0].strip()
+
+    return details
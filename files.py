@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+
+def write_atomic(path, data, mode=None):
+    """Write bytes or text (as UTF-8) to `path` so that readers see the old file or the new one, never a part.
+
+    The data goes to a temporary file in the same directory, which then replaces `path`.
+    `mode` sets the file's permissions, which are otherwise owner-only.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
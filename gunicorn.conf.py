@@ -0,0 +1,22 @@
+import os
+
+# Serving mode. With GUNICORN_THREADS > 1 gunicorn runs threaded (gthread) workers: each process
+# serves that many requests at once, so a request waiting on the database no longer blocks the
+# whole worker. Workers (WEB_CONCURRENCY) cost memory; threads cost little.
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+
+
+def post_worker_init(worker):
+    from app import app, warm_caches
+
+    # Every thread may hold a database connection at once
+    capacity = app.config['DB_POOL_SIZE'] + app.config['DB_MAX_OVERFLOW']
+    if worker.cfg.threads > capacity:
+        worker.log.warning("GUNICORN_THREADS=%d exceeds DB_POOL_SIZE + DB_MAX_OVERFLOW (%d); "
+                           "requests will queue for connections", worker.cfg.threads, capacity)
+
+    # Each worker holds its own copy of the in-memory indexes; build them before serving
+    stats = warm_caches()
+    worker.log.info("Autocomplete index: %d subjects, %d keys, %.0f KiB",
+                    stats['subjects'], stats['keys'], stats['bytes'] / 1024)
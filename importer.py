@@ -0,0 +1,411 @@
+import codecs
+import hashlib
+import io
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+
+from batching import chunks
+from catalogue import to_int
+from crawler import course_url
+from drps_parser import PARSER_VERSION, parse_course_page
+from models import db, Subject
+from prerequisites import save_links, subject_links, update_closure
+
+# Subject columns written by an import, besides the `code` key
+SUBJECT_COLUMNS = (
+    'name', 'period', 'credits', 'scqf', 'availability', 'school', 'college', 'summary',
+    'assessment', 'learning_outcomes', 'total_hours', 'prerequisites',
+    'prohibited_combinations', 'additional_costs', 'course_organizer', 'keywords', 'url',
+)
+# The subset of those columns that comes from the course page rather than the listing
+DETAIL_COLUMNS = (
+    'school', 'college', 'summary', 'assessment', 'learning_outcomes', 'total_hours',
+    'prerequisites', 'prohibited_combinations', 'additional_costs', 'course_organizer', 'keywords',
+)
+# The columns an import writes to an existing subject whose course page could not be fetched
+LISTING_UPDATE_COLUMNS = tuple(column for column in SUBJECT_COLUMNS if column not in DETAIL_COLUMNS)
+# Bookkeeping written alongside the data so later syncs can tell what changed
+TRACKING_COLUMNS = ('content_hash', 'fetched_at')
+
+
+class ImportStats:
+    """Running counters for one subject import."""
+
+    def __init__(self):
+        self.pages_total = 0
+        self.pages_fetched = 0
+        self.pages_parsed = 0
+        self.pages_failed = 0
+        self.subjects_inserted = 0
+        self.subjects_updated = 0
+        self.subjects_unchanged = 0
+        self.cache_hits = 0
+        self.cache_revalidated = 0
+        self.cache_misses = 0
+        self.parse_cache_hits = 0
+
+    def add_cache_counters(self, before, after):
+        """Record the crawler cache activity between two snapshots of its counters."""
+        for name in ('cache_hits', 'cache_revalidated', 'cache_misses', 'parse_cache_hits'):
+            setattr(self, name, after[name] - before[name])
+
+
+def fingerprint(content):
+    """Content hash of a fetched course page."""
+    return hashlib.sha256(content).hexdigest()
+
+
+def subject_details(details):
+    """Pick the Subject detail columns out of a parsed course page."""
+    return {column: details.get(column, '') for column in DETAIL_COLUMNS}
+
+
+class ListingParser(HTMLParser):
+    """Incremental DRPS listing parser: feed() it text and collect course rows from `rows`.
+
+    Each h3.scqf_level heading applies to the first table after it; every row of that table
+    after the header row with at least five cells is a course (code, availability, name,
+    period, credits). Only the row being read is held, never a document tree.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self.scqf = None
+        self.heading = None  # text of an open scqf_level heading
+        self.pending = False  # a heading was read and its table has not started yet
+        self.table_depth = 0  # nesting depth inside the heading's table
+        self.row_number = 0
+        self.cells = None  # texts of the open row's cells
+        self.cell = None  # text of the open cell
+        self.text = []  # the current text node, which can arrive in pieces across feed() calls
+
+    def handle_starttag(self, tag, attrs):
+        self._end_text()
+        if tag == 'h3' and 'scqf_level' in (dict(attrs).get('class') or '').split():
+            self.heading = []
+        elif tag == 'table':
+            if self.table_depth:
+                self.table_depth += 1
+            elif self.pending:
+                self.pending, self.table_depth, self.row_number = False, 1, 0
+        elif tag == 'tr' and self.table_depth == 1:
+            self._end_row()  # Rows and cells may be left unclosed
+            self.cells = []
+        elif tag == 'td' and self.cells is not None:
+            self._end_cell()
+            self.cell = []
+
+    def handle_endtag(self, tag):
+        self._end_text()
+        if tag == 'h3' and self.heading is not None:
+            self.scqf = ''.join(self.heading).split('(')[0].replace('SCQF Level', '').strip()
+            self.heading, self.pending = None, True
+        elif tag == 'td':
+            self._end_cell()
+        elif tag == 'tr' and self.table_depth == 1:
+            self._end_row()
+        elif tag == 'table' and self.table_depth:
+            self.table_depth -= 1
+            if not self.table_depth:
+                self._end_row()
+
+    def handle_data(self, data):
+        if self.heading is not None or self.cell is not None:
+            self.text.append(data)
+
+    def _end_text(self):
+        # Matches BeautifulSoup's get_text(strip=True): every text node stripped, then joined
+        if not self.text:
+            return
+        text = ''.join(self.text).strip()
+        self.text = []
+        if self.heading is not None:
+            self.heading.append(text)
+        if self.cell is not None:
+            self.cell.append(text)
+
+    def _end_cell(self):
+        if self.cell is not None:
+            self.cells.append(''.join(self.cell))
+            self.cell = None
+
+    def _end_row(self):
+        if self.cells is None:
+            return
+        self._end_cell()
+        cells, self.cells = self.cells, None
+        self.row_number += 1
+        if self.row_number == 1 or len(cells) < 5:  # The header row, or not a course
+            return
+        code, availability, name, period, credits = cells[:5]
+        try:
+            credits = int(credits)
+        except ValueError:
+            # Skip if credits cannot be converted to an integer
+            return
+        self.rows.append({
+            "name": name,
+            "code": code,
+            "period": period,
+            "credits": credits,
+            "scqf": self.scqf,
+            "availability": availability,
+        })
+
+
+def iter_listing(stream, chunk_size=64 * 1024):
+    """Yield the course rows of a DRPS listing read from a binary file object as they are parsed.
+
+    Memory stays bounded by `chunk_size` and the current row, however large the listing.
+    """
+    parser = ListingParser()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    while True:
+        chunk = stream.read(chunk_size)
+        parser.feed(decoder.decode(chunk, final=not chunk))
+        if not chunk:
+            parser.close()
+        rows, parser.rows = parser.rows, []
+        yield from rows
+        if not chunk:
+            return
+
+
+def parse_listing(content):
+    """Extract the course rows (code, availability, name, period, credits, scqf) from a DRPS listing page."""
+    return list(iter_listing(io.BytesIO(content)))
+
+
+def crawl_subjects(listing, crawler, base_url, parse=parse_course_page, stats=None, on_progress=None, window=500):
+    """Fetch every course page concurrently and yield each listing row merged with its course details.
+
+    `listing` can be a generator such as iter_listing(): rows are read as fetch slots free up,
+    so at most `window` rows and pages are in flight at once.
+    """
+    stats = stats or ImportStats()
+    counters_before = crawler.counters.copy()
+    rows = {}  # url -> listing row, for fetches in flight
+
+    def urls():
+        for row in listing:
+            url = course_url(row["code"], base_url)
+            stats.pages_total += 1
+            # Fetch each course once; a repeated row replaces the one waiting for the page
+            in_flight = url in rows
+            rows[url] = row
+            if not in_flight:
+                yield url
+
+    for url, content in crawler.fetch_many(urls(), window=window):
+        if content is None:
+            stats.pages_failed += 1
+        else:
+            stats.pages_fetched += 1
+        # Pages already seen with the same body reuse their memoized parse result
+        details = crawler.parse(content or b'', parse, PARSER_VERSION)
+        if content is not None:
+            stats.pages_parsed += 1
+        stats.add_cache_counters(counters_before, crawler.counters)
+        if on_progress:
+            on_progress(stats)
+
+        row = dict(
+            rows.pop(url),
+            **subject_details(details),
+            url=url,
+            content_hash=fingerprint(content) if content is not None else None,
+            fetched_at=datetime.now() if content is not None else None,
+        )
+        if content is not None:
+            row['links'] = subject_links(details)
+        yield row
+
+
+def _dialect_insert():
+    """Return the INSERT construct with ON CONFLICT support for the current database, if it has one."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+
+def _typed(subject):
+    # Listing text of the integer columns ('20', 'SCQF Level 8') as the numbers stored
+    return dict(subject, credits=to_int(subject.get('credits')), scqf=to_int(subject.get('scqf')))
+
+
+def _update_columns(subject):
+    # A row whose course page could not be fetched has no details to write: the subject keeps
+    # the details and fingerprint of the last page read, as it keeps its links
+    if subject.get('content_hash') is None:
+        return LISTING_UPDATE_COLUMNS
+    return SUBJECT_COLUMNS + TRACKING_COLUMNS
+
+
+def _changed(subject, existing, columns):
+    # Compare as text, so an empty string and NULL are the same value
+    return any(str(subject.get(column) or '') != str(existing[column] or '')
+               for column in columns if column in SUBJECT_COLUMNS)
+
+
+def save_subjects(subjects, update=False, batch_size=500, stats=None):
+    """Bulk insert new subjects and, with `update`, rewrite existing ones whose data changed.
+
+    Existing rows are prefetched with one IN query per batch, new rows go in as multi-row
+    INSERTs and changed rows as INSERT ... ON CONFLICT (code) DO UPDATE where supported.
+    Rows without a fetched course page (no content_hash) only update the listing's columns.
+    """
+    stats = stats or ImportStats()
+    # The same course can appear under several listing headings; the last row wins, here and
+    # wherever import rows are collected by code before they reach this point
+    by_code = {subject["code"]: _typed(subject) for subject in subjects}
+
+    existing = {}
+    for codes in chunks(list(by_code), batch_size):
+        rows = db.session.execute(
+            db.select(Subject.id, Subject.code, *[getattr(Subject, column) for column in SUBJECT_COLUMNS])
+            .where(Subject.code.in_(codes))
+        )
+        for row in rows:
+            existing[row.code] = row._mapping
+
+    now = datetime.now()
+    to_insert, to_update = [], {}  # to_update: columns written -> rows
+    for code, subject in by_code.items():
+        if code not in existing:
+            values = {column: subject.get(column) for column in SUBJECT_COLUMNS + TRACKING_COLUMNS}
+            to_insert.append(dict(values, code=code, created_at=now, updated_at=now))
+            continue
+        columns = _update_columns(subject)
+        if update and _changed(subject, existing[code], columns):
+            values = {column: subject.get(column) for column in columns}
+            to_update.setdefault(columns, []).append(dict(values, code=code, id=existing[code]['id'], updated_at=now))
+        else:
+            stats.subjects_unchanged += 1
+
+    insert = _dialect_insert()
+    for batch in chunks(to_insert, batch_size):
+        if insert is not None:
+            # Another import may have added some of these codes since the prefetch
+            result = db.session.execute(insert(Subject).values(batch).on_conflict_do_nothing(index_elements=['code']))
+            stats.subjects_inserted += result.rowcount
+            stats.subjects_unchanged += len(batch) - result.rowcount
+        else:
+            db.session.execute(db.insert(Subject).values(batch))
+            stats.subjects_inserted += len(batch)
+
+    for columns, rows in to_update.items():
+        for batch in chunks(rows, batch_size):
+            if insert is not None:
+                stmt = insert(Subject).values([{k: v for k, v in row.items() if k != 'id'} for row in batch])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['code'],
+                    set_={column: stmt.excluded[column] for column in columns + ('updated_at',)},
+                )
+                db.session.execute(stmt)
+            else:
+                # ORM bulk UPDATE by primary key: a list of dicts carrying 'id' runs as one
+                # executemany per set of columns written, as in sync_subjects and elsewhere
+                db.session.execute(db.update(Subject), batch)
+            stats.subjects_updated += len(batch)
+
+    # Prerequisite links of the rows written; rows whose page failed to fetch keep their old links
+    written = [row['code'] for row in to_insert + [row for rows in to_update.values() for row in rows]]
+    update_closure(save_links({code: by_code[code]['links'] for code in written if 'links' in by_code[code]}))
+    db.session.commit()
+    return stats
+
+
+def run_import(content, crawler, base_url, parse=parse_course_page, stats=None, on_progress=None,
+               update=False, batch_size=500):
+    """Parse a listing upload, crawl its course pages and save the subjects.
+
+    Rows stream from the parser through the crawler into save_subjects one batch at a time,
+    so memory does not grow with the size of the listing.
+    """
+    stats = stats or ImportStats()
+    listing = iter_listing(io.BytesIO(content))
+    subjects = crawl_subjects(listing, crawler, base_url, parse, stats, on_progress, window=batch_size)
+    for batch in chunks(subjects, batch_size):
+        save_subjects(batch, update=update, batch_size=batch_size, stats=stats)
+        if on_progress:
+            on_progress(stats)
+    return stats
+
+
+def sync_subjects(crawler, parse=parse_course_page, max_age=timedelta(days=1), dry_run=False,
+                  limit=None, batch_size=500):
+    """Re-fetch subjects last fetched more than `max_age` ago and write only the columns that changed.
+
+    Pages whose content hash matches the stored fingerprint are not parsed again. With `dry_run`
+    nothing is written. Returns a report with counts and, per changed subject, an old/new diff.
+    """
+    cutoff = datetime.now() - max_age
+    query = (
+        db.select(Subject.id, Subject.code, Subject.url, Subject.content_hash,
+                  *[getattr(Subject, column) for column in DETAIL_COLUMNS])
+        .where((Subject.fetched_at == None) | (Subject.fetched_at < cutoff))  # noqa: E711
+        .order_by(Subject.fetched_at.is_not(None), Subject.fetched_at)
+    )
+    if limit:
+        query = query.limit(limit)
+    stale = {row.url: row._mapping for row in db.session.execute(query)}
+
+    report = {'checked': len(stale), 'unchanged': 0, 'changed': 0, 'failed': 0, 'dry_run': dry_run, 'diffs': []}
+    updates, links = [], {}
+    now = datetime.now()
+    # Revalidate even pages the crawl cache still considers fresh: the point is to see the current source
+    for url, content in crawler.fetch_many(stale, revalidate=True):
+        current = stale[url]
+        if content is None:
+            report['failed'] += 1
+            continue
+
+        content_hash = fingerprint(content)
+        update = {'id': current['id'], 'fetched_at': now}
+        if content_hash == current['content_hash']:
+            report['unchanged'] += 1
+        else:
+            parsed = crawler.parse(content, parse, PARSER_VERSION)
+            details = subject_details(parsed)
+            links[current['code']] = subject_links(parsed)
+            changes = {column: {'old': current[column], 'new': value}
+                       for column, value in details.items() if (current[column] or '') != value}
+            update['content_hash'] = content_hash
+            update.update({column: change['new'] for column, change in changes.items()})
+            if changes:
+                update['updated_at'] = now
+                report['changed'] += 1
+                report['diffs'].append({'code': current['code'], 'changes': changes})
+            else:
+                report['unchanged'] += 1
+        updates.append(update)
+
+    if not dry_run:
+        for batch in chunks(updates, batch_size):
+            db.session.execute(db.update(Subject), batch)
+        update_closure(save_links(links))
+        db.session.commit()
+    return report
+
+
+def relink_subjects(crawler, parse=parse_course_page, batch_size=500):
+    """Re-read every subject's prerequisite links from its course page (from the crawl cache when fresh).
+
+    For subjects imported before links were recorded. Returns the number of subjects whose links changed.
+    """
+    codes = dict(db.session.execute(db.select(Subject.url, Subject.code).where(Subject.url.is_not(None))).all())
+    links = {}
+    for url, content in crawler.fetch_many(codes):
+        if content is not None:
+            links[codes[url]] = subject_links(crawler.parse(content, parse, PARSER_VERSION))
+    changed = 0
+    for batch in chunks(list(links.items()), batch_size):
+        changed += len(save_links(dict(batch)))
+        db.session.commit()
+    return changed
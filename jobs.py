@@ -0,0 +1,157 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from importer import ImportStats
+from models import db, ImportJob
+
+logger = logging.getLogger(__name__)
+
+# A running job whose worker has not checked in for this long is assumed dead and can be reclaimed
+JOB_LEASE = timedelta(minutes=5)
+# Renew the lease of a running job this often (seconds), whether or not it reports progress
+HEARTBEAT_INTERVAL = JOB_LEASE.total_seconds() / 5
+# Write progress counters back to the job row at most this often (seconds)
+PROGRESS_INTERVAL = 1.0
+# Longest error message kept on a failed job
+ERROR_LENGTH = 500
+
+
+def enqueue_import(content, filename=None, update_existing=False):
+    """Queue a listing upload for import and return the new job."""
+    job = ImportJob(payload=content, filename=filename, update_existing=update_existing, status='queued')
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def claim_next_job(worker_name):
+    """Atomically take the oldest queued (or abandoned) job, returning it or None."""
+    stale = datetime.now() - JOB_LEASE
+    candidate = ImportJob.query.filter(
+        (ImportJob.status == 'queued') |
+        ((ImportJob.status == 'running') & (ImportJob.heartbeat_at < stale))
+    ).order_by(ImportJob.id).with_for_update(skip_locked=True).first()
+    if candidate is None:
+        db.session.rollback()
+        return None
+
+    # Only one worker's conditional update can match, so the claim holds even without row locks
+    now = datetime.now()
+    claimed = ImportJob.query.filter_by(
+        id=candidate.id, status=candidate.status, heartbeat_at=candidate.heartbeat_at
+    ).update({'status': 'running', 'worker': worker_name, 'started_at': now, 'heartbeat_at': now},
+             synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return None
+    return db.session.get(ImportJob, candidate.id)
+
+
+class LeaseLost(Exception):
+    """The job was reclaimed by another worker while this one was running it."""
+
+
+def _update_held(job_id, worker_name, **values):
+    """Write `values` to a job only if `worker_name` still holds its lease, returning whether it did."""
+    result = db.session.execute(
+        db.update(ImportJob).where(ImportJob.id == job_id, ImportJob.worker == worker_name).values(**values))
+    db.session.commit()
+    return result.rowcount > 0
+
+
+def _keep_alive(app, job_id, worker_name, stop):
+    # Phases that report no progress (e.g. refreshing the similar subjects) must not outlast the lease.
+    # The thread has its own app context, so its own session, removed when the context ends
+    with app.app_context():
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                if not _update_held(job_id, worker_name, heartbeat_at=datetime.now()):
+                    return
+            except Exception:
+                db.session.rollback()
+                logger.warning("Heartbeat of import job %s failed", job_id, exc_info=True, extra={'job_id': job_id})
+
+
+def run_job(job, pipeline):
+    """Run `pipeline(content, stats, on_progress, update)` for a claimed job, recording progress and outcome.
+
+    A background thread renews the lease every HEARTBEAT_INTERVAL while the pipeline runs. Every
+    write is conditional on this worker still holding the lease: if another worker reclaimed the
+    job, progress reports stop the pipeline and the outcome is not recorded.
+    """
+    job_id, worker_name = job.id, job.worker
+    stats = ImportStats()
+    last_flush = [0.0]
+
+    def on_progress(stats):
+        if time.monotonic() - last_flush[0] < PROGRESS_INTERVAL:
+            return
+        last_flush[0] = time.monotonic()
+        if not _update_held(job_id, worker_name, **_counters(stats)):
+            raise LeaseLost(f"Import job {job_id} was reclaimed by another worker")
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_keep_alive, args=(current_app._get_current_object(), job_id, worker_name, stop),
+                                 daemon=True)
+    heartbeat.start()
+    outcome = {'status': 'done'}
+    try:
+        pipeline(job.payload, stats, on_progress, job.update_existing)
+    except Exception as e:
+        db.session.rollback()
+        # The status endpoint is public: it gets the message, the worker log the traceback
+        logger.exception("Import job %s failed", job_id, extra={'job_id': job_id})
+        outcome = {'status': 'failed', 'error': f"{type(e).__name__}: {e}"[:ERROR_LENGTH]}
+    finally:
+        stop.set()
+        heartbeat.join()
+
+    # A finished job is never run again, so the upload it was queued with need not be kept
+    if not _update_held(job_id, worker_name, payload=b'', finished_at=datetime.now(), **_counters(stats), **outcome):
+        logger.warning("Import job %s was reclaimed by another worker; its outcome here is discarded", job_id,
+                       extra={'job_id': job_id})
+    db.session.expire(job)
+    return job
+
+
+def _counters(stats):
+    return {
+        'pages_total': stats.pages_total,
+        'pages_fetched': stats.pages_fetched,
+        'pages_parsed': stats.pages_parsed,
+        'pages_failed': stats.pages_failed,
+        'subjects_inserted': stats.subjects_inserted,
+        'subjects_updated': stats.subjects_updated,
+        'subjects_unchanged': stats.subjects_unchanged,
+        'cache_hits': stats.cache_hits,
+        'cache_revalidated': stats.cache_revalidated,
+        'cache_misses': stats.cache_misses,
+        'parse_cache_hits': stats.parse_cache_hits,
+        'heartbeat_at': datetime.now(),
+    }
+
+
+def work(pipeline, poll_interval=2.0, once=False, on_job_done=None):
+    """Worker loop: claim and run import jobs until interrupted (or the queue is empty, with `once`).
+
+    `on_job_done` is called after every job, e.g. to publish the worker's metrics.
+    """
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+    while True:
+        job = claim_next_job(worker_name)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        logger.info("Running import job %s", job.id, extra={'job_id': job.id})
+        run_job(job, pipeline)
+        logger.info("Import job %s %s", job.id, job.status, extra={'job_id': job.id, 'status': job.status})
+        if on_job_done:
+            on_job_done()
@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from models import db, Subject, Review
+
+# Feed windows, newest first; None means all time (read from the aggregates on Subject)
+WINDOWS = {
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30),
+    'all': None,
+}
+WINDOW_LABELS = {'7d': 'Last 7 days', '30d': 'Last 30 days', 'all': 'All time'}
+
+Entry = namedtuple('Entry', 'id name review_count avg_rating score')
+
+
+def _window_totals(since):
+    """Per-subject (subject_id, review_count, rating_sum) for reviews since `since`, as a subquery."""
+    if since is None:
+        return db.select(
+            Subject.id.label('subject_id'), Subject.review_count, Subject.rating_sum,
+        ).where(Subject.review_count > 0).subquery()
+    return db.select(
+        Review.subject_id,
+        db.func.count(Review.id).label('review_count'),
+        db.func.sum(Review.rating).label('rating_sum'),
+    ).where(Review.created_at >= since).group_by(Review.subject_id).subquery()
+
+
+def build_window(since, size=5, prior_weight=5.0):
+    """Top `size` most-reviewed and highest-rated subjects among reviews since `since`.
+
+    Subjects are rated by a Bayesian average: every subject starts with `prior_weight`
+    pseudo-reviews at the window's mean rating, so a single 5-star review cannot outrank a
+    subject with many consistently good ones.
+    """
+    totals = _window_totals(since)
+    review_count, rating_sum = db.session.execute(db.select(
+        db.func.coalesce(db.func.sum(totals.c.review_count), 0),
+        db.func.coalesce(db.func.sum(totals.c.rating_sum), 0),
+    )).one()
+    if not review_count:
+        return {'most_reviewed': [], 'highest_rated': []}
+    mean = rating_sum / review_count
+
+    rating_sum = db.cast(totals.c.rating_sum, db.Float)
+    query = db.select(
+        Subject.id, Subject.name, totals.c.review_count,
+        (rating_sum / totals.c.review_count).label('avg_rating'),
+        ((rating_sum + prior_weight * mean) / (totals.c.review_count + prior_weight)).label('score'),
+    ).join(totals, totals.c.subject_id == Subject.id)
+    return {
+        'most_reviewed': [Entry(*row) for row in db.session.execute(
+            query.order_by(totals.c.review_count.desc(), Subject.id).limit(size))],
+        'highest_rated': [Entry(*row) for row in db.session.execute(
+            query.order_by(db.desc('score'), Subject.id).limit(size))],
+    }
+
+
+def build_leaderboards(size=5, prior_weight=5.0, now=None):
+    now = now or datetime.now()
+    return {name: build_window(now - window if window else None, size, prior_weight)
+            for name, window in WINDOWS.items()}
+
+
+class Leaderboards:
+    """Feed rankings for every window, rebuilt at most every `ttl` seconds.
+
+    Reviews added in this process count towards `refresh_after` so a burst of activity shows
+    up before the TTL runs out; reviews from other workers appear within `ttl`.
+    """
+
+    def __init__(self, ttl=60.0, refresh_after=20, size=5, prior_weight=5.0):
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.size = size
+        self.prior_weight = prior_weight
+        self.value = None
+        self.built_at = 0.0
+        self.pending_reviews = 0
+        self.lock = threading.Lock()
+
+    def _stale(self):
+        return (self.value is None or time.monotonic() - self.built_at >= self.ttl
+                or self.pending_reviews >= self.refresh_after)
+
+    def get(self, window='all'):
+        if self._stale():
+            with self.lock:
+                if self._stale():  # Double-checked, as in CatalogueCache.get
+                    self.pending_reviews = 0
+                    self.value = build_leaderboards(self.size, self.prior_weight)
+                    self.built_at = time.monotonic()
+        return self.value[window]
+
+    def record_reviews(self, count=1):
+        """Note reviews committed by this process."""
+        with self.lock:
+            self.pending_reviews += count
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(ttl=config['LEADERBOARD_TTL'], refresh_after=config['LEADERBOARD_REFRESH_REVIEWS'],
+                   prior_weight=config['LEADERBOARD_PRIOR_WEIGHT'])
@@ -0,0 +1,214 @@
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from files import write_atomic
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [(name, value) for name, value in zip(names, values)] + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [per-bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labels, key, [('le', _format_value(float(bound)))])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    """The metrics of this process, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+    def write_textfile(self, path):
+        """Write the metrics atomically for node_exporter's textfile collector (for batch processes)."""
+        # Readable by all: the exporter runs as another user
+        write_atomic(path, self.render(), mode=0o644)
+
+
+class Instrumentation:
+    """Request, query, template and crawler timings for one process.
+
+    Each gunicorn worker keeps its own metrics, so /metrics reports the worker that served the
+    scrape; label series by instance when scraping more than one. With `server_timing`, every
+    response also carries a Server-Timing header with its database and template time.
+    """
+
+    def __init__(self, slow_query_threshold=0.5, server_timing=False):
+        self.slow_query_threshold = slow_query_threshold
+        self.server_timing = server_timing
+        self.registry = Registry()
+        self.requests = self.registry.counter(
+            'http_requests_total', 'HTTP requests served.', ('route', 'method', 'status'))
+        self.request_duration = self.registry.histogram(
+            'http_request_duration_seconds', 'Time to serve a request.', ('route',))
+        self.request_queries = self.registry.histogram(
+            'http_request_queries', 'Database queries issued per request.', ('route',), QUERY_COUNT_BUCKETS)
+        self.request_query_duration = self.registry.histogram(
+            'http_request_query_duration_seconds', 'Time spent in database queries per request.', ('route',))
+        self.query_duration = self.registry.histogram(
+            'db_query_duration_seconds', 'Time to execute a database query.')
+        self.slow_queries = self.registry.counter(
+            'db_slow_queries_total', 'Queries slower than the slow query threshold.')
+        self.template_duration = self.registry.histogram(
+            'template_render_duration_seconds', 'Time to render a template.', ('template',))
+        self.crawler_fetch_duration = self.registry.histogram(
+            'crawler_fetch_duration_seconds', 'Time to fetch a course page.', ('outcome',))
+        self.crawler_parse_duration = self.registry.histogram(
+            'crawler_parse_duration_seconds', 'Time to parse a course page.', ('cached',))
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        # Every engine, including any read replica binds
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(Engine, 'handle_error', self._handle_error)
+
+    def observe_crawler(self, name, seconds, **labels):
+        """Crawler timing callback: name is 'fetch' or 'parse'."""
+        histogram = self.crawler_fetch_duration if name == 'fetch' else self.crawler_parse_duration
+        histogram.observe(seconds, **labels)
+
+    def _before_request(self):
+        g.request_started = time.perf_counter()
+        g.query_count = 0
+        g.query_time = 0.0
+        g.template_time = 0.0
+        g.template_starts = []
+
+    def _after_request(self, response):
+        if 'request_started' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        self.requests.inc(route=route, method=request.method, status=response.status_code)
+        self.request_duration.observe(elapsed, route=route)
+        self.request_queries.observe(g.query_count, route=route)
+        self.request_query_duration.observe(g.query_time, route=route)
+        if self.server_timing:
+            response.headers['Server-Timing'] = (
+                f'db;dur={g.query_time * 1000:.1f};desc="{g.query_count} queries", '
+                f'tpl;dur={g.template_time * 1000:.1f}, app;dur={elapsed * 1000:.1f}'
+            )
+        return response
+
+    def _before_render(self, sender, template, context, **extra):
+        if has_request_context() and 'template_starts' in g:
+            g.template_starts.append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        if has_request_context() and g.get('template_starts'):
+            elapsed = time.perf_counter() - g.template_starts.pop()
+            g.template_time += elapsed
+            self.template_duration.observe(elapsed, template=template.name or 'string')
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_starts', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_starts'].pop()
+        self.query_duration.observe(elapsed)
+        if has_request_context() and 'query_count' in g:
+            g.query_count += 1
+            g.query_time += elapsed
+        if elapsed >= self.slow_query_threshold:
+            self.slow_queries.inc()
+            where = f" ({request.method} {request.path})" if has_request_context() else ""
+            logger.warning("Slow query (%.1fms)%s: %s", elapsed * 1000, where, ' '.join(statement.split())[:1000])
+
+    def _handle_error(self, context):
+        # A failed statement never reaches after_cursor_execute
+        if context.connection is not None and context.connection.info.get('query_starts'):
+            context.connection.info['query_starts'].pop()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(slow_query_threshold=config['SLOW_QUERY_THRESHOLD_MS'] / 1000,
+                   server_timing=config['SERVER_TIMING'])
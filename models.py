@@ -1,8 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from flask_login import UserMixin
+from db_routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model, UserMixin):  
     id = db.Column(db.Integer, primary_key=True)
@@ -20,8 +21,8 @@ class Subject(db.Model):
     code = db.Column(db.String(50), nullable=False, unique=True)
     school = db.Column(db.String(200), nullable=True)
     college = db.Column(db.String(200), nullable=True)
-    scqf = db.Column(db.String(50), nullable=True)
-    credits = db.Column(db.String(50), nullable=True)
+    scqf = db.Column(db.Integer, nullable=True)
+    credits = db.Column(db.Integer, nullable=True)
     availability = db.Column(db.String(200), nullable=True)
     summary = db.Column(db.Text, nullable=True)
     assessment = db.Column(db.Text, nullable=True)
@@ -31,9 +32,37 @@ class Subject(db.Model):
     prohibited_combinations = db.Column(db.Text, nullable=True)
     additional_costs = db.Column(db.Text, nullable=True)
     course_organizer = db.Column(db.String(200), nullable=True)
+    keywords = db.Column(db.Text, nullable=True)
     period = db.Column(db.String(100), nullable=True)
     url = db.Column(db.String(500), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=True)  # sha256 of the course page last parsed
+    fetched_at = db.Column(db.DateTime, nullable=True, index=True)
+    updated_at = db.Column(db.DateTime, nullable=True, index=True)  # last import or sync that wrote the row
     created_at = db.Column(db.DateTime, default=datetime.now)
+    # Running review aggregates, kept in step with the Review table by ratings.py
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        # Keyset paging order of the subject listings
+        db.Index('ix_subject_name_id', 'name', 'id'),
+        # Home page filters, then the listing order, so a filtered page is one index range scan
+        db.Index('ix_subject_scqf_credits_period_name_id', 'scqf', 'credits', 'period', 'name', 'id'),
+    )
+
+    @property
+    def avg_rating(self):
+        return self.rating_sum / self.review_count if self.review_count else 0
+
+    @property
+    def rating_histogram(self):
+        """Number of reviews with each rating, from 1 to 5."""
+        return [self.rating_1, self.rating_2, self.rating_3, self.rating_4, self.rating_5]
 
     def __repr__(self):
         return f'<Subject {self.name}>'
@@ -44,10 +73,103 @@ class Review(db.Model):
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
     rating = db.Column(db.Integer, nullable=False)
     comment = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.now)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)  # windowed feed leaderboards
 
     user = db.relationship('User', backref='reviews', lazy=True)
     subject = db.relationship('Subject', backref='reviews', lazy=True)
 
+    __table_args__ = (
+        # A subject's reviews, newest first (keyset paged by reviews.list_reviews)
+        db.Index('ix_review_subject_id_created_at', 'subject_id', 'created_at', 'id'),
+        # One review per user and subject; also serves lookups by user
+        db.UniqueConstraint('user_id', 'subject_id', name='uq_review_user_id_subject_id'),
+    )
+
+    def __repr__(self):
+        return f'<Review {self.id}>'
+
+class SubjectLink(db.Model):
+    """A course named in another course's entry requirements, by code (it may not be imported yet)."""
+    subject_code = db.Column(db.String(50), primary_key=True)
+    kind = db.Column(db.String(20), primary_key=True)  # prerequisite, prohibited
+    target_code = db.Column(db.String(50), primary_key=True)
+
+    # Reverse lookups: which courses name this one
+    __table_args__ = (db.Index('ix_subject_link_target_code_kind', 'target_code', 'kind'),)
+
+class PrerequisiteClosure(db.Model):
+    """Every course in a course's prerequisite chain, `depth` links away; kept up to date by prerequisites.py."""
+    subject_code = db.Column(db.String(50), primary_key=True)
+    prerequisite_code = db.Column(db.String(50), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)  # 1 for direct prerequisites
+
+    # What a course unlocks, nearest first
+    __table_args__ = (db.Index('ix_prerequisite_closure_prerequisite_code_depth', 'prerequisite_code', 'depth'),)
+
+class SimilarSubject(db.Model):
+    """A subject's most similar subjects by the TF-IDF of their text, best first; built by similarity.py."""
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)  # 0 for the most similar
+    similar_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)  # cosine similarity, 0 to 1
+    # Entries are only ever inserted, so the newest of these moves whenever any list is rewritten
+    created_at = db.Column(db.DateTime, nullable=True, default=datetime.now, index=True)
+
+    # The lists a subject appears in, for incremental updates
+    __table_args__ = (db.Index('ix_similar_subject_similar_id', 'similar_id'),)
+
+class SimilarityDigest(db.Model):
+    """Digest of the text a subject's similar subjects were last computed from."""
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), primary_key=True)
+    digest = db.Column(db.String(40), nullable=False)
+
+class ImportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, done, failed
+    filename = db.Column(db.String(200), nullable=True)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    update_existing = db.Column(db.Boolean, nullable=False, default=False)
+    pages_total = db.Column(db.Integer, nullable=False, default=0)
+    pages_fetched = db.Column(db.Integer, nullable=False, default=0)
+    pages_parsed = db.Column(db.Integer, nullable=False, default=0)
+    pages_failed = db.Column(db.Integer, nullable=False, default=0)
+    subjects_inserted = db.Column(db.Integer, nullable=False, default=0)
+    subjects_updated = db.Column(db.Integer, nullable=False, default=0)
+    subjects_unchanged = db.Column(db.Integer, nullable=False, default=0)
+    cache_hits = db.Column(db.Integer, nullable=False, default=0)
+    cache_revalidated = db.Column(db.Integer, nullable=False, default=0)
+    cache_misses = db.Column(db.Integer, nullable=False, default=0)
+    parse_cache_hits = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    worker = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'filename': self.filename,
+            'update_existing': self.update_existing,
+            'pages_total': self.pages_total,
+            'pages_fetched': self.pages_fetched,
+            'pages_parsed': self.pages_parsed,
+            'pages_failed': self.pages_failed,
+            'subjects_inserted': self.subjects_inserted,
+            'subjects_updated': self.subjects_updated,
+            'subjects_unchanged': self.subjects_unchanged,
+            'cache_hits': self.cache_hits,
+            'cache_revalidated': self.cache_revalidated,
+            'cache_misses': self.cache_misses,
+            'parse_cache_hits': self.parse_cache_hits,
+            # Only the message: jobs that failed before tracebacks went to the worker log stored them
+            'error': self.error.strip().splitlines()[-1] if self.error else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
     def __repr__(self):
-        return f'<Review {self.id}>'
\ No newline at end of file
+        return f'<ImportJob {self.id} {self.status}>'
@@ -0,0 +1,183 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import has_request_context, make_response, request, session
+
+from auth import is_logged_in
+from files import write_atomic
+
+
+class MemoryBackend:
+    """Per-process LRU of rendered pages. Tag invalidations are only seen by this process."""
+
+    shared = False
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def tag_version(self, tag):
+        return self.tags.get(tag, '0')
+
+    def bump_tag(self, tag):
+        self.tags[tag] = uuid.uuid4().hex
+
+
+class FileSystemBackend:
+    """Rendered pages and tag versions in a directory shared by every worker on the host.
+
+    Writes are atomic (temp file + rename), so concurrent workers never read a partial entry.
+    Expired entries are swept every `sweep_every` stores.
+    """
+
+    shared = True
+
+    def __init__(self, directory, ttl=60.0, sweep_every=200):
+        self.directory = directory
+        self.ttl = ttl
+        self.sweep_every = sweep_every
+        self.stores = 0
+        os.makedirs(os.path.join(directory, 'entries'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'tags'), exist_ok=True)
+
+    def _path(self, kind, name):
+        return os.path.join(self.directory, kind, hashlib.sha256(name.encode()).hexdigest())
+
+    def _read(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get(self, key):
+        text = self._read(self._path('entries', key))
+        try:
+            return json.loads(text) if text else None
+        except ValueError:
+            return None
+
+    def set(self, key, entry):
+        write_atomic(self._path('entries', key), json.dumps(entry))
+        self.stores += 1
+        if self.stores % self.sweep_every == 0:
+            self.sweep()
+
+    def sweep(self):
+        cutoff = time.time() - self.ttl
+        entries = os.path.join(self.directory, 'entries')
+        for name in os.listdir(entries):
+            try:
+                if os.path.getmtime(os.path.join(entries, name)) < cutoff:
+                    os.remove(os.path.join(entries, name))
+            except FileNotFoundError:
+                pass
+
+    def tag_version(self, tag):
+        return self._read(self._path('tags', tag)) or '0'
+
+    def bump_tag(self, tag):
+        write_atomic(self._path('tags', tag), uuid.uuid4().hex)
+
+
+class PageCache:
+    """Cache of rendered GET responses, keyed by path, query args and login state.
+
+    Each cached view names the tags its page depends on (e.g. 'subject:3', 'feed'). An entry
+    records the tag versions it was rendered under and is discarded once any of them moves,
+    so writes evict exactly the pages they affect. `versions` maps tags whose version is
+    derived rather than bumped, like the catalogue stamp that moves on every import.
+    Responses carry an ETag, and a matching If-None-Match is answered with 304.
+
+    A per-process backend only evicts the pages of the worker that handled the write, so the
+    client that wrote skips the cache until the other workers' copies have expired.
+    """
+
+    def __init__(self, backend=None, ttl=60.0, versions=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.versions = versions or {}
+
+    def _tag_versions(self, tags):
+        return {tag: str(self.versions[tag]()) if tag in self.versions else self.backend.tag_version(tag)
+                for tag in tags}
+
+    def invalidate(self, *tags):
+        if self.backend is not None:
+            for tag in tags:
+                self.backend.bump_tag(tag)
+            if not self.backend.shared and has_request_context():
+                session['page_cache_until'] = time.time() + self.ttl
+
+    def cached(self, tags):
+        """Decorator for a view; `tags(**view_args)` lists the tags of the page it renders."""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(**kwargs):
+                # The cached templates only vary by login state, never by session contents
+                if (self.backend is None or request.method != 'GET'
+                        or session.get('page_cache_until', 0) > time.time()):
+                    return view(**kwargs)
+
+                variant = 'user' if is_logged_in() else 'anon'
+                key = f"{variant}:{request.full_path}"
+                versions = self._tag_versions(tags(**kwargs))
+                entry = self.backend.get(key)
+                if (entry is None or time.time() - entry['stored_at'] >= self.ttl
+                        or entry['versions'] != versions):
+                    response = make_response(view(**kwargs))
+                    if response.status_code != 200 or response.direct_passthrough:
+                        return response
+                    entry = {
+                        'body': response.get_data(as_text=True),
+                        'mimetype': response.mimetype,
+                        'etag': hashlib.sha1(response.get_data()).hexdigest(),
+                        'stored_at': time.time(),
+                        'versions': versions,
+                    }
+                    self.backend.set(key, entry)
+
+                response = make_response(entry['body'])
+                response.mimetype = entry['mimetype']
+                response.set_etag(entry['etag'])
+                response.cache_control.no_cache = True  # Browsers revalidate with If-None-Match
+                if variant == 'user':
+                    response.cache_control.private = True
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+    @classmethod
+    def from_config(cls, config, versions=None):
+        backend_name = config['PAGE_CACHE_BACKEND']
+        if backend_name == 'memory':
+            backend = MemoryBackend(config['PAGE_CACHE_SIZE'])
+        elif backend_name == 'filesystem':
+            backend = FileSystemBackend(config['PAGE_CACHE_DIR'], config['PAGE_CACHE_TTL'])
+        elif not backend_name:
+            backend = None
+        else:
+            raise ValueError(f"Unknown PAGE_CACHE_BACKEND {backend_name!r}")
+        return cls(backend, config['PAGE_CACHE_TTL'], versions)
@@ -0,0 +1,19 @@
+import base64
+import json
+
+
+def encode_cursor(*values):
+    """Opaque paging token for a position in a keyset-paged listing (its sort key values)."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, *types):
+    """The sort key values in a cursor, raising ValueError unless they match `types`."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as exc:
+        raise ValueError(f"Invalid cursor {cursor!r}") from exc
+    if (not isinstance(values, list) or len(values) != len(types)
+            or not all(isinstance(value, type_) for value, type_ in zip(values, types))):
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return values
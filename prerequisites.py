@@ -0,0 +1,175 @@
+from collections import defaultdict, namedtuple
+
+from batching import chunks
+from models import db, PrerequisiteClosure, Subject, SubjectLink
+
+# Link kinds, and the parsed course page field listing each kind's course codes
+LINK_KINDS = {'prerequisite': 'prerequisite_codes', 'prohibited': 'prohibited_codes'}
+# Codes per IN query and rows per INSERT
+BATCH_SIZE = 500
+
+LinkedCourse = namedtuple('LinkedCourse', 'code depth subject_id name')
+
+
+def subject_links(details):
+    """The {kind: [codes]} links of a parsed course page (or an import row carrying its codes)."""
+    return {kind: details.get(field) or [] for kind, field in LINK_KINDS.items()}
+
+
+def save_links(links_by_code):
+    """Replace the links of the given courses, in the caller's transaction.
+
+    `links_by_code` maps a course code to its subject_links(). Only links that differ from the
+    stored ones are written. Returns the codes whose prerequisites changed, for update_closure().
+    """
+    existing = defaultdict(set)
+    for codes in chunks(links_by_code, BATCH_SIZE):
+        for code, kind, target in db.session.execute(
+                db.select(SubjectLink.subject_code, SubjectLink.kind, SubjectLink.target_code)
+                .where(SubjectLink.subject_code.in_(codes))):
+            existing[code].add((kind, target))
+
+    to_insert, to_delete, changed = [], [], set()
+    for code, links in links_by_code.items():
+        wanted = {(kind, target) for kind, targets in links.items() for target in targets if target != code}
+        added, removed = wanted - existing[code], existing[code] - wanted
+        to_insert += [{'subject_code': code, 'kind': kind, 'target_code': target} for kind, target in added]
+        to_delete += [(code, kind, target) for kind, target in removed]
+        if any(kind == 'prerequisite' for kind, _ in added | removed):
+            changed.add(code)
+
+    for batch in chunks(to_delete, BATCH_SIZE):
+        db.session.execute(db.delete(SubjectLink).where(
+            db.tuple_(SubjectLink.subject_code, SubjectLink.kind, SubjectLink.target_code).in_(batch)))
+    for batch in chunks(to_insert, BATCH_SIZE):
+        db.session.execute(db.insert(SubjectLink), batch)
+    return changed
+
+
+def _load_prerequisites(codes, edges):
+    """Add the direct prerequisites of any of `codes` missing from `edges` (code -> [codes])."""
+    missing = [code for code in codes if code not in edges]
+    for code in missing:
+        edges[code] = []
+    for batch in chunks(missing, BATCH_SIZE):
+        for code, target in db.session.execute(
+                db.select(SubjectLink.subject_code, SubjectLink.target_code)
+                .where(SubjectLink.kind == 'prerequisite', SubjectLink.subject_code.in_(batch))):
+            edges[code].append(target)
+
+
+def _write_closure(codes):
+    """Insert the closure rows of `codes`: a breadth-first walk from all of them at once.
+
+    Each level of the walk fetches the prerequisites of every course it reached with one query
+    per BATCH_SIZE codes. Cycles in the source data are cut where they close.
+    """
+    edges = {}
+    frontiers = {code: {code} for code in codes}
+    seen = {code: {code} for code in codes}
+    rows, depth = [], 0
+    while frontiers:
+        depth += 1
+        _load_prerequisites(set().union(*frontiers.values()), edges)
+        next_frontiers = {}
+        for code, frontier in frontiers.items():
+            reached = {target for course in frontier for target in edges[course]} - seen[code]
+            if reached:
+                seen[code] |= reached
+                next_frontiers[code] = reached
+                rows += [{'subject_code': code, 'prerequisite_code': target, 'depth': depth} for target in reached]
+        frontiers = next_frontiers
+
+    for batch in chunks(rows, BATCH_SIZE):
+        db.session.execute(db.insert(PrerequisiteClosure), batch)
+    return len(rows)
+
+
+def update_closure(changed_codes):
+    """Recompute the closure of `changed_codes` and of every course whose chain passes through them.
+
+    Runs in the caller's transaction and returns the number of courses recomputed.
+    """
+    affected = set(changed_codes)
+    for codes in chunks(sorted(changed_codes), BATCH_SIZE):
+        affected.update(db.session.scalars(
+            db.select(PrerequisiteClosure.subject_code).where(PrerequisiteClosure.prerequisite_code.in_(codes))))
+    for codes in chunks(sorted(affected), BATCH_SIZE):
+        db.session.execute(db.delete(PrerequisiteClosure).where(PrerequisiteClosure.subject_code.in_(codes)))
+    if affected:
+        _write_closure(affected)
+    return len(affected)
+
+
+def rebuild_closure():
+    """Recompute the whole closure from the links, returning the number of closure rows."""
+    db.session.execute(db.delete(PrerequisiteClosure))
+    codes = db.session.scalars(
+        db.select(SubjectLink.subject_code).where(SubjectLink.kind == 'prerequisite').distinct()).all()
+    count = _write_closure(codes)
+    db.session.commit()
+    return count
+
+
+def _linked_courses(code_column, depth_column, where, order_by):
+    query = (db.select(code_column, depth_column, Subject.id, Subject.name)
+             .outerjoin(Subject, Subject.code == code_column).where(where).order_by(*order_by))
+    return [LinkedCourse(*row) for row in db.session.execute(query)]
+
+
+def prerequisite_chain(code):
+    """Every course that must be passed before `code`, nearest first."""
+    return _linked_courses(PrerequisiteClosure.prerequisite_code, PrerequisiteClosure.depth,
+                           PrerequisiteClosure.subject_code == code,
+                           (PrerequisiteClosure.depth, PrerequisiteClosure.prerequisite_code))
+
+
+def unlocks(code):
+    """Every course that has `code` somewhere in its prerequisite chain, nearest first."""
+    return _linked_courses(PrerequisiteClosure.subject_code, PrerequisiteClosure.depth,
+                           PrerequisiteClosure.prerequisite_code == code,
+                           (PrerequisiteClosure.depth, PrerequisiteClosure.subject_code))
+
+
+def prohibited_with(code):
+    """Courses that cannot be taken with `code`, as listed on either course."""
+    listed = db.select(SubjectLink.target_code.label('code')).where(
+        SubjectLink.subject_code == code, SubjectLink.kind == 'prohibited')
+    listing = db.select(SubjectLink.subject_code.label('code')).where(
+        SubjectLink.target_code == code, SubjectLink.kind == 'prohibited')
+    codes = db.union(listed, listing).subquery()
+    return _linked_courses(codes.c.code, db.literal(1), db.true(), (codes.c.code,))
+
+
+def check_plan(codes, completed=()):
+    """Check a study plan: `codes` in the order they will be taken, after the `completed` ones.
+
+    A course is missing prerequisites when one it links to is neither completed nor earlier in
+    the plan (every linked prerequisite counts as required), and two courses that prohibit each
+    other cannot both be taken. Costs one query per BATCH_SIZE courses.
+    """
+    plan = list(dict.fromkeys(codes))
+    everything = set(plan) | set(completed)
+    links = defaultdict(lambda: defaultdict(list))
+    for batch in chunks(sorted(everything), BATCH_SIZE):
+        for code, kind, target in db.session.execute(
+                db.select(SubjectLink.subject_code, SubjectLink.kind, SubjectLink.target_code)
+                .where(SubjectLink.subject_code.in_(batch))):
+            links[code][kind].append(target)
+
+    taken, missing = set(completed), {}
+    for code in plan:
+        needed = sorted(target for target in links[code]['prerequisite'] if target not in taken)
+        if needed:
+            missing[code] = needed
+        taken.add(code)
+
+    planned = set(plan)
+    prohibited = sorted({tuple(sorted((code, target))) for code in everything
+                         for target in links[code]['prohibited']
+                         if target in everything and (code in planned or target in planned)})
+    return {
+        'valid': not missing and not prohibited,
+        'missing_prerequisites': missing,
+        'prohibited_combinations': [list(pair) for pair in prohibited],
+    }
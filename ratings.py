@@ -0,0 +1,67 @@
+from collections import Counter
+
+from models import db, Subject, Review
+
+RATINGS = range(1, 6)
+AGGREGATE_COLUMNS = ('review_count', 'rating_sum') + tuple(f'rating_{rating}' for rating in RATINGS)
+
+
+def rating_deltas(ratings):
+    """Aggregate column increments for a batch of new ratings of one subject."""
+    histogram = Counter(ratings)
+    deltas = {'review_count': len(ratings), 'rating_sum': sum(ratings)}
+    deltas.update({f'rating_{rating}': count for rating, count in histogram.items()})
+    return deltas
+
+
+def add_ratings(subject_id, ratings):
+    """Add new reviews' ratings to a subject's aggregates, in the caller's transaction.
+
+    The increments are applied in the database (col = col + n), so concurrent reviews of the
+    same subject don't overwrite each other's counts. Returns False if there is no such subject.
+    """
+    deltas = rating_deltas(ratings)
+    result = db.session.execute(
+        db.update(Subject).where(Subject.id == subject_id)
+        .values({getattr(Subject, column): getattr(Subject, column) + amount for column, amount in deltas.items()})
+    )
+    return result.rowcount > 0
+
+
+def add_batch_ratings(ratings_by_subject):
+    """add_ratings for many subjects at once: a single executemany UPDATE for the whole batch."""
+    if not ratings_by_subject:
+        return
+    subject = Subject.__table__
+    params = []
+    for subject_id, ratings in ratings_by_subject.items():
+        deltas = dict.fromkeys(AGGREGATE_COLUMNS, 0)
+        deltas.update(rating_deltas(ratings))
+        params.append({'subject_id': subject_id, **{f'delta_{column}': deltas[column] for column in AGGREGATE_COLUMNS}})
+    # A Core statement, so the parameter sets go to the driver's executemany rather than ORM bulk update
+    db.session.execute(
+        db.update(subject).where(subject.c.id == db.bindparam('subject_id'))
+        .values({column: subject.c[column] + db.bindparam(f'delta_{column}') for column in AGGREGATE_COLUMNS}),
+        params,
+    )
+
+
+def rebuild_rating_aggregates(dry_run=False):
+    """Recompute every subject's aggregates from the Review table, returning the ids that were wrong."""
+    columns = [db.func.count(Review.id), db.func.coalesce(db.func.sum(Review.rating), 0)]
+    columns += [db.func.count(Review.id).filter(Review.rating == rating) for rating in RATINGS]
+    actual = {row[0]: dict(zip(AGGREGATE_COLUMNS, row[1:])) for row in db.session.execute(
+        db.select(Review.subject_id, *columns).group_by(Review.subject_id))}
+
+    stored = db.session.execute(db.select(Subject.id, *(getattr(Subject, column) for column in AGGREGATE_COLUMNS)))
+    empty = dict.fromkeys(AGGREGATE_COLUMNS, 0)
+    repairs = []
+    for row in stored:
+        values = actual.get(row[0], empty)
+        if tuple(row[1:]) != tuple(values[column] for column in AGGREGATE_COLUMNS):
+            repairs.append({'id': row[0], **values})
+
+    if repairs and not dry_run:
+        db.session.execute(db.update(Subject), repairs)
+        db.session.commit()
+    return [repair['id'] for repair in repairs]
@@ -0,0 +1,279 @@
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from batching import chunks
+from models import db, Review, Subject, User
+from paging import decode_cursor, encode_cursor
+from ratings import RATINGS, add_batch_ratings
+
+
+def review_cursor(review):
+    return encode_cursor(review.created_at.isoformat(), review.id)
+
+
+def list_reviews(subject_id, after=None, per_page=20):
+    """One page of a subject's reviews, newest first, as (reviews, next_cursor).
+
+    Keyset paging over (created_at, id) on the (subject_id, created_at, id) index, with each
+    review's author loaded in the same query.
+    """
+    query = (db.select(Review).where(Review.subject_id == subject_id)
+             .options(joinedload(Review.user).load_only(User.id, User.username)))
+    if after:
+        created_at, review_id = decode_cursor(after, str, int)
+        query = query.where(db.tuple_(Review.created_at, Review.id) < (datetime.fromisoformat(created_at), review_id))
+    query = query.order_by(Review.created_at.desc(), Review.id.desc()).limit(per_page + 1)
+
+    reviews = db.session.scalars(query).all()
+    next_cursor = review_cursor(reviews[per_page - 1]) if len(reviews) > per_page else None
+    return reviews[:per_page], next_cursor
+
+
+def review_dict(review):
+    return {
+        'id': review.id,
+        'rating': review.rating,
+        'comment': review.comment,
+        'created_at': review.created_at.isoformat() if review.created_at else None,
+        'user': {'id': review.user.id, 'username': review.user.username},
+    }
+
+
+class IngestStats:
+    """Running counters for one bulk review load."""
+
+    def __init__(self):
+        self.received = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.errors = []  # (record index, message)
+        self.subject_ids = set()  # subjects that gained reviews
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def reviews_per_sec(self):
+        return self.inserted / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self, max_errors=100):
+        return {
+            'received': self.received,
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'invalid': len(self.errors),
+            'errors': [{'index': index, 'error': message} for index, message in self.errors[:max_errors]],
+            'seconds': round(self.elapsed, 3),
+            'reviews_per_sec': round(self.reviews_per_sec, 1),
+        }
+
+
+def _parse_created_at(value):
+    """A record's ISO 'created_at' as a naive local datetime, like the ones datetime.now() stores."""
+    try:
+        created_at = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError("'created_at' must be an ISO 8601 timestamp.")
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone().replace(tzinfo=None)
+    if created_at > datetime.now():
+        raise ValueError("'created_at' must not be in the future.")
+    return created_at
+
+
+def _parse_record(record, user_id=None, keep_created_at=False):
+    """Validate one bulk review record, returning (user key, subject key, rating, comment, created_at).
+
+    Subjects are named by 'subject_id' or 'subject_code'; users by 'user_id' or 'username'
+    unless `user_id` fixes the author. 'created_at' is read only with `keep_created_at`, and
+    is otherwise None (the time of the insert). Raises ValueError for an invalid record.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("Each review must be an object.")
+    rating = record.get('rating')
+    if isinstance(rating, str) and rating.isdigit():
+        rating = int(rating)
+    if type(rating) is not int or rating not in RATINGS:
+        raise ValueError("'rating' must be an integer between 1 and 5.")
+    comment = record.get('comment')
+    if comment is not None and not isinstance(comment, str):
+        raise ValueError("'comment' must be a string.")
+    created_at = None
+    if keep_created_at and record.get('created_at') is not None:
+        created_at = _parse_created_at(record['created_at'])
+
+    if isinstance(record.get('subject_id'), int):
+        subject = ('id', record['subject_id'])
+    elif isinstance(record.get('subject_code'), str):
+        subject = ('code', record['subject_code'])
+    else:
+        raise ValueError("'subject_id' or 'subject_code' is required.")
+    if user_id is not None:
+        user = ('id', user_id)
+    elif isinstance(record.get('user_id'), int):
+        user = ('id', record['user_id'])
+    elif isinstance(record.get('username'), str):
+        user = ('username', record['username'])
+    else:
+        raise ValueError("'user_id' or 'username' is required.")
+    return user, subject, rating, comment, created_at
+
+
+def _prefetch(model, key_column, keys):
+    """Map ('id', id) and (key_column, value) keys to ids of rows that exist, in one query."""
+    ids = sorted(value for kind, value in keys if kind == 'id')
+    values = sorted(value for kind, value in keys if kind != 'id')
+    column = getattr(model, key_column)
+    found = {}
+    for row_id, value in db.session.execute(
+            db.select(model.id, column).where(db.or_(model.id.in_(ids), column.in_(values)))):
+        found[('id', row_id)] = row_id
+        found[(key_column, value)] = row_id
+    return found
+
+
+def _ingest_batch(batch, user_id=None, keep_created_at=False):
+    """Validate and insert one batch of (index, record) pairs, in the caller's transaction.
+
+    Returns (inserted rows, duplicates, errors). Nothing is committed.
+    """
+    errors, parsed = [], []
+    for index, record in batch:
+        try:
+            parsed.append((index, _parse_record(record, user_id, keep_created_at)))
+        except ValueError as e:
+            errors.append((index, str(e)))
+
+    subjects = _prefetch(Subject, 'code', {fields[1] for _, fields in parsed})
+    if user_id is not None:
+        users = {('id', user_id): user_id}  # The logged-in user, who exists
+    else:
+        users = _prefetch(User, 'username', {fields[0] for _, fields in parsed})
+
+    resolved = []
+    for index, (user, subject, rating, comment, created_at) in parsed:
+        if subject not in subjects:
+            errors.append((index, f"No subject with {subject[0]} {subject[1]!r}."))
+        elif user not in users:
+            errors.append((index, f"No user with {user[0]} {user[1]!r}."))
+        else:
+            resolved.append((users[user], subjects[subject], rating, comment, created_at))
+
+    # One review per (user, subject): skip pairs already reviewed, in the database or earlier in the batch
+    pairs = {(row[0], row[1]) for row in resolved}
+    seen = set(db.session.execute(
+        db.select(Review.user_id, Review.subject_id).where(db.tuple_(Review.user_id, Review.subject_id).in_(sorted(pairs)))
+    ).tuples()) if pairs else set()
+    rows, duplicates, now = [], 0, datetime.now()
+    for review_user_id, subject_id, rating, comment, created_at in resolved:
+        if (review_user_id, subject_id) in seen:
+            duplicates += 1
+            continue
+        seen.add((review_user_id, subject_id))
+        rows.append({'user_id': review_user_id, 'subject_id': subject_id, 'rating': rating,
+                     'comment': comment, 'created_at': created_at or now})
+
+    if rows:
+        db.session.execute(db.insert(Review), rows)
+        ratings_by_subject = defaultdict(list)
+        for row in rows:
+            ratings_by_subject[row['subject_id']].append(row['rating'])
+        add_batch_ratings(ratings_by_subject)
+    return rows, duplicates, errors
+
+
+def ingest_reviews(records, user_id=None, batch_size=500, on_batch=None, keep_created_at=False):
+    """Add reviews from an iterable of dicts, committing every `batch_size` records.
+
+    Records' 'created_at' is kept only with `keep_created_at`, for trusted loads of past
+    reviews; other reviews are dated now, so clients cannot backdate or pin them.
+
+    Each batch costs one subject query, one user query (none when `user_id` fixes the author),
+    one duplicate check, an executemany INSERT and one executemany aggregate UPDATE. Invalid
+    records and repeat reviews are counted and skipped. `on_batch(stats)` runs after each commit.
+    """
+    stats = IngestStats()
+    batch = []
+
+    def flush():
+        for attempt in range(2):
+            try:
+                rows, duplicates, errors = _ingest_batch(batch, user_id, keep_created_at)
+                db.session.commit()
+                break
+            except IntegrityError:
+                # Another writer added one of these reviews since the duplicate check; check again
+                db.session.rollback()
+                if attempt:
+                    raise
+        stats.inserted += len(rows)
+        stats.duplicates += duplicates
+        stats.errors.extend(sorted(errors))
+        stats.subject_ids.update(row['subject_id'] for row in rows)
+        batch.clear()
+        if on_batch:
+            on_batch(stats)
+
+    for index, record in enumerate(records):
+        stats.received += 1
+        batch.append((index, record))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return stats
+
+
+def remove_duplicate_reviews(batch_size=500):
+    """Delete all but each user's latest review of a subject, returning how many were deleted.
+
+    For reviews written before one review per user and subject was enforced. The latest review
+    (by created_at, then id) is the one kept. Rating aggregates are not adjusted.
+    """
+    position = db.func.row_number().over(partition_by=(Review.user_id, Review.subject_id),
+                                         order_by=(Review.created_at.desc().nulls_last(), Review.id.desc()))
+    ranked = db.select(Review.id, position.label('position')).subquery()
+    ids = db.session.scalars(db.select(ranked.c.id).where(ranked.c.position > 1).order_by(ranked.c.id)).all()
+    for batch in chunks(ids, batch_size):
+        db.session.execute(db.delete(Review).where(Review.id.in_(batch)))
+    db.session.commit()
+    return len(ids)
+
+
+class ReviewRateLimiter:
+    """Per-user token bucket: `rate` reviews a second, in bursts of up to `burst`, per worker."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}  # user id -> (tokens, updated)
+        self.lock = threading.Lock()
+
+    def take(self, user_id, count):
+        """Spend `count` tokens, returning 0 if allowed or the seconds to wait before retrying."""
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(user_id, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if count > tokens:
+                self.buckets[user_id] = (tokens, now)
+                return (count - tokens) / self.rate
+            self.buckets[user_id] = (tokens - count, now)
+            if len(self.buckets) > 10000:
+                # Drop users whose buckets have refilled
+                self.buckets = {key: (t, u) for key, (t, u) in self.buckets.items()
+                                if t + (now - u) * self.rate < self.burst}
+            return 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(rate=config['REVIEW_RATE_LIMIT'], burst=config['REVIEW_BULK_MAX'])
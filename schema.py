@@ -0,0 +1,119 @@
+from sqlalchemy.schema import AddConstraint, CreateColumn
+
+from catalogue import migrate_filter_columns
+from models import db
+from ratings import rebuild_rating_aggregates
+from reviews import remove_duplicate_reviews
+from search import POSTGRES_SEARCH_OBJECTS, create_search_indexes
+
+# The one way the schema changes: databases created before a model change are brought up to date
+# by `flask upgrade-schema`, whose steps are listed in upgrade_schema(). Each step checks what the
+# database already has, so the command is safe to run on every deploy. (There is no Alembic: its
+# autogenerate cannot convert the filter columns' text, and knows nothing of the search columns.)
+
+# Unique constraints added to tables that may already hold rows breaking them, with the
+# function that removes those rows (returning how many) before the constraint is created
+CONSTRAINT_CLEANUPS = {
+    'uq_review_user_id_subject_id': remove_duplicate_reviews,
+}
+
+
+def add_missing_columns():
+    """Add the model columns that existing tables lack, returning them as 'table.column'.
+
+    New columns are nullable or have a server default, so existing rows need no values.
+    """
+    connection = db.session.connection()
+    inspector = db.inspect(connection)
+    added = []
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                definition = CreateColumn(column).compile(dialect=connection.dialect)
+                db.session.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+                added.append(f"{table.name}.{column.name}")
+    db.session.commit()
+    return added
+
+
+def missing_unique_constraints():
+    """The named unique constraints of the models that existing tables lack."""
+    inspector = db.inspect(db.session.connection())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        existing = {constraint['name'] for constraint in inspector.get_unique_constraints(table.name)}
+        existing |= {index['name'] for index in inspector.get_indexes(table.name) if index['unique']}
+        missing += [constraint for constraint in table.constraints
+                    if isinstance(constraint, db.UniqueConstraint) and constraint.name
+                    and constraint.name not in existing]
+    return missing
+
+
+def create_unique_constraint(constraint):
+    """Add a unique constraint to an existing table (as a unique index on SQLite, which cannot)."""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        columns = ', '.join(column.name for column in constraint.columns)
+        db.session.execute(db.text(f"CREATE UNIQUE INDEX {constraint.name} ON {constraint.table.name} ({columns})"))
+    else:
+        db.session.execute(AddConstraint(constraint))
+    db.session.commit()
+
+
+def create_missing_indexes():
+    """Create the model indexes that existing tables lack, returning their names."""
+    connection = db.session.connection()
+    inspector = db.inspect(connection)
+    created = []
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                index.create(connection)
+                created.append(index.name)
+    db.session.commit()
+    return created
+
+
+def missing_search_objects():
+    """The Postgres search columns and indexes the subject table lacks (none on other databases)."""
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return set()
+    inspector = db.inspect(db.session.connection())
+    existing = {column['name'] for column in inspector.get_columns('subject')}
+    existing |= {index['name'] for index in inspector.get_indexes('subject')}
+    return POSTGRES_SEARCH_OBJECTS - existing
+
+
+def upgrade_schema():
+    """Bring the database up to the current models, returning a line for each change made.
+
+    In order: new tables come from create_all(), which leaves existing tables alone; columns
+    added to existing tables since they were created follow, then the conversion of the filter
+    columns to integers. Unique constraints come next, with rows that would break them removed
+    first, then indexes and the Postgres search columns. Last, the rating aggregates are checked
+    against the reviews and repaired: new aggregate columns start at zero, and removed reviews
+    must no longer count. Checking them every time also repairs a run that failed half way.
+    """
+    changes = []
+    db.create_all()
+    added = add_missing_columns()
+    changes += [f"Added column {name}." for name in added]
+    converted = migrate_filter_columns()
+    if converted:
+        changes.append(f"Converted the credits and SCQF levels of {converted} subjects to integers.")
+    for constraint in missing_unique_constraints():
+        cleanup = CONSTRAINT_CLEANUPS.get(constraint.name)
+        if cleanup:
+            count = cleanup()
+            changes.append(f"Removed {count} {constraint.table.name} rows breaking {constraint.name}.")
+        create_unique_constraint(constraint)
+        changes.append(f"Created unique constraint {constraint.name}.")
+    changes += [f"Created index {name}." for name in create_missing_indexes()]
+    if missing_search_objects():
+        create_search_indexes()
+        changes.append("Created the search columns and indexes.")
+    repaired = rebuild_rating_aggregates()
+    if repaired:
+        changes.append(f"Repaired the rating aggregates of {len(repaired)} subjects.")
+    return changes
@@ -0,0 +1,235 @@
+import heapq
+import re
+from bisect import bisect_left
+
+from models import db, Subject
+
+# Fields searched, with their weight in the ranking (and tsvector weight class on Postgres)
+SEARCH_FIELDS = (
+    ('name', 8, 'A'),
+    ('code', 8, 'A'),
+    ('keywords', 4, 'B'),
+    ('summary', 2, 'C'),
+    ('learning_outcomes', 1, 'D'),
+)
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Non-driving query terms are only walked through a tier when they match at most this many postings
+CHEAP_POSTINGS = 1000
+
+# Postgres: weighted document vectors, stored in generated columns so ranking does not
+# re-tokenize every matching row. name_vector covers only the top-weighted fields, so the
+# common case (the user is typing a subject name or code) ranks a small set of short vectors.
+SEARCH_VECTOR_SQL = " || ".join(
+    f"setweight(to_tsvector('simple', coalesce({field}, '')), '{weight_class}')"
+    for field, _, weight_class in SEARCH_FIELDS
+)
+NAME_VECTOR_SQL = " || ".join(
+    f"setweight(to_tsvector('simple', coalesce({field}, '')), '{weight_class}')"
+    for field, _, weight_class in SEARCH_FIELDS if weight_class == 'A'
+)
+
+POSTGRES_INDEX_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"ALTER TABLE subject ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({SEARCH_VECTOR_SQL}) STORED",
+    f"ALTER TABLE subject ADD COLUMN IF NOT EXISTS name_vector tsvector GENERATED ALWAYS AS ({NAME_VECTOR_SQL}) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_subject_search_vector ON subject USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_subject_name_vector ON subject USING gin (name_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_subject_name_trgm ON subject USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_subject_code_trgm ON subject USING gin (code gin_trgm_ops)",
+)
+
+# Created by create_search_indexes rather than the models, so migrations must not drop them
+POSTGRES_SEARCH_OBJECTS = {
+    'search_vector', 'name_vector', 'ix_subject_search_vector', 'ix_subject_name_vector',
+    'ix_subject_name_trgm', 'ix_subject_code_trgm',
+}
+
+# Name/code matches: word prefixes, or substrings through the trigram indexes
+POSTGRES_NAME_SEARCH_SQL = """
+    SELECT id, name, code FROM subject
+    WHERE name_vector @@ to_tsquery('simple', :tsquery)
+       OR name ILIKE :contains OR code ILIKE :contains
+    ORDER BY (name ILIKE :prefix OR code ILIKE :prefix) DESC,
+             ts_rank(name_vector, to_tsquery('simple', :tsquery)) DESC,
+             name
+    LIMIT :limit
+"""
+
+# Everything else, only needed when names alone do not fill the suggestions. Words common in
+# summaries can match most of the table, so only a bounded set of candidates is ranked.
+POSTGRES_TEXT_SEARCH_SQL = """
+    SELECT id, name, code FROM (
+        SELECT id, name, code, search_vector FROM subject
+        WHERE search_vector @@ to_tsquery('simple', :tsquery) AND NOT (id = ANY(:exclude))
+        LIMIT :candidates
+    ) AS candidates
+    ORDER BY ts_rank(search_vector, to_tsquery('simple', :tsquery)) DESC, name
+    LIMIT :limit
+"""
+TEXT_SEARCH_CANDIDATES = 200
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def _like_escape(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class InvertedIndex:
+    """In-process token -> subject index with prefix lookups over sorted vocabularies.
+
+    Postings are split by field weight ("tiers") and walked best tier first, so a query can stop
+    as soon as the lower-weighted fields could no longer change the top results. A forward index
+    (subject -> sorted tokens per tier) scores the other words of a multi-word query.
+    """
+
+    def __init__(self, rows):
+        self.weights = sorted({weight for _, weight, _ in SEARCH_FIELDS}, reverse=True)
+        tier_of = {field: self.weights.index(weight) for field, weight, _ in SEARCH_FIELDS}
+        postings = [{} for _ in self.weights]
+        self.names = {}
+        self.codes = {}
+        self.forward = {}
+        for row in rows:
+            self.names[row.id] = row.name
+            self.codes[row.id] = row.code
+            tokens = [set() for _ in self.weights]
+            for field, _, _ in SEARCH_FIELDS:
+                tokens[tier_of[field]].update(tokenize(getattr(row, field)))
+            for tier, tier_tokens in enumerate(tokens):
+                for token in tier_tokens:
+                    postings[tier].setdefault(token, []).append(row.id)
+            self.forward[row.id] = [sorted(tier_tokens) for tier_tokens in tokens]
+        self.vocabulary = [sorted(tier_postings) for tier_postings in postings]
+        self.postings = [[tier_postings[token] for token in vocabulary]
+                         for tier_postings, vocabulary in zip(postings, self.vocabulary)]
+
+    @classmethod
+    def from_database(cls):
+        fields = [getattr(Subject, field) for field, _, _ in SEARCH_FIELDS if field not in ('name', 'code')]
+        return cls(db.session.execute(db.select(Subject.id, Subject.name, Subject.code, *fields)))
+
+    def _tier_matches(self, tier, prefix):
+        """Yield (posting list, exact) for every token in a tier starting with `prefix`."""
+        vocabulary = self.vocabulary[tier]
+        i = bisect_left(vocabulary, prefix)
+        while i < len(vocabulary) and vocabulary[i].startswith(prefix):
+            yield self.postings[tier][i], vocabulary[i] == prefix
+            i += 1
+
+    def _term_score(self, subject_id, term):
+        """Score of one query term for one subject: its best tier weight, +1 for a whole-word match."""
+        for tier, tokens in enumerate(self.forward[subject_id]):
+            i = bisect_left(tokens, term)
+            if i < len(tokens) and tokens[i].startswith(term):
+                return self.weights[tier] + (1 if tokens[i] == term else 0)
+        return 0
+
+    def search(self, query, limit=10):
+        """Subjects matching every query term as a word prefix, best first, as (id, name, code)."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        # The rarest term drives the search through every tier, which guarantees every match
+        # is seen. Other terms are walked too while their postings in a tier are cheap, which
+        # tightens the bound below and lets the search stop sooner.
+        sizes = {term: [sum(len(ids) for ids, _ in self._tier_matches(tier, term)) for tier in range(len(self.weights))]
+                 for term in terms}
+        driver = min(terms, key=lambda term: sum(sizes[term]))
+        complete = dict.fromkeys(terms, True)
+        best_term_score = self.weights[0] + 1
+
+        scores = {}
+        seen = set()
+        for tier, weight in enumerate(self.weights):
+            # A subject not seen yet scores at most weight + 1 for each term walked through every
+            # tier so far (and the best possible score for the others). Once the current top
+            # `limit` all beat that, the remaining tiers cannot change the result.
+            bound = sum(weight + 1 if complete[term] else best_term_score for term in terms)
+            if len(scores) >= limit and heapq.nlargest(limit, scores.values())[-1] > bound:
+                break
+            for term in terms:
+                if term != driver and sizes[term][tier] > CHEAP_POSTINGS:
+                    complete[term] = False
+                    continue
+                # A term walked through every higher tier without meeting these subjects scores
+                # straight from the posting. One skipped in a higher tier may match them there,
+                # so it is scored from the forward index like the other terms.
+                walked = complete[term]
+                others = [other for other in terms if other != term or not walked]
+                # Exact matches come first in the vocabulary, so they are seen (and scored) first
+                for subject_ids, exact in self._tier_matches(tier, term):
+                    term_score = weight + (1 if exact else 0) if walked else 0
+                    for subject_id in subject_ids:
+                        if subject_id in seen:
+                            continue
+                        seen.add(subject_id)
+                        total = term_score
+                        for other in others:
+                            other_score = self._term_score(subject_id, other)
+                            if not other_score:
+                                break
+                            total += other_score
+                        else:
+                            scores[subject_id] = total
+
+        ranked = heapq.nsmallest(limit, scores, key=lambda subject_id: (-scores[subject_id], self.names[subject_id]))
+        return [(subject_id, self.names[subject_id], self.codes[subject_id]) for subject_id in ranked]
+
+
+# Databases create_search_indexes has been run on, once seen to have its columns
+_indexed_binds = set()
+
+
+def has_search_indexes(bind):
+    """Whether the subject table has the search columns created by create_search_indexes."""
+    if bind not in _indexed_binds:
+        columns = {column['name'] for column in db.inspect(bind).get_columns('subject')}
+        if not {'search_vector', 'name_vector'} <= columns:
+            return False
+        _indexed_binds.add(bind)
+    return True
+
+
+def create_search_indexes():
+    """Create the Postgres full-text and trigram indexes (no-op on other databases)."""
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return False
+    for statement in POSTGRES_INDEX_DDL:
+        db.session.execute(db.text(statement))
+    db.session.commit()
+    return True
+
+
+def search_subjects(query, index_cache, limit=10):
+    """Ranked prefix search over subject name, code, keywords, summary and learning outcomes.
+
+    Uses the full-text/trigram indexes on Postgres and the in-process inverted index elsewhere,
+    or on a Postgres database the search columns have not been created on yet.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return []
+    bind = db.session.get_bind()
+    if bind.dialect.name == 'postgresql' and has_search_indexes(bind):
+        tsquery = " & ".join(f"{term}:*" for term in terms)
+        results = [tuple(row) for row in db.session.execute(db.text(POSTGRES_NAME_SEARCH_SQL), {
+            'tsquery': tsquery,
+            'contains': f"%{_like_escape(query.strip())}%",
+            'prefix': f"{_like_escape(query.strip())}%",
+            'limit': limit,
+        })]
+        if len(results) < limit:
+            results += [tuple(row) for row in db.session.execute(db.text(POSTGRES_TEXT_SEARCH_SQL), {
+                'tsquery': tsquery,
+                'exclude': [subject_id for subject_id, _, _ in results],
+                'candidates': TEXT_SEARCH_CANDIDATES,
+                'limit': limit - len(results),
+            })]
+        return results
+    return index_cache.get().search(query, limit)
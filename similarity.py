@@ -0,0 +1,202 @@
+import hashlib
+import math
+from collections import Counter, defaultdict, namedtuple
+
+import numpy as np
+from scipy import sparse
+
+from batching import chunks
+from models import db, SimilarityDigest, SimilarSubject, Subject
+from search import TOKEN_RE
+
+# Text compared, with the weight of each field's terms
+SIMILARITY_FIELDS = (('name', 2.0), ('keywords', 2.0), ('summary', 1.0), ('learning_outcomes', 1.0))
+# Terms in fewer subjects than MIN_DF cannot make two subjects similar; terms in more than
+# MAX_DF of them are too common to tell subjects apart
+MIN_DF = 2
+MAX_DF = 0.5
+# Similarity scores held at once: subjects are scored against the catalogue this many at a time
+BLOCK_SCORES = 2 ** 23
+# Rows per INSERT and ids per IN query
+BATCH_SIZE = 500
+
+SimilarCourse = namedtuple('SimilarCourse', 'subject_id name code score')
+
+
+def _load_subjects():
+    """(ids, documents, digests) of every subject in id order; a document is its SIMILARITY_FIELDS texts."""
+    ids, documents, digests = [], [], []
+    columns = [getattr(Subject, field) for field, _ in SIMILARITY_FIELDS]
+    for subject_id, *texts in db.session.execute(db.select(Subject.id, *columns).order_by(Subject.id)):
+        texts = [text or '' for text in texts]
+        ids.append(subject_id)
+        documents.append(texts)
+        digests.append(hashlib.sha1('\x1f'.join(texts).encode()).hexdigest())
+    return ids, documents, digests
+
+
+def tfidf_matrix(documents):
+    """Unit-length TF-IDF rows of `documents`, as a float32 CSR matrix with one row per document.
+
+    Term frequencies are weighted by field and dampened (1 + log tf); terms outside the
+    MIN_DF and MAX_DF document frequency bounds are left out.
+    """
+    counts, df = [], Counter()
+    for texts in documents:
+        terms = Counter()
+        for text, (_, weight) in zip(texts, SIMILARITY_FIELDS):
+            for token in TOKEN_RE.findall(text.lower()):
+                terms[token] += weight
+        counts.append(terms)
+        df.update(terms.keys())
+
+    n = len(documents)
+    max_df = max(MAX_DF * n, MIN_DF)
+    vocabulary = {term: i for i, term in enumerate(sorted(term for term, count in df.items()
+                                                          if MIN_DF <= count <= max_df))}
+    idf = {term: math.log((1 + n) / (1 + df[term])) + 1 for term in vocabulary}
+
+    indptr, indices, data = [0], [], []
+    for terms in counts:
+        weights = {vocabulary[term]: (1 + math.log(tf)) * idf[term] for term, tf in terms.items() if term in vocabulary}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        for column in sorted(weights):
+            indices.append(column)
+            data.append(weights[column] / norm)
+        indptr.append(len(indices))
+    return sparse.csr_matrix((np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32),
+                              np.array(indptr, dtype=np.int64)), shape=(n, len(vocabulary)))
+
+
+def _score_blocks(matrix, positions):
+    """Yield (positions, scores) blocks: the cosine similarity of those rows to every row, self excluded.
+
+    Common terms make most scores non-zero, so each block is scored as the sparse matrix times
+    the block's rows as a dense array, which costs the same however many terms subjects share.
+    """
+    size = max(1, BLOCK_SCORES // max(matrix.shape[0], 1))
+    for start in range(0, len(positions), size):
+        block = np.asarray(positions[start:start + size])
+        scores = np.ascontiguousarray((matrix @ matrix[block].T.toarray()).T)
+        scores[np.arange(len(block)), block] = 0
+        yield block, scores
+
+
+def _top(scores, k):
+    """The `k` best (columns, scores) of each row of a score block, best first, ties by column."""
+    k = min(k, scores.shape[1] - 1)
+    if k <= 0:
+        return np.empty((len(scores), 0), dtype=np.int64), np.empty((len(scores), 0), dtype=scores.dtype)
+    columns = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best = np.take_along_axis(scores, columns, axis=1)
+    order = np.lexsort((columns, -best), axis=1)
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(best, order, axis=1)
+
+
+def _list_rows(subject_id, entries):
+    return [{'subject_id': subject_id, 'rank': rank, 'similar_id': similar_id, 'score': score}
+            for rank, (score, similar_id) in enumerate(entries)]
+
+
+def update_similar_subjects(k=10, full=False):
+    """Bring every subject's list of its `k` most similar subjects up to date with their text.
+
+    The whole catalogue is vectorised each time, since term weights depend on every subject,
+    but only subjects whose text changed since the last update are scored against it, along
+    with subjects whose lists held one of them. Any other list just takes in a changed subject
+    that now beats its last entry, and keeps the scores it had. `full` rescores every subject
+    (after large imports, or to change `k`). Returns the number of lists written.
+    """
+    ids, documents, digests = _load_subjects()
+    current = dict(zip(ids, digests))
+    stored = dict(db.session.execute(db.select(SimilarityDigest.subject_id, SimilarityDigest.digest)).all())
+    changed = set(ids) if full else {subject_id for subject_id, digest in current.items()
+                                     if stored.get(subject_id) != digest}
+    removed = set(stored) - set(current)
+    if not changed and not removed:
+        return 0
+
+    # Lists that held a changed or removed subject may have lost it, so they are rebuilt from scratch
+    stale = set(changed)
+    if full:
+        db.session.execute(db.delete(SimilarSubject))
+    else:
+        for batch in chunks(sorted(changed | removed), BATCH_SIZE):
+            stale.update(db.session.scalars(
+                db.select(SimilarSubject.subject_id).where(SimilarSubject.similar_id.in_(batch))))
+        stale -= removed
+        for batch in chunks(sorted(stale | removed), BATCH_SIZE):
+            db.session.execute(db.delete(SimilarSubject).where(SimilarSubject.subject_id.in_(batch)))
+
+    # The score a changed subject must beat to enter each other list: its last entry's, or 0 with room to spare
+    position = {subject_id: i for i, subject_id in enumerate(ids)}
+    floors = np.zeros(len(ids), dtype=np.float32)
+    if not full:
+        for subject_id, entries, lowest in db.session.execute(
+                db.select(SimilarSubject.subject_id, db.func.count(), db.func.min(SimilarSubject.score))
+                .group_by(SimilarSubject.subject_id)):
+            if entries >= k and subject_id in position:
+                floors[position[subject_id]] = lowest
+    floors[[position[subject_id] for subject_id in stale]] = np.inf
+
+    matrix = tfidf_matrix(documents)
+    candidates = defaultdict(list)  # other list's subject id -> [(score, changed subject id)]
+    for block, scores in _score_blocks(matrix, sorted(position[subject_id] for subject_id in stale)):
+        rows = []
+        for row, (columns, best) in zip(block, zip(*_top(scores, k))):
+            rows += _list_rows(ids[row], [(float(score), ids[column]) for column, score in zip(columns, best) if score > 0])
+        for batch in chunks(rows, BATCH_SIZE):
+            db.session.execute(db.insert(SimilarSubject), batch)
+        if not full:
+            for i, row in enumerate(block):
+                if ids[row] in changed:
+                    for column in np.flatnonzero(scores[i] > floors):
+                        candidates[ids[column]].append((float(scores[i, column]), ids[row]))
+
+    # Merge the newcomers into the other lists, keeping the best k
+    for batch in chunks(sorted(candidates), BATCH_SIZE):
+        lists = defaultdict(list)
+        for subject_id, similar_id, score in db.session.execute(
+                db.select(SimilarSubject.subject_id, SimilarSubject.similar_id, SimilarSubject.score)
+                .where(SimilarSubject.subject_id.in_(batch))):
+            lists[subject_id].append((score, similar_id))
+        db.session.execute(db.delete(SimilarSubject).where(SimilarSubject.subject_id.in_(batch)))
+        rows = []
+        for subject_id in batch:
+            entries = sorted(lists[subject_id] + candidates[subject_id], key=lambda entry: (-entry[0], entry[1]))
+            rows += _list_rows(subject_id, entries[:k])
+        for rows_batch in chunks(rows, BATCH_SIZE):
+            db.session.execute(db.insert(SimilarSubject), rows_batch)
+
+    if full:
+        db.session.execute(db.delete(SimilarityDigest))
+    else:
+        for batch in chunks(sorted(changed | removed), BATCH_SIZE):
+            db.session.execute(db.delete(SimilarityDigest).where(SimilarityDigest.subject_id.in_(batch)))
+    for batch in chunks(sorted(changed), BATCH_SIZE):
+        db.session.execute(db.insert(SimilarityDigest),
+                           [{'subject_id': subject_id, 'digest': current[subject_id]} for subject_id in batch])
+    db.session.commit()
+    return len(stale) + len(candidates)
+
+
+def similarity_stamp():
+    """A cheap fingerprint of the similar subjects lists that changes whenever any list is rewritten.
+
+    Lists are rewritten by deleting their entries and inserting new ones, so (count, newest
+    created_at) moves on every update, in whichever process made it.
+    """
+    return tuple(db.session.execute(
+        db.select(db.func.count(), db.func.max(SimilarSubject.created_at)).select_from(SimilarSubject)
+    ).one())
+
+
+def similar_subjects(subject_id, limit=None):
+    """A subject's similar subjects, most similar first: one primary key range scan of its list."""
+    query = (db.select(Subject.id, Subject.name, Subject.code, SimilarSubject.score)
+             .join(Subject, Subject.id == SimilarSubject.similar_id)
+             .where(SimilarSubject.subject_id == subject_id)
+             .order_by(SimilarSubject.rank))
+    if limit:
+        query = query.limit(limit)
+    return [SimilarCourse(*row) for row in db.session.execute(query)]
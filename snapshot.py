@@ -0,0 +1,221 @@
+import functools
+import json
+import os
+import re
+import signal
+import tarfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from batching import chunks
+from crawler import DEFAULT_BASE_URL, course_url
+from drps_parser import parse_course_page
+from files import write_atomic
+from importer import ImportStats, fingerprint, iter_listing, save_subjects, subject_details
+from prerequisites import subject_links
+
+# Saved course pages keep DRPS's cx<code>.htm names; every other .htm/.html page is a listing
+COURSE_PAGE_NAME = re.compile(r'^cx([a-z]+\d+)\.html?$', re.IGNORECASE)
+PAGE_NAME = re.compile(r'\.html?$', re.IGNORECASE)
+
+
+class Snapshot:
+    """Saved DRPS pages in a directory, a tar archive (optionally compressed) or a zip archive.
+
+    Pages are always read in the same order (sorted names, or archive order for tar, which
+    can only be read front to back cheaply), so a position in that order can be checkpointed.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        if os.path.isdir(self.path):
+            self.kind = 'directory'
+        elif tarfile.is_tarfile(self.path):
+            self.kind = 'tar'
+        elif zipfile.is_zipfile(self.path):
+            self.kind = 'zip'
+        else:
+            raise ValueError(f"{path} is not a directory, tar or zip archive")
+
+    def signature(self):
+        """Changes whenever the snapshot does, so a checkpoint is only resumed against the same pages."""
+        if self.kind != 'directory':
+            stat = os.stat(self.path)
+            return f"{self.kind}:{stat.st_size}:{stat.st_mtime_ns}"
+        count, newest = 0, 0
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                count += 1
+                newest = max(newest, os.stat(os.path.join(root, name)).st_mtime_ns)
+        return f"directory:{count}:{newest}"
+
+    def pages(self):
+        """Yield (name, binary file object) for every .htm/.html page, in the snapshot's order."""
+        if self.kind == 'directory':
+            for root, dirs, files in os.walk(self.path):
+                dirs.sort()
+                for name in sorted(files):
+                    if PAGE_NAME.search(name):
+                        with open(os.path.join(root, name), 'rb') as f:
+                            yield name, f
+        elif self.kind == 'tar':
+            with tarfile.open(self.path, 'r:*') as archive:
+                for member in archive:
+                    if member.isfile() and PAGE_NAME.search(member.name):
+                        yield os.path.basename(member.name), archive.extractfile(member)
+        else:
+            with zipfile.ZipFile(self.path) as archive:
+                for name in sorted(archive.namelist()):
+                    if PAGE_NAME.search(name) and not name.endswith('/'):
+                        with archive.open(name) as f:
+                            yield os.path.basename(name), f
+
+    def listing_rows(self):
+        """Course rows of every listing page, in order."""
+        for name, f in self.pages():
+            if not COURSE_PAGE_NAME.match(name):
+                yield from iter_listing(f)
+
+    def course_pages(self):
+        """(code, content) of every saved course page, in order."""
+        for name, f in self.pages():
+            match = COURSE_PAGE_NAME.match(name)
+            if match:
+                yield match.group(1).upper(), f.read()
+
+
+class Checkpoint:
+    """How far an import of one snapshot got: pages handled and the stats so far, in a JSON file.
+
+    Written atomically after each committed batch, so a resumed import redoes at most one batch
+    (which save_subjects treats as already imported).
+    """
+
+    def __init__(self, path, source, signature):
+        self.path = path
+        self.source = source
+        self.signature = signature
+        self.pages_done = 0
+        self.finished = False
+        self.stats = {}
+
+    def load(self):
+        """Pick up a previous run of the same snapshot; returns False if there is none to resume."""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if (saved.get('source'), saved.get('signature')) != (self.source, self.signature):
+            return False
+        self.pages_done = saved['pages_done']
+        self.finished = saved['finished']
+        self.stats = saved['stats']
+        return True
+
+    def save(self, stats):
+        self.stats = vars(stats).copy()
+        write_atomic(self.path, json.dumps({'source': self.source, 'signature': self.signature,
+                                            'pages_done': self.pages_done, 'finished': self.finished,
+                                            'stats': self.stats}))
+
+
+def _ignore_interrupts():
+    # Ctrl-C reaches the whole process group; only the importing process should act on it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _parse_or_none(parse, content):
+    # A page the parser cannot read is reported back rather than raised, so one malformed page
+    # cannot stop (and on every resume, stop again) the whole import
+    try:
+        return parse(content)
+    except Exception:
+        return None
+
+
+def import_snapshot(path, checkpoint_path, parse=parse_course_page, base_url=DEFAULT_BASE_URL, workers=None,
+                    batch_size=500, update=False, on_batch=None):
+    """Import the subjects of a snapshot of listing and course pages, without touching the network.
+
+    Course pages are parsed `batch_size` at a time across a pool of `workers` processes (one
+    batch ahead of the database writes) and saved with save_subjects. Courses listed without
+    a saved page, or whose page fails to parse, are imported from their listing row alone, as
+    when a crawl fails. Progress is checkpointed to `checkpoint_path` after every batch; running
+    the import again resumes it, and once finished returns the stats of the completed run without importing anything.
+    `parse` must be picklable (a module-level function or a functools.partial of one).
+    """
+    snapshot = Snapshot(path)
+    checkpoint = Checkpoint(checkpoint_path, snapshot.path, snapshot.signature())
+    stats = ImportStats()
+    if checkpoint.load():
+        vars(stats).update(checkpoint.stats)
+        if checkpoint.finished:
+            return stats
+
+    listing = {}
+    for row in snapshot.listing_rows():
+        listing[row['code']] = row
+    stats.pages_total = len(listing)
+
+    def subject_rows(pages, results):
+        now = datetime.now()
+        rows = []
+        for (code, content), details in zip(pages, results):
+            stats.pages_fetched += 1
+            if details is None:
+                stats.pages_failed += 1
+                rows.append(dict(listing[code], url=course_url(code, base_url)))
+                continue
+            stats.pages_parsed += 1
+            rows.append(dict(listing[code], **subject_details(details), url=course_url(code, base_url),
+                             content_hash=fingerprint(content), fetched_at=now, links=subject_links(details)))
+        return rows
+
+    # Only pages of listed courses; those a previous run already saved are read but not parsed again
+    pages = ((code, content) for code, content in snapshot.course_pages() if code in listing)
+    seen = set()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_ignore_interrupts) as executor:
+        in_flight = deque()
+        batches = chunks(pages, batch_size)
+        position = 0
+        while True:
+            # Keep one batch parsing while the previous one is written
+            while len(in_flight) < 2:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                start, position = position, position + len(batch)
+                seen.update(code for code, _ in batch)
+                if position <= checkpoint.pages_done:
+                    continue
+                batch = batch[max(0, checkpoint.pages_done - start):]
+                chunksize = max(1, len(batch) // ((workers or os.cpu_count() or 1) * 4))
+                in_flight.append((batch, position, executor.map(functools.partial(_parse_or_none, parse),
+                                                                [content for _, content in batch],
+                                                                chunksize=chunksize)))
+            if not in_flight:
+                break
+            batch, position_after, results = in_flight.popleft()
+            try:
+                rows = subject_rows(batch, results)
+            except (KeyboardInterrupt, SystemExit):
+                # Interrupted: drop queued pages rather than finish parsing them
+                executor.shutdown(cancel_futures=True)
+                raise
+            save_subjects(rows, update=update, batch_size=batch_size, stats=stats)
+            checkpoint.pages_done = position_after
+            checkpoint.save(stats)
+            if on_batch:
+                on_batch(stats)
+
+    # Listed courses with no saved page; existing subjects keep the details they have
+    missing = [dict(row, url=course_url(code, base_url)) for code, row in listing.items() if code not in seen]
+    stats.pages_failed += len(missing)
+    for batch in chunks(missing, batch_size):
+        save_subjects(batch, update=update, batch_size=batch_size, stats=stats)
+    checkpoint.finished = True
+    checkpoint.save(stats)
+    return stats
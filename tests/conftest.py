@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app reads its configuration at import time
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['CRAWLER_CACHE_DIR'] = ''
+
+
+@pytest.fixture
+def db():
+    """The app's database, with fresh tables, inside an app context."""
+    from app import app, db
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield db
+        db.session.remove()
@@ -0,0 +1,150 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from crawler import Crawler, CrawlCache
+
+
+class LocalDRPS:
+    """Course pages served from a local thread, with scripted failures and a log of every request."""
+
+    def __init__(self):
+        self.pages = {}  # path -> body
+        self.failures = {}  # path -> 503 responses to send before the page
+        self.etags = {}  # path -> ETag sent with the page, and matched against If-None-Match
+        self.delay = 0.0
+        self.requests = []  # (path, monotonic time)
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.lock = threading.Lock()
+        drps = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with drps.lock:
+                    drps.requests.append((self.path, time.monotonic()))
+                    drps.in_flight += 1
+                    drps.most_in_flight = max(drps.most_in_flight, drps.in_flight)
+                    failing = drps.failures.get(self.path, 0)
+                    if failing:
+                        drps.failures[self.path] = failing - 1
+                time.sleep(drps.delay)
+                with drps.lock:
+                    drps.in_flight -= 1
+                body = drps.pages.get(self.path)
+                if failing or body is None:
+                    self.send_response(503 if failing else 404)
+                    self.end_headers()
+                    return
+                etag = drps.etags.get(self.path)
+                if etag and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                if etag:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def drps():
+    server = LocalDRPS()
+    yield server
+    server.close()
+
+
+def test_fetch_many_fetches_concurrently(drps):
+    urls = [f"{drps.base_url}/cx{i}.htm" for i in range(8)]
+    for i in range(8):
+        drps.pages[f"/cx{i}.htm"] = f"page {i}".encode()
+    drps.delay = 0.2
+    crawler = Crawler(max_workers=8, rate_limit=0)
+
+    start = time.monotonic()
+    results = dict(crawler.fetch_many(urls))
+    assert results == {url: f"page {i}".encode() for i, url in enumerate(urls)}
+    assert drps.most_in_flight > 1
+    assert time.monotonic() - start < 8 * drps.delay
+
+
+def test_failed_responses_are_retried_with_backoff(drps):
+    drps.pages['/cx1.htm'] = b'page'
+    drps.failures['/cx1.htm'] = 2
+    crawler = Crawler(rate_limit=0, retries=3, backoff=0.1)
+
+    assert crawler.fetch(f"{drps.base_url}/cx1.htm") == b'page'
+    times = [at for _, at in drps.requests]
+    assert len(times) == 3 and crawler.counters['retries'] == 2
+    # 0.1s before the first retry, 0.2s before the second
+    assert times[1] - times[0] >= 0.1 and times[2] - times[1] >= 0.2
+
+
+def test_gives_up_after_the_last_retry(drps):
+    drps.failures['/cx1.htm'] = 10
+    crawler = Crawler(rate_limit=0, retries=2, backoff=0)
+    assert crawler.fetch(f"{drps.base_url}/cx1.htm") is None
+    assert len(drps.requests) == 3
+
+
+def test_requests_and_retries_keep_to_the_host_rate_limit(drps):
+    for i in range(4):
+        drps.pages[f"/cx{i}.htm"] = b'page'
+    drps.failures['/cx0.htm'] = 2
+    crawler = Crawler(max_workers=4, rate_limit=10, retries=3, backoff=0)
+
+    list(crawler.fetch_many([f"{drps.base_url}/cx{i}.htm" for i in range(4)]))
+    times = sorted(at for _, at in drps.requests)
+    assert len(times) == 6
+    # Six requests, retries included, at most ten a second (less a little for the server's scheduling)
+    assert times[-1] - times[0] >= 0.45
+
+
+def test_fresh_cached_pages_are_not_fetched_again(drps, tmp_path):
+    drps.pages['/cx1.htm'] = b'page'
+    crawler = Crawler(rate_limit=0, cache=CrawlCache(str(tmp_path), ttl=3600))
+    url = f"{drps.base_url}/cx1.htm"
+
+    assert crawler.fetch(url) == b'page'
+    assert crawler.fetch(url) == b'page'
+    assert len(drps.requests) == 1
+    assert (crawler.counters['cache_misses'], crawler.counters['cache_hits']) == (1, 1)
+
+
+def test_stale_pages_are_revalidated_with_a_conditional_get(drps, tmp_path):
+    drps.pages['/cx1.htm'] = b'page'
+    drps.etags['/cx1.htm'] = '"v1"'
+    crawler = Crawler(rate_limit=0, cache=CrawlCache(str(tmp_path), ttl=0))
+    url = f"{drps.base_url}/cx1.htm"
+
+    assert crawler.fetch(url) == b'page'
+    drps.pages['/cx1.htm'] = b'not sent: the ETag still matches'
+    assert crawler.fetch(url) == b'page'
+    assert len(drps.requests) == 2
+    assert (crawler.counters['cache_misses'], crawler.counters['cache_revalidated']) == (1, 1)
+
+
+def test_a_stale_copy_is_served_when_the_fetch_fails(drps, tmp_path):
+    drps.pages['/cx1.htm'] = b'page'
+    crawler = Crawler(rate_limit=0, retries=0, cache=CrawlCache(str(tmp_path), ttl=0))
+    url = f"{drps.base_url}/cx1.htm"
+
+    assert crawler.fetch(url) == b'page'
+    drps.failures['/cx1.htm'] = 1
+    assert crawler.fetch(url) == b'page'
+    assert crawler.counters['cache_stale'] == 1
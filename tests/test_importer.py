@@ -0,0 +1,62 @@
+from collections import Counter
+
+from catalogue import catalogue_stamp
+from importer import crawl_subjects, save_subjects
+from models import Subject
+
+BASE_URL = 'http://drps.example/'
+LISTING = [{'code': 'INFR08025', 'name': 'Informatics 1', 'period': 'Semester 1', 'credits': 20,
+            'scqf': '8', 'availability': 'SV1'}]
+
+
+class StubCrawler:
+    """Serves course pages from a dict; a missing page is a failed fetch."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.counters = Counter()
+
+    def fetch_many(self, urls, revalidate=False, window=None):
+        for url in urls:
+            yield url, self.pages.get(url)
+
+    def parse(self, body, parse, version):
+        return parse(body)
+
+
+def parse(body):
+    return {'school': 'School of Informatics', 'summary': body.decode()} if body else {}
+
+
+def test_update_import_keeps_details_when_fetch_fails(db):
+    url = BASE_URL + 'cxinfr08025.htm'
+    save_subjects(crawl_subjects(LISTING, StubCrawler({url: b'An introduction'}), BASE_URL, parse))
+    before = db.session.execute(db.select(Subject.summary, Subject.school, Subject.content_hash)).one()
+
+    # The course page 404s, but the listing renamed the course
+    renamed = [dict(LISTING[0], name='Introduction to Informatics')]
+    stats = save_subjects(crawl_subjects(renamed, StubCrawler({}), BASE_URL, parse), update=True)
+
+    subject = db.session.execute(db.select(Subject)).scalar_one()
+    assert stats.subjects_updated == 1
+    assert subject.name == 'Introduction to Informatics'
+    assert (subject.summary, subject.school, subject.content_hash) == tuple(before)
+    assert before.summary == 'An introduction' and before.content_hash
+
+
+def test_update_import_with_failed_fetch_and_same_listing_is_unchanged(db):
+    url = BASE_URL + 'cxinfr08025.htm'
+    save_subjects(crawl_subjects(LISTING, StubCrawler({url: b'An introduction'}), BASE_URL, parse))
+    stats = save_subjects(crawl_subjects(LISTING, StubCrawler({}), BASE_URL, parse), update=True)
+    assert (stats.subjects_updated, stats.subjects_unchanged) == (0, 1)
+    assert db.session.execute(db.select(Subject.summary)).scalar_one() == 'An introduction'
+
+
+def test_update_import_with_failed_fetch_changes_catalogue_stamp(db):
+    url = BASE_URL + 'cxinfr08025.htm'
+    save_subjects(crawl_subjects(LISTING, StubCrawler({url: b'An introduction'}), BASE_URL, parse))
+    before = catalogue_stamp()
+
+    renamed = [dict(LISTING[0], name='Introduction to Informatics')]
+    save_subjects(crawl_subjects(renamed, StubCrawler({}), BASE_URL, parse), update=True)
+    assert catalogue_stamp() != before
@@ -0,0 +1,57 @@
+import time
+
+import jobs
+from jobs import claim_next_job, enqueue_import, run_job
+from models import ImportJob
+
+
+def failing_pipeline(content, stats, on_progress, update):
+    raise ValueError('not a listing')
+
+
+def test_finished_jobs_drop_their_payload(db):
+    enqueue_import(b'<html>listing</html>', filename='listing.html')
+    enqueue_import(b'<html>broken</html>', filename='broken.html')
+
+    run_job(claim_next_job('test'), lambda content, stats, on_progress, update: stats)
+    run_job(claim_next_job('test'), failing_pipeline)
+
+    jobs = db.session.execute(db.select(ImportJob.status, ImportJob.payload).order_by(ImportJob.id)).all()
+    assert [tuple(job) for job in jobs] == [('done', b''), ('failed', b'')]
+
+
+def test_heartbeat_renews_lease_during_silent_phases(db, monkeypatch):
+    monkeypatch.setattr(jobs, 'HEARTBEAT_INTERVAL', 0.05)
+    enqueue_import(b'<html>listing</html>')
+    job = claim_next_job('test')
+    claimed_at = job.heartbeat_at
+    beats = []
+
+    def silent_pipeline(content, stats, on_progress, update):
+        time.sleep(0.5)
+        db.session.expire_all()
+        beats.append(db.session.get(ImportJob, job.id).heartbeat_at)
+        db.session.rollback()
+
+    run_job(job, silent_pipeline)
+    assert beats[0] > claimed_at
+
+
+def test_reclaimed_job_keeps_the_new_workers_outcome(db):
+    enqueue_import(b'<html>listing</html>')
+    job = claim_next_job('first')
+
+    def reclaimed_pipeline(content, stats, on_progress, update):
+        # Another worker takes over the job and finishes it while this one is still running
+        db.session.execute(db.update(ImportJob).values(worker='second', status='done', subjects_inserted=7))
+        db.session.commit()
+        on_progress(stats)
+
+    run_job(job, reclaimed_pipeline)
+    assert (job.worker, job.status, job.subjects_inserted) == ('second', 'done', 7)
+
+
+def test_failed_job_reports_the_error_message_only(db):
+    enqueue_import(b'<html>broken</html>')
+    job = run_job(claim_next_job('test'), failing_pipeline)
+    assert job.to_dict()['error'] == 'ValueError: not a listing'
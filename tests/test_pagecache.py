@@ -0,0 +1,36 @@
+from flask import Flask
+
+from pagecache import MemoryBackend, PageCache
+
+
+def worker(reviews):
+    """One web worker: its own app and in-memory page cache, serving a page of `reviews`."""
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    cache = PageCache(MemoryBackend(), ttl=60)
+
+    @app.route('/subject')
+    @cache.cached(tags=lambda: ['subject:1'])
+    def subject():
+        return ', '.join(reviews)
+
+    @app.route('/review', methods=['POST'])
+    def review():
+        reviews.append('new review')
+        cache.invalidate('subject:1')
+        return ''
+
+    return app.test_client()
+
+
+def test_writer_skips_other_workers_cached_pages():
+    reviews = ['old review']
+    a, b = worker(reviews), worker(reviews)
+    assert b.get('/subject').text == 'old review'
+
+    a.post('/review')
+    # Worker b still holds the page from before the write, which other clients keep seeing
+    assert b.get('/subject').text == 'old review'
+    # but not the client that wrote, whichever worker serves it
+    b.set_cookie('session', a.get_cookie('session').value)
+    assert b.get('/subject').text == 'old review, new review'
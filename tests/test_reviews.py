@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta, timezone
+
+from models import Review, Subject, User
+from reviews import ingest_reviews
+
+
+def add_user_and_subjects(db, count):
+    db.session.add(User(username='reader', email='reader@example.com', password='x'))
+    for i in range(count):
+        db.session.add(Subject(code=f'INFR0802{i}', name=f'Informatics {i}', url=f'http://drps.example/{i}'))
+    db.session.commit()
+    return db.session.scalar(db.select(User.id))
+
+
+def test_created_at_is_ignored_unless_kept(db):
+    user_id = add_user_and_subjects(db, 1)
+    before = datetime.now()
+    stats = ingest_reviews([{'subject_code': 'INFR08020', 'rating': 5, 'created_at': '2999-01-01T00:00:00'}],
+                           user_id=user_id)
+    assert stats.inserted == 1
+    assert before <= db.session.scalar(db.select(Review.created_at)) <= datetime.now()
+
+
+def test_kept_created_at_must_be_past_and_is_stored_naive(db):
+    add_user_and_subjects(db, 2)
+    aware = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+    future = (datetime.now() + timedelta(days=1)).isoformat()
+    stats = ingest_reviews([
+        {'username': 'reader', 'subject_code': 'INFR08020', 'rating': 4, 'created_at': aware.isoformat()},
+        {'username': 'reader', 'subject_code': 'INFR08021', 'rating': 4, 'created_at': future},
+    ], keep_created_at=True)
+
+    assert stats.inserted == 1
+    assert stats.errors == [(1, "'created_at' must not be in the future.")]
+    stored = db.session.scalar(db.select(Review.created_at))
+    assert stored.tzinfo is None
+    assert stored == aware.astimezone().replace(tzinfo=None)
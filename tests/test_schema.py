@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from models import Review, Subject, User
+from schema import upgrade_schema
+
+
+def test_upgrade_schema_adds_missing_columns_and_indexes(db):
+    db.session.add(User(id=1, username='ann', email='ann@example.com', password='x'))
+    db.session.add(Subject(id=1, name='Algorithms', code='INFR10001', url='http://drps.example/cxinfr10001.htm'))
+    db.session.add(Review(user_id=1, subject_id=1, rating=4))
+    db.session.commit()
+    # The review table and rating aggregates as they were before the review indexes and aggregates
+    db.session.execute(db.text("DROP INDEX ix_review_subject_id_created_at"))
+    db.session.execute(db.text("DROP INDEX ix_subject_review_count"))
+    for column in ('review_count', 'rating_sum', 'rating_4'):
+        db.session.execute(db.text(f"ALTER TABLE subject DROP COLUMN {column}"))
+    db.session.commit()
+
+    changes = upgrade_schema()
+    assert "Created index ix_review_subject_id_created_at." in changes
+    assert "Added column subject.review_count." in changes
+    subject = db.session.get(Subject, 1)
+    assert (subject.review_count, subject.rating_sum, subject.rating_4) == (1, 4, 1)
+    assert upgrade_schema() == []
+
+
+def test_upgrade_schema_removes_duplicate_reviews_before_the_unique_constraint(db):
+    # The review table as it was, with nothing stopping a user reviewing a subject twice
+    Review.__table__.drop(db.engine)
+    db.session.execute(db.text("CREATE TABLE review (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+                               "subject_id INTEGER NOT NULL, rating INTEGER NOT NULL, comment TEXT, created_at DATETIME)"))
+    db.session.add_all([User(id=1, username='ann', email='ann@example.com', password='x'),
+                        User(id=2, username='bob', email='bob@example.com', password='x')])
+    db.session.add(Subject(id=1, name='Algorithms', code='INFR10001', url='http://drps.example/cxinfr10001.htm'))
+    db.session.execute(db.insert(Review), [
+        {'user_id': 1, 'subject_id': 1, 'rating': 1, 'created_at': datetime(2024, 1, 1)},
+        {'user_id': 1, 'subject_id': 1, 'rating': 5, 'created_at': datetime(2024, 3, 1)},
+        {'user_id': 1, 'subject_id': 1, 'rating': 2, 'created_at': datetime(2024, 2, 1)},
+        {'user_id': 2, 'subject_id': 1, 'rating': 3, 'created_at': datetime(2024, 1, 1)},
+    ])
+    db.session.commit()
+
+    changes = upgrade_schema()
+    assert "Removed 2 review rows breaking uq_review_user_id_subject_id." in changes
+    # Each user's latest review stays, and the aggregates count only those
+    assert db.session.execute(db.select(Review.user_id, Review.rating).order_by(Review.user_id)).all() == [(1, 5), (2, 3)]
+    subject = db.session.get(Subject, 1)
+    assert (subject.review_count, subject.rating_sum) == (2, 8)
+    db.session.add(Review(user_id=2, subject_id=1, rating=4))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
@@ -0,0 +1,49 @@
+import random
+from collections import namedtuple
+
+import pytest
+
+import search
+from search import InvertedIndex, tokenize
+
+Row = namedtuple('Row', 'id name code keywords summary learning_outcomes')
+
+SYLLABLES = ['al', 'go', 'ri', 'da', 'ta', 'com', 'pu', 'sci', 'net', 'sys', 'lo', 'gic', 'ma', 'law', 'art', 'so']
+
+
+def corpus(count, seed=0):
+    """Subjects over a small vocabulary, so that terms share prefixes and match many subjects."""
+    rng = random.Random(seed)
+    words = sorted({''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3))) for _ in range(300)})
+    weights = [1.0 / (rank + 1) for rank in range(len(words))]
+
+    def text(n):
+        return ' '.join(rng.choices(words, weights, k=n))
+
+    rows = [Row(i, f"{text(rng.randint(1, 4))} {i}", f"TEST{i:05d}", text(3), text(20), text(10))
+            for i in range(1, count + 1)]
+    return rows, words
+
+
+def brute_force(index, query, limit):
+    """Every subject scored with every query term, ranked as InvertedIndex.search ranks them."""
+    terms = list(dict.fromkeys(tokenize(query)))
+    scores = {}
+    for subject_id in index.forward:
+        term_scores = [index._term_score(subject_id, term) for term in terms]
+        if all(term_scores):
+            scores[subject_id] = sum(term_scores)
+    return sorted(scores, key=lambda subject_id: (-scores[subject_id], index.names[subject_id]))[:limit]
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_search_matches_brute_force_ranking(monkeypatch, seed):
+    # Lower the cheap postings threshold so that this corpus skips terms in the higher tiers too
+    monkeypatch.setattr(search, 'CHEAP_POSTINGS', 40)
+    rows, words = corpus(1500, seed)
+    index = InvertedIndex(rows)
+    rng = random.Random(seed)
+    for _ in range(100):
+        query = ' '.join(rng.choice(words)[:rng.randint(2, 5)] for _ in range(rng.randint(1, 3)))
+        ranked = [subject_id for subject_id, _, _ in index.search(query, limit=10)]
+        assert ranked == brute_force(index, query, 10), query
@@ -0,0 +1,26 @@
+from models import Subject
+from similarity import similarity_stamp, update_similar_subjects
+
+SUBJECTS = [
+    ('INFR08025', 'Introduction to Algorithms', 'algorithms data structures'),
+    ('INFR08026', 'Advanced Algorithms', 'algorithms complexity'),
+    ('HIST08001', 'Medieval History', 'history europe'),
+    ('HIST08002', 'Modern History', 'history politics'),
+    ('MATH08001', 'Calculus', 'limits integrals'),
+]
+
+
+def test_similarity_stamp_moves_when_lists_are_rewritten(db):
+    for code, name, keywords in SUBJECTS:
+        db.session.add(Subject(code=code, name=name, keywords=keywords, url=f'http://drps.example/{code}'))
+    db.session.commit()
+    empty = similarity_stamp()
+    assert update_similar_subjects(k=2)
+    built = similarity_stamp()
+    assert built != empty
+
+    # Another process changes a subject and updates the lists; this one only sees the database
+    db.session.execute(db.update(Subject).where(Subject.code == 'HIST08002').values(keywords='algorithms history'))
+    db.session.commit()
+    assert update_similar_subjects(k=2)
+    assert similarity_stamp() != built
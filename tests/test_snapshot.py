@@ -0,0 +1,48 @@
+from models import Subject
+from snapshot import import_snapshot
+
+
+def listing_page(*rows):
+    cells = ''.join(f'<tr><td>{code}</td><td>SV1</td><td>{name}</td><td>Semester 1</td><td>20</td></tr>'
+                    for code, name in rows)
+    return ('<h3 class="scqf_level">SCQF Level 8</h3>'
+            '<table><tr><td>Code</td><td>Availability</td><td>Name</td><td>Period</td><td>Credits</td></tr>'
+            f'{cells}</table>')
+
+
+def parse(body):
+    if b'malformed' in body:
+        raise IndexError('list index out of range')
+    return {'school': 'School of Informatics', 'summary': body.decode()}
+
+
+def write_snapshot(directory, listing, pages):
+    (directory / 'listing.htm').write_text(listing)
+    for code, body in pages.items():
+        (directory / f'cx{code.lower()}.htm').write_bytes(body)
+
+
+def test_page_that_fails_to_parse_falls_back_to_listing_row(db, tmp_path):
+    snapshot = tmp_path / 'snapshot'
+    snapshot.mkdir()
+    write_snapshot(snapshot, listing_page(('INFR08025', 'Informatics 1'), ('INFR08026', 'Informatics 2')),
+                   {'INFR08025': b'An introduction', 'INFR08026': b'malformed'})
+
+    stats = import_snapshot(snapshot, tmp_path / 'checkpoint.json', parse=parse, workers=1)
+
+    assert (stats.pages_parsed, stats.pages_failed, stats.subjects_inserted) == (1, 1, 2)
+    subjects = dict(db.session.execute(db.select(Subject.code, Subject.summary)).all())
+    assert subjects == {'INFR08025': 'An introduction', 'INFR08026': None}
+
+
+def test_update_rewrites_listing_of_courses_without_a_saved_page(db, tmp_path):
+    snapshot = tmp_path / 'snapshot'
+    snapshot.mkdir()
+    write_snapshot(snapshot, listing_page(('INFR08025', 'Informatics 1')), {})
+    import_snapshot(snapshot, tmp_path / 'first.json', parse=parse, workers=1)
+
+    write_snapshot(snapshot, listing_page(('INFR08025', 'Introduction to Informatics')), {})
+    stats = import_snapshot(snapshot, tmp_path / 'second.json', parse=parse, workers=1, update=True)
+
+    assert stats.subjects_updated == 1
+    assert db.session.execute(db.select(Subject.name)).scalar_one() == 'Introduction to Informatics'